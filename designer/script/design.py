@@ -3,8 +3,8 @@ import copy
 from typing import TypedDict, Sequence
 
 from optimizer.adam import AdamOptimizer, AdamThicknessOptimizer
+from optimizer.LM_optimizer import LMOptimizer
 import optimizer.needle_insert as insert
-import optimizer.archive.LM_gradient_descent as LM_gd
 from optimizer.archive.adam_d import adam_optimize
 from film import TwoMaterialFilm, BaseFilm, FreeFormFilm
 from spectrum import SpectrumSimple, BaseSpectrum
@@ -86,12 +86,17 @@ class NeedleDesign(BaseDesign):
         for i in range(needle_epoch):
             # LM gradient descent
             try:
-                step_count = LM_gd.LM_optimize_d_simple(
+                optimizer = LMOptimizer(
                     self.film,
-                    self.target_specs,
-                    error,
-                    max_step
+                    list(self.target_specs),
+                    max_step,
+                    h_tol=error,
                 )
+                optimizer.optimize()
+                step_count = optimizer.i + 1
+                self.film.remove_negative_thickness_layer()
+                if self.film.get_layer_number() == 0:
+                    raise Exception('Design terminated: zero layers')
                 if show:
                     print(f'{i}-th iteration, loss: {self.calculate_loss()},',
                           f'{step_count} gd steps')
@@ -105,7 +110,7 @@ class NeedleDesign(BaseDesign):
             if record:
                 self.training_info.append({
                     'loss': self.calculate_loss(),
-                    'film': copy.deepcopy(self.film),
+                    'film': self.film.snapshot(),
                     'step': step_count,  # gd steps in this needle iteration
                 })
                 if show:
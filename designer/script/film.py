@@ -1,66 +1,354 @@
 import numpy as np
 from numpy.typing import NDArray
 import copy
-import utils.get_n as get_n
+from utils.dispersion import calculate_n, grid_digest
+from utils.materials import Material, get_material
 from spectrum import SpectrumSimple
 from abc import ABC, abstractmethod
 from typing import Callable
-import tmm.get_spectrum as get_spectrum
+
+
+def _read_only(arr):
+    view = arr.view()
+    view.flags.writeable = False
+    return view
+
+
+def _spec_key(inc_ang, wls):
+    '''Key of a spectrum in BaseFilm._spec_index'''
+    return (float(inc_ang), grid_digest(wls))
+
+
+def _small_uint(n):
+    '''Smallest unsigned int dtype that can index n materials'''
+    for dtype in ['uint8', 'uint16']:
+        if n <= np.iinfo(dtype).max + 1:
+            return np.dtype(dtype)
+    return np.dtype('uint32')
+
+
+def _merge_runs(d, material_idx):
+    '''
+    Merge runs of adjacent layers of the same material into one layer.
+
+    Returns:
+        d, material_idx of the merged layers
+    '''
+    if d.shape[0] == 0:
+        return d, material_idx
+    starts = np.flatnonzero(
+        np.r_[True, material_idx[1:] != material_idx[:-1]])
+    return np.add.reduceat(d, starts), material_idx[starts]
+
+
+class FilmCore:
+    '''
+    Compact layer data of a film as a struct of arrays: the thickness and
+    the material id of every layer, and a small table of the distinct
+    materials. Beyond the thicknesses this takes 1 byte per layer (2 bytes
+    with more than 256 materials), and looking up the material of a layer
+    is O(1).
+
+    material_idx and materials are never modified in place: the bulk
+    operations return new cores, which may share them with this one.
+
+    Attributes:
+        d (1d NDArray): float64 thicknesses
+        material_idx (1d NDArray): read-only small uint, row of materials
+            of every layer
+        materials (tuple of Material): distinct materials
+    '''
+    __slots__ = ('d', 'material_idx', 'materials')
+
+    def __init__(self, d, material_idx, materials):
+        self.d = np.array(d, dtype='float64')
+        self.materials = tuple(materials)
+        dtype = _small_uint(len(self.materials))
+        if isinstance(material_idx, np.ndarray) and \
+                material_idx.dtype == dtype and not material_idx.flags.writeable:
+            # read-only: shared, e.g. with the core this one is copied from
+            self.material_idx = material_idx
+        else:
+            self.material_idx = np.array(material_idx, dtype=dtype)
+            self.material_idx.flags.writeable = False
+        assert self.d.shape == self.material_idx.shape, \
+            'one material per layer'
+
+    @classmethod
+    def from_layers(cls, d, layer_materials):
+        '''
+        Core of layers made of layer_materials (names, numbers or Material,
+        see utils.materials.get_material). Equal materials share a row of
+        the table, in order of first appearance.
+        '''
+        rows = {}  # by the given spec, to look up each name only once
+        materials = []
+        material_idx = np.empty(len(layer_materials), dtype='uint32')
+        for i, spec in enumerate(layer_materials):
+            if spec not in rows:
+                material = get_material(spec)
+                if material not in materials:
+                    materials.append(material)
+                rows[spec] = materials.index(material)
+            material_idx[i] = rows[spec]
+        return cls(d, material_idx, materials)
+
+    def get_layer_number(self):
+        return self.d.shape[0]
+
+    def layer_material(self, i):
+        return self.materials[self.material_idx[i]]
+
+    def layer_materials(self):
+        '''1d object NDArray, the Material of every layer'''
+        table = np.empty(len(self.materials), dtype=object)
+        table[:] = self.materials
+        return table[self.material_idx]
+
+    def n_table(self, wls):
+        '''wls number * material number refractive indices'''
+        n_table = np.empty(
+            (wls.shape[0], len(self.materials)), dtype='complex128')
+        for i, material in enumerate(self.materials):
+            n_table[:, i] = calculate_n(material, wls)
+        return n_table
+
+    def n_array(self, wls):
+        '''wls number * layer number refractive indices'''
+        return self.n_table(wls)[:, self.material_idx]
+
+    # bulk operations. All return a new core
+
+    def copy(self):
+        '''Copies d, shares the material ids and the table'''
+        return FilmCore(self.d, self.material_idx, self.materials)
+
+    def _compacted(self):
+        # drop materials no layer is made of any more
+        used = np.zeros(len(self.materials), dtype=bool)
+        used[self.material_idx] = True
+        if used.all():
+            return self
+        rows = np.cumsum(used) - 1
+        return FilmCore(
+            self.d,
+            rows[self.material_idx],
+            [m for m, u in zip(self.materials, used) if u]
+        )
+
+    def delete(self, indices):
+        '''Remove the layers at indices (see np.delete)'''
+        return FilmCore(
+            np.delete(self.d, indices),
+            np.delete(self.material_idx, indices),
+            self.materials
+        )._compacted()
+
+    def select(self, keep):
+        '''Keep the layers where the boolean mask keep is True'''
+        return FilmCore(
+            self.d[keep], self.material_idx[keep], self.materials
+        )._compacted()
+
+    def merged(self):
+        '''Merge adjacent layers of the same material'''
+        d, material_idx = _merge_runs(self.d, self.material_idx)
+        return FilmCore(d, material_idx, self.materials)
+
+    def insert(self, indices, d, layer_materials):
+        '''
+        Insert layers of thicknesses d made of layer_materials before
+        indices (see np.insert).
+        '''
+        materials = list(self.materials)
+        rows = []
+        for material in layer_materials:
+            material = get_material(material)
+            if material not in materials:
+                materials.append(material)
+            rows.append(materials.index(material))
+        return FilmCore(
+            np.insert(self.d, indices, d),
+            np.insert(self.material_idx.astype('uint32'), indices, rows),
+            materials
+        )
+
+
+class FilmSnapshot:
+    '''
+    State of a film at one point in time, e.g. an optimizer step. See
+    BaseFilm.snapshot.
+
+    Only the parameter vectors (d, n) are copied. Everything else is
+    referenced: materials are immutable and replaced rather than modified by
+    the films, and the spectra are kept as (INC_ANG, WLS) pairs only. So a
+    snapshot costs O(layer number) bytes and no traversal of the film's
+    object graph.
+
+    to_film rebuilds a full film. Attributes and methods not defined here
+    (e.g. get_spec, calculate_n_array) are looked up on a film rebuilt on
+    first use, so a snapshot can stand in for a deep copy.
+    '''
+    __slots__ = ('film_type', 'state', 'params', 'spec_params', '_film')
+
+    def __init__(self, film):
+        self.film_type = type(film)
+        self.params = film._params()
+        self.state = {
+            k: v for k, v in vars(film).items()
+            if k not in self.params
+            and k not in ('spectra', '_spec_idx', '_version')
+        }
+        # the only container films modify in place
+        self.state['materials'] = dict(self.state['materials'])
+        self.spec_params = [(s.INC_ANG, s.WLS) for s in film.spectra]
+        self._film = None
+
+    def to_film(self):
+        '''A new film in the recorded state'''
+        film = self.film_type.__new__(self.film_type)
+        film.__dict__.update(self.state)
+        film.materials = dict(self.state['materials'])
+        film._version = 0
+        # copies: the film may be modified, the snapshot may not
+        for k, v in self.params.items():
+            setattr(film, k, v.copy())
+        film.spectra = []
+        for inc_ang, wls in self.spec_params:
+            film.add_spec_param(inc_ang, wls)
+        return film
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._film is None:
+            self._film = self.to_film()
+        return getattr(self._film, name)
+
+    def _param(self, name):
+        if name in self.params:
+            return _read_only(self.params[name])
+        raise AttributeError(
+            f'{self.film_type.__name__} snapshot has no parameter {name}')
+
+    def get_d(self):
+        if '_core' in self.params:
+            return _read_only(self.params['_core'].d)
+        return self._param('d')
+
+    def get_n(self):
+        return self._param('n')
+
+    def get_layer_number(self):
+        return self.get_d().shape[0]
 
 
 class BaseFilm(ABC):
     d: NDArray
     spectra: list[SpectrumSimple]
+    # names of the tmm engines this film needs. See tmm.engines.warmup
+    ENGINES: tuple[str, ...] = ()
+    # whether spectra are calculated by the indexed engines
+    # (calculate_n_table + get_material_idx) or from calculate_n_array
+    INDEXED = False
 
     def __init__(self, substrate, incidence):
+        # bumped by every change of the structure or the materials, see
+        # get_version
+        self._version = 0
         self.materials = {}
         self._register_get_n('sub', substrate)
         self._register_get_n('inc', incidence)
+        # coherent semi-infinite substrate by default.
+        # See set_incoherent_substrate
+        self.sub_thickness = None
 
-    def _register_get_n(self, name: str, material) -> Callable:
-        if type(material) is str or type(material) is np.str_:
-            try:
-                exec(f"self.get_n_{name} = get_n.get_n_{material}")
-                self.materials[name] = material
-            except:
-                raise ValueError(
-                    "Material not found. \
-                    Dispersion must have been defined in gets.get_n")
-        elif type(float(material)) is float:
-            exec(
-                f"self.get_n_{name} = lambda wl: wl * {material} / wl")
-            self.materials[name] = material
-        else:
-            raise ValueError(
-                'bad material. should be either name defined in utils.get_n or a float')
-        
-        return getattr(self, f'get_n_{name}')
+    def _register_get_n(self, name: str, material) -> Material:
+        '''
+        Look up material (a name, a number or a Material, see
+        utils.materials.MaterialRegistry.get) and store it as
+        self.materials[name] and self.get_n_{name}.
+        '''
+        material = get_material(material)
+        setattr(self, f'get_n_{name}', material)
+        self.materials[name] = material
+        self._changed()
+        return material
+
+    def _changed(self):
+        '''Call after every change of d, n or the materials'''
+        self._version = self.get_version() + 1
+        for spec in getattr(self, 'spectra', []):
+            spec.outdate()
+
+    def get_version(self):
+        '''
+        Counter of changes of this film. Spectra remember the version they
+        were calculated at and are recalculated only when it differs.
+        '''
+        return getattr(self, '_version', 0)
 
     # spectrum-related methods
 
-    def add_spec_param(self, inc_ang, wls):
+    def _spec_index(self):
+        '''
+        Index of self.spectra, rebuilt when the list was replaced or modified
+        outside of add_spec_param / remove_spec_param.
+
+        Returns:
+            specs: dict (INC_ANG, digest of WLS) -> spectrum
+            grids: dict digest -> WLS array of the first spectrum on that grid
+        '''
+        index = getattr(self, '_spec_idx', None)
+        if index is None or index[0] is not self.spectra \
+                or len(index[1]) != len(self.spectra):
+            specs, grids = {}, {}
+            for s in self.spectra:
+                key = _spec_key(s.INC_ANG, s.WLS)
+                specs.setdefault(key, s)
+                grids.setdefault(key[1], s.WLS)
+            index = self._spec_idx = (self.spectra, specs, grids)
+        return index[1], index[2]
+
+    def add_spec_param(self, inc_ang, wls, share_wls=True):
         """
         Setter of the spectrum params: wls and inc
 
+        Parameters:
+            share_wls (bool):
+                if a spectrum on an equal wavelength grid exists, the new
+                spectrum uses its WLS array instead of wls
         """
-
-        for s in self.spectra:
-            if np.array_equal(s.WLS, wls) and s.INC_ANG == inc_ang:
-                return s
+        key = _spec_key(inc_ang, wls)
+        specs, grids = self._spec_index()
+        if key in specs:
+            return specs[key]
+        if share_wls:
+            wls = grids.setdefault(key[1], wls)
         spec = SpectrumSimple(inc_ang, wls, self)
         self.spectra.append(spec)
+        specs[key] = spec
         return spec
 
     def remove_spec_param(self, inc_ang=None, wls=None):
+        '''
+        Remove the spectra at inc_ang and wls. If only one of them is given,
+        all spectra matching it are removed.
+
+        Returns:
+            number of removed spectra
+        '''
         assert wls is not None or inc_ang is not None, "Must specify which spec to del"
-        count = 0
-        for s in self.spectra:
-            if (inc_ang is None and np.array_equal(s.WLS, wls)) or \
-                (wls is None and s.INC_ANG == inc_ang) or \
-                    (np.array_equal(s.WLS, wls) == s.INC_ANG == inc_ang):
-                self.spectra.remove(s)
-                count += 1
-        return count
+        digest = None if wls is None else grid_digest(wls)
+        removed = [
+            s for (ang, grid), s in self._spec_index()[0].items()
+            if (inc_ang is None or ang == float(inc_ang))
+            and (digest is None or grid == digest)
+        ]
+        self.spectra[:] = [
+            s for s in self.spectra if not any(s is r for r in removed)]
+        self._spec_idx = None
+        return len(removed)
 
     def remove_all_spec_param(self):
         self.spectra = []
@@ -78,11 +366,7 @@ class BaseFilm(ABC):
                 raise ValueError(
                     "In the case of multiple spectrums, must specify inc_ang\
                     and wls")
-            for s in self.spectra:
-                if np.array_equal(s.WLS, wls) and s.INC_ANG == inc_ang:
-                    return s
-            # Not found, add to get_spec
-            # print("WARNING: spec not in this film's spec list. New spec added to film!")
+            # adds the spectrum if not in this film's spec list
             return self.add_spec_param(inc_ang, wls)
 
     def get_all_spec_list(self) -> list[SpectrumSimple]:
@@ -93,45 +377,167 @@ class BaseFilm(ABC):
     def calculate_n_array(self, wls: NDArray):
         raise NotImplementedError
 
+    def calculate_n_table(self, wls: NDArray):
+        '''
+        calculate n at different wl for each *material* in the film stack.
+        Used together with get_material_idx by the indexed engines.
+
+        By default every layer is its own material. Films made of a few
+        materials override this.
+
+        Returns:
+            2d NDArray, size is wls number * material number.
+        '''
+        return self.calculate_n_array(wls)
+
+    def calculate_node_n_tables(self, wls: NDArray, wl_offsets: NDArray):
+        '''
+        Refractive indices at the wavelength quadrature nodes
+        wls[i] + wl_offsets[q] of the averaging engines
+        (tmm.get_spectrum_averaged).
+
+        Returns:
+            n_table (wls number * node number * material number),
+            n_sub and n_inc (wls number * node number)
+        '''
+        shape = (wls.shape[0], wl_offsets.shape[0])
+        wls_nodes = (wls.reshape((-1, 1)) + wl_offsets.reshape((1, -1))).ravel()
+        n_table = self.calculate_n_table(wls_nodes)
+        return (
+            n_table.reshape(shape + (n_table.shape[1],)),
+            self.calculate_n_sub(wls_nodes).reshape(shape),
+            self.calculate_n_inc(wls_nodes).reshape(shape)
+        )
+
+    def get_material_idx(self):
+        '''
+        Returns:
+            1d NDArray of small unsigned ints, size is layer number.
+            Column of calculate_n_table of each layer.
+        '''
+        l = self.get_layer_number()
+        return np.arange(l, dtype=_small_uint(l))
+
     def calculate_n_sub(self, wls):
         """
         calculate n at different wl for substrate
 
         Returns:
-            1d NDArray, size is wls.shape[0]. Refractive indices
+            1d NDArray, size is wls.shape[0]. Refractive indices, read-only
+            and shared (see utils.dispersion)
         """
-        n_arr = np.empty(wls.shape[0], dtype='complex128')
-        for i in range(wls.shape[0]):
-            n_arr[i] = self.get_n_sub(wls[i])
-        return n_arr
+        return calculate_n(self.materials['sub'], wls)
 
     def calculate_n_inc(self, wls):
         """
         calculate n at different wl for incident material
 
         Returns:
-            1d NDArray, size is wls.shape[0]. Refractive indices
-
+            1d NDArray, size is wls.shape[0]. Refractive indices, read-only
+            and shared (see utils.dispersion)
         """
-        n_arr = np.empty(wls.shape[0], dtype='complex128')
-        for i in range(wls.shape[0]):
-            n_arr[i] = self.get_n_inc(wls[i])
+        return calculate_n(self.materials['inc'], wls)
+
+    # incoherent substrate related
+
+    def set_incoherent_substrate(
+        self,
+        thickness,
+        exit_medium='Air',
+        back_d=None,
+        back_materials=None
+    ):
+        '''
+        Treat the substrate as a thick slab of the given geometric thickness
+        which is passed incoherently (see tmm.incoherent), instead of a
+        semi-infinite medium. Spectra then include the reflection at the
+        back side of the substrate and come out fringe-free.
+
+        NOTE: only spectrum evaluation (SpectrumSimple.calculate) uses this
+        model. There are no gradients for it: gradient based optimizers
+        refuse films with an incoherent substrate.
+
+        Parameters:
+            thickness (float):
+                substrate thickness, in the unit of wls
+            exit_medium (str or float):
+                material behind the substrate
+            back_d (1d np.array):
+                thicknesses of an optional coating on the back side, ordered
+                from the substrate to the exit medium
+            back_materials (list of str or float):
+                materials of the back side coating
+        '''
+        self.sub_thickness = thickness
+        self._register_get_n('exit', exit_medium)
+        if back_d is None:
+            back_d, back_materials = [], []
+        back_d = np.asarray(back_d, dtype='float')
+        assert len(back_materials) == back_d.shape[0], \
+            'one material per back side layer'
+        self.back_d = back_d
+        self.get_n_back_ls = [
+            self._register_get_n(f'back_{i}', m)
+            for i, m in enumerate(back_materials)
+        ]
+        self._changed()
+
+    def remove_incoherent_substrate(self):
+        '''Go back to a semi-infinite substrate'''
+        self.sub_thickness = None
+        self._changed()
+
+    def has_incoherent_substrate(self):
+        return getattr(self, 'sub_thickness', None) is not None
+
+    def calculate_n_exit(self, wls):
+        '''
+        calculate n at different wl for the medium behind an incoherent
+        substrate
+        '''
+        return calculate_n(self.materials['exit'], wls)
+
+    def calculate_n_back_array(self, wls):
+        '''
+        Returns:
+            2d NDArray, size is wls number * back side layer number.
+        '''
+        n_arr = np.empty((wls.shape[0], self.back_d.shape[0]),
+                         dtype='complex128')
+        for i in range(self.back_d.shape[0]):
+            n_arr[:, i] = calculate_n(self.materials[f'back_{i}'], wls)
         return n_arr
 
     # Accessor functions
 
     def get_d(self):
-        return self.d
+        '''
+        Returns a read-only view of the thicknesses. Change them with
+        update_d (on a copy), so that the stored spectra are recalculated.
+        '''
+        return _read_only(self.d)
 
     def update_d(self, d):
-        self.d = np.ascontiguousarray(d)
-        for spec in self.get_all_spec_list():
-            spec.outdate()  # set the oudated flag of the stored spectrum(s)
+        # copy: the caller may keep modifying its array in place
+        self.d = np.array(d)
+        self._changed()
         return
 
     def get_layer_number(self):
         return self.d.shape[0]
 
+    def _params(self):
+        '''Copies of the attributes that change during optimization'''
+        return {'d': self.d.copy()}
+
+    def snapshot(self) -> FilmSnapshot:
+        '''
+        Cheap record of the current state, restorable with
+        FilmSnapshot.to_film. Use instead of copy.deepcopy to keep the
+        history of an optimization.
+        '''
+        return FilmSnapshot(self)
+
     @abstractmethod
     def get_optical_thickness(self, wl, neglect_last_layer=False) -> float:
         raise NotImplementedError
@@ -142,6 +548,8 @@ class BaseFilm(ABC):
 
 
 class FreeFormFilm(BaseFilm):
+    ENGINES = ('spectrum_free', 'jacobi_free_form')
+
     def __init__(
         self,
         init_n_ls: NDArray,
@@ -182,11 +590,8 @@ class FreeFormFilm(BaseFilm):
         self.spectra = []
 
     def calculate_n_array(self, wls: NDArray):
-        n_arr = np.empty((wls.shape[0], self.get_layer_number()),
-                         dtype='complex128')
-        for i in range(self.get_layer_number()):
-            n_arr[:, i] = get_n.get_n_free(wls, self.n[i])
-        return n_arr
+        # non-dispersive: the same n at every wl
+        return np.tile(self.n, (wls.shape[0], 1))
 
     def get_optical_thickness(self, wl, neglect_last_layer=False) -> float:
         if neglect_last_layer:
@@ -194,9 +599,8 @@ class FreeFormFilm(BaseFilm):
         return (self.d * self.calculate_n_array(np.array([wl]))[0, :].real).sum()
 
     def update_n(self, n_new):
-        self.n = n_new
-        for s in self.get_all_spec_list():
-            s.outdate()
+        self.n = np.array(n_new, dtype='complex128')
+        self._changed()
 
     def get_n(self):
         '''
@@ -205,28 +609,30 @@ class FreeFormFilm(BaseFilm):
             Because FreeFormFilm contains only non-dispersive materials IN the 
             film stack (substrate and incidence can be dispersive though)
             the n_array is duplicate along axis 0. 
+
+            The returned view is read-only, change n with update_n.
         '''
-        return self.n
+        return _read_only(self.n)
+
+    def _params(self):
+        return {'d': self.d.copy(), 'n': self.n.copy()}
 
     def calculate_spectrum(self):
+        # SpectrumSimple.calculate picks the engine from INDEXED and the
+        # substrate model
         for s in self.spectra:
-            s.calculate(get_spectrum.get_spectrum_free)
+            s.calculate()
 
     def project_to_two_material_film(self, n1, n2, material1=None, material2=None):
         if n1 < n2:  # assume n1 > n2
             n1, n2 = n2, n1
             material1, material2 = material2, material1
 
-        is_high = (self.get_n() > ((n1 + n2) / 2))
-        each_d = self.get_d()[0]
-        new_d = np.array([0])  # assume first layer: high refractive index (n1)
-        now_high = True
-        for i in range(self.get_layer_number()):
-            if (is_high[i] and now_high) or (not is_high[i] and not now_high):
-                new_d[-1] += each_d
-            else:
-                now_high = not now_high
-                new_d = np.append(new_d, each_d)
+        # 0: high (n1), 1: low (n2). The first layer of the projection is
+        # high, of zero thickness if the film starts with a low layer
+        is_low = (self.get_n() <= ((n1 + n2) / 2)).astype('uint8')
+        new_d, _ = _merge_runs(
+            np.r_[0., self.get_d()], np.r_[np.uint8(0), is_low])
         if material1 is not None and material2 is not None:
             new_film = TwoMaterialFilm(
                 material1, material2, self.materials['sub'], new_d)
@@ -271,6 +677,8 @@ class TwoMaterialFilm(BaseFilm):
     """
     get_n_A: Callable
     get_n_B: Callable
+    ENGINES = ('spectrum_indexed', 'jacobi_indexed')
+    INDEXED = True
 
     def __init__(
         self,
@@ -289,7 +697,7 @@ class TwoMaterialFilm(BaseFilm):
 
         assert len(d_init.shape) == 1, "Should be 1 dim array!"
 
-        self.d = d_init
+        self.d = np.array(d_init)
         self.spectra: list[SpectrumSimple] = []
 
     # all layers should have non-zero thickness, except right after insertion
@@ -299,21 +707,38 @@ class TwoMaterialFilm(BaseFilm):
         assert np.min(self.d) > 0, "layers of zero thickness!"
 
     def remove_negative_thickness_layer(self, exclude=[], zero=0):
-        indices = []
+        '''
+        Remove the layers thinner than zero (the last one: thinner than 0),
+        except those at the indices in exclude (the last layer included).
+        The first layer is never removed.
+
+        Removed layers are dropped and their thickness is lost; neighbours
+        that end up adjacent with the same material are merged into one
+        layer (see remove_layers). E.g. [10, -1, -2, 20, 30] becomes
+        [10, 20, 30]. Before the change to remove_layers, the layer after
+        each removed one was folded into the layer before it, so
+        consecutive non-positive thicknesses were summed into the
+        neighbour instead ([8, 20, 30]).
+        '''
         d = self.get_d()
-        # first layer is never removed
-        i = 1
-        while i < d.shape[0] - 1:
-            if d[i] <= zero and i not in exclude:
-                d[i - 1] += d[i + 1]
-                d = np.delete(d, [i, i + 1])
-                exclude = [x - 2 for x in exclude]
-            else:
-                i += 1
-
-        if d[-1] <= 0 and d.shape[0] not in exclude:
-            d = np.delete(d, -1)
+        mask = d <= zero
+        mask[-1] = d[-1] <= 0
+        mask[0] = False
+        mask[np.asarray(exclude, dtype=int)] = False
+        self.remove_layers(mask)
 
+    def remove_layers(self, mask):
+        '''
+        Remove the layers where the boolean mask is True. The neighbours of
+        a removed layer are of the same material and merge into one layer.
+        The first layer can not be removed.
+        '''
+        mask = np.asarray(mask, dtype=bool)
+        assert mask.shape == self.d.shape, 'one mask entry per layer'
+        assert not mask[0], 'first layer is never removed'
+        keep = ~mask
+        d, _ = _merge_runs(
+            self.d[keep], (np.arange(self.d.shape[0]) % 2)[keep])
         self.update_d(d)
 
     def remove_thin_layers(self, d_min, method):
@@ -338,16 +763,59 @@ class TwoMaterialFilm(BaseFilm):
                     ^    (i == layer_index + 1)
                        ^ (i == layer_index + 2)
         """
-        d = self.get_d()
-        assert 0 <= layer_index < d.shape[0], 'invalid insert layer'
+        self.insert_layers([layer_index], [position], [thickness])
 
-        assert (d[layer_index] >= position and position >= 0), \
-            f'invalid insert position: {d[layer_index]} should >= {position} >= 0'
+    def insert_layers(self, indices, positions, thicknesses):
+        '''
+        Insert layers of the other material into layers of this film, at
+        once. See insert_layer. A layer with k insertions is split into
+        k + 1 layers.
 
-        d = np.insert(d, [layer_index + 1, layer_index + 1], thickness)
-        d[layer_index + 2] = max(d[layer_index] - position, 0)
-        d[layer_index] = position
-        self.update_d(d)
+        Parameters:
+            indices (1d NDArray of int): layers to insert into
+            positions (1d NDArray): depths of the insertions in their
+                layers, between 0 and the thickness of the layer
+            thicknesses (1d NDArray): thicknesses of the inserted layers
+
+        Returns:
+            1d NDArray, indices of the inserted layers in the new film
+        '''
+        d = self.get_d()
+        indices, positions, thicknesses = np.broadcast_arrays(
+            np.asarray(indices, dtype=int).ravel(),
+            np.asarray(positions, dtype='float64').ravel(),
+            np.asarray(thicknesses, dtype='float64').ravel(),
+        )
+        assert np.all((0 <= indices) & (indices < d.shape[0])), \
+            'invalid insert layer'
+        assert np.all((positions >= 0) & (positions <= d[indices])), \
+            f'invalid insert position: {positions} should be in [0, {d[indices]}]'
+
+        # by layer, then by depth
+        order = np.lexsort((positions, indices))
+        indices, positions = indices[order], positions[order]
+        counts = np.bincount(indices, minlength=d.shape[0])
+        first = np.cumsum(counts) - counts  # first insertion of every layer
+        start = np.arange(d.shape[0]) + 2 * first  # in the new film
+        rank = np.arange(indices.shape[0]) - first[indices]
+        new_idx = start[indices] + 2 * rank
+
+        new_d = np.empty(d.shape[0] + 2 * indices.shape[0])
+        # the part of the layer above each insertion...
+        above = positions.copy()
+        above[1:][rank[1:] > 0] -= positions[:-1][rank[1:] > 0]
+        new_d[new_idx] = above
+        new_d[new_idx + 1] = thicknesses[order]
+        # ...and below the last one
+        has = counts > 0
+        last = np.zeros(d.shape[0])
+        last[has] = positions[(first + counts - 1)[has]]
+        new_d[start + 2 * counts] = np.maximum(d - last, 0)
+        self.update_d(new_d)
+
+        inserted = np.empty_like(new_idx)
+        inserted[order] = new_idx + 1
+        return inserted
 
     def get_insert_layer_n(self, index):
         """
@@ -372,14 +840,29 @@ class TwoMaterialFilm(BaseFilm):
         n_arr = np.empty(
             (wls.shape[0], self.get_layer_number()), dtype='complex128')
 
-        n_A: NDArray = self.get_n_A(wls)
-        n_B: NDArray = self.get_n_B(wls)
-        l = self.get_layer_number()
+        n_A: NDArray = calculate_n(self.materials['A'], wls)
+        n_B: NDArray = calculate_n(self.materials['B'], wls)
 
-        n_arr[:, [i for i in range(0, l, 2)]] = n_A.reshape((-1, 1))
-        n_arr[:, [i for i in range(1, l, 2)]] = n_B.reshape((-1, 1))
+        n_arr[:, 0::2] = n_A.reshape((-1, 1))
+        n_arr[:, 1::2] = n_B.reshape((-1, 1))
         return n_arr
 
+    def calculate_n_table(self, wls: NDArray):
+        """
+        calculate n at different wl of A and B.
+
+        Returns:
+            2d NDArray, size is wls number * 2. Refractive indices
+        """
+        n_table = np.empty((wls.shape[0], 2), dtype='complex128')
+        n_table[:, 0] = calculate_n(self.materials['A'], wls)
+        n_table[:, 1] = calculate_n(self.materials['B'], wls)
+        return n_table
+
+    def get_material_idx(self):
+        # ABAB...
+        return np.arange(self.get_layer_number(), dtype='uint8') % 2
+
     def get_optical_thickness(self, wl, neglect_last_layer=False) -> float:
         """
         Calculate the optical thickness of this film
@@ -400,7 +883,7 @@ class TwoMaterialFilm(BaseFilm):
 
     def calculate_spectrum(self):
         for s in self.spectra:
-            s.calculate(get_spectrum.get_spectrum_simple)
+            s.calculate()
 
 
 class EqOTFilm(FreeFormFilm):
@@ -462,34 +945,56 @@ class MultiMaterialFilm(BaseFilm):
         n_arr (numpy array):
             array of refractive indices of layers at different wls
         materials_list (numpy array):
-            materials strings excluding incidence medium and substrate 
+            Material of each layer excluding incidence medium and substrate.
+            Computed from the FilmCore (get_core) holding d, the material
+            id of each layer and the distinct materials.
             NOTE that this is different from self.materials which is a dict
     """
-    get_n_ls: [Callable]
-    d: NDArray
-    materials_list: NDArray
-    get_n_ls: list[callable]
-    
+    ENGINES = ('spectrum_indexed', 'jacobi_indexed')
+    INDEXED = True
 
     def __init__(
         self,
-        materials: NDArray, # array of strings 
+        materials: NDArray, # array of strings, numbers or Material
         substrate: str,
         d_init: NDArray,
         incidence='Air'
     ):
         super().__init__(substrate, incidence)  # register sub and inc
-        self.materials_list = copy.deepcopy(materials)
-        self.register_multiple_get_n()
-        
+
         if d_init.shape == ():
             d_init = np.array([d_init])
 
         assert len(d_init.shape) == 1, "Should be 1 dim array!"
+        assert len(materials) == d_init.shape[0], 'one material per layer'
 
-        self.d = d_init
+        self._core = FilmCore.from_layers(d_init, materials)
         self.spectra: list[SpectrumSimple] = []
 
+    @property
+    def d(self):
+        return self._core.d
+
+    @d.setter
+    def d(self, d):
+        self._core.d = np.asarray(d, dtype='float64')
+
+    @property
+    def materials_list(self):
+        '''Material of every layer, excluding incidence and substrate'''
+        return self._core.layer_materials()
+
+    @property
+    def get_n_ls(self):
+        '''Material (wl -> n) of every layer'''
+        return list(self.materials_list)
+
+    def get_core(self):
+        return self._core
+
+    def _params(self):
+        return {'_core': self._core.copy()}
+
     def update_d(self, d):
         assert d.shape == self.d.shape, f'if layer count changes, \
         material list should also be maintained! {d.shape} != {self.d.shape}'
@@ -497,27 +1002,30 @@ class MultiMaterialFilm(BaseFilm):
 
     # all layers should have non-zero thickness, except right after insertion
     # so check by explicitly calling these methods
-    def register_multiple_get_n(self):
-        # test
-        self.get_n_ls = []
-        for i, material in enumerate(self.materials_list):
-            get_n_i = self._register_get_n(f'{i}th_layer', material)
-            self.get_n_ls.append(get_n_i)
-
     def check_thickness(self):
         assert np.min(self.d) > 0, "layers of zero thickness!"
 
     def remove_layer(self, rm_idx):
         # first layer is never removed
-        self.materials_list = np.delete(self.materials_list, rm_idx)
-        self.d = np.delete(self.d, rm_idx)
-        self.register_multiple_get_n()
+        self._core = self._core.delete(rm_idx)
+        self._changed()
 
     def remove_negative_thickness_layer(self, exclude=[]):
-        d = self.get_d()
-        rm_idx = np.where(self.d < 0)
-        rm_idx = [i for i in rm_idx if i not in exclude]
-        self.remove_layer(rm_idx)
+        mask = self.d < 0
+        mask[np.asarray(exclude, dtype=int)] = False
+        self.remove_layers(mask)
+
+    def remove_layers(self, mask):
+        '''Remove the layers where the boolean mask is True'''
+        mask = np.asarray(mask, dtype=bool)
+        assert mask.shape == self.d.shape, 'one mask entry per layer'
+        self._core = self._core.select(~mask)
+        self._changed()
+
+    def merge_adjacent_same_material(self):
+        '''Merge adjacent layers of the same material into one layer'''
+        self._core = self._core.merged()
+        self._changed()
 
     # Helper functions of needle insertion
     def insert_layer(self, layer_index, position, thickness):
@@ -535,13 +1043,20 @@ class MultiMaterialFilm(BaseFilm):
         Returns:
             2d NDArray, size is wls number * layer number. Refractive indices
         """
-        n_arr = np.empty(
-            (wls.shape[0], self.get_layer_number()), dtype='complex128')
-        for i, get_n in enumerate(self.get_n_ls):
-            n: NDArray = get_n(wls)
-            n_arr[:, i] = n
+        # layers of the same material share their column of the table
+        return self._core.n_array(wls)
 
-        return n_arr
+    def calculate_n_table(self, wls: NDArray):
+        """
+        calculate n at different wl for each distinct material.
+
+        Returns:
+            2d NDArray, size is wls number * distinct material number.
+        """
+        return self._core.n_table(wls)
+
+    def get_material_idx(self):
+        return self._core.material_idx
 
     def get_optical_thickness(self, wl, neglect_last_layer=False) -> float:
         """
@@ -551,13 +1066,13 @@ class MultiMaterialFilm(BaseFilm):
             wl (float):
                 wavelength at which refractive index is evaluated
         """
-        l = self.get_layer_number()
-        n_ls = np.array([get_n(wl) for get_n in self.get_n_ls])
+        core = self._core
+        n_ls = np.array([m(wl) for m in core.materials])[core.material_idx]
         ot = np.sum(n_ls * self.d)
         if neglect_last_layer:
-            ot -= self.get_d()[-1] * self.get_n_ls[-1](wl)
+            ot -= self.d[-1] * n_ls[-1]
         return ot
 
     def calculate_spectrum(self):
         for s in self.spectra:
-            s.calculate(get_spectrum.get_spectrum_free)
+            s.calculate()
@@ -0,0 +1,240 @@
+import sys
+sys.path.append('./designer/script/')
+
+
+from optimizer.grad_helper import stack_init_params, JacobianOperator
+from utils.loss import rms
+from spectrum import BaseSpectrum
+import numpy as np
+from typing import Sequence
+from optimizer.optimizer import GradientOptimizer, ThicknessParams, \
+    FreeFormIndexParams
+
+"""LM_matrix_free.py - matrix-free Gauss-Newton trust region optimizer.
+
+For films of 1e4+ layers the L * L normal matrix J^T J of LMOptimizer (and
+the W * L Jacobian itself) no longer fit in memory. Here every step is
+solved by preconditioned conjugate gradients (Steihaug-Toint) in a trust
+region, which only needs products J^T J v. Those are calculated by
+grad_helper.JacobianOperator from blocks of wavelengths, so memory is
+O(L + W) plus one block of the Jacobian (max_chunk_bytes).
+
+The preconditioner and the scaling of the trust region are the column norms
+of J (Jacobi preconditioning of J^T J), updated after every accepted step
+and never decreased (More 1978).
+"""
+
+
+def steihaug_cg(normal_matvec, g, D, delta, tol, max_iter):
+    '''
+    Approximately minimize the model m(p) = g^T p + 1/2 p^T B p subject to
+    |D p| <= delta by conjugate gradients, stopping on the boundary of the
+    trust region or at negative curvature (Steihaug 1983). Runs on
+    p_hat = D p, that is preconditioned by D^2.
+
+    Parameters:
+        normal_matvec (callable): v -> B v
+        g (1d NDArray): gradient
+        D (1d NDArray): positive scaling of the parameters
+        delta (float): trust region radius
+        tol (float): stop when the (scaled) residual is smaller
+        max_iter (int): maximum CG iterations, i.e. products with B
+
+    Returns:
+        p: the step
+        predicted: -m(p), the reduction predicted by the model
+    '''
+    g_hat = g / D
+    p = np.zeros_like(g_hat)
+    Bp = np.zeros_like(g_hat)  # B_hat p, tracked to evaluate m(p)
+    r = g_hat.copy()
+    d = -r
+    rr = r @ r
+    for _ in range(max_iter):
+        if np.sqrt(rr) <= tol:
+            break
+        Bd = normal_matvec(d / D) / D
+        dBd = d @ Bd
+        if dBd <= 0:
+            tau = _to_boundary(p, d, delta)
+            p, Bp = p + tau * d, Bp + tau * Bd
+            break
+        alpha = rr / dBd
+        if np.linalg.norm(p + alpha * d) >= delta:
+            tau = _to_boundary(p, d, delta)
+            p, Bp = p + tau * d, Bp + tau * Bd
+            break
+        p, Bp = p + alpha * d, Bp + alpha * Bd
+        r = r + alpha * Bd
+        rr_next = r @ r
+        d = -r + rr_next / rr * d
+        rr = rr_next
+    predicted = -(g_hat @ p + 0.5 * p @ Bp)
+    return p / D, predicted
+
+
+def _to_boundary(p, d, delta):
+    '''tau >= 0 such that |p + tau d| = delta'''
+    a, b, c = d @ d, 2 * p @ d, p @ p - delta ** 2
+    return (-b + np.sqrt(b ** 2 - 4 * a * c)) / (2 * a)
+
+
+class MatrixFreeLMOptimizer(GradientOptimizer):
+    """
+    Gauss-Newton trust region optimizer with matrix-free CG steps. Full
+    batch: mini-batching is not supported. The parameters (thicknesses or
+    refractive indices) are defined by the mixins ThicknessParams and
+    FreeFormIndexParams, see the subclasses below.
+
+    Attributes:
+        h_tol (float): stop when the largest step in any parameter is
+            smaller
+        delta (float): trust region radius in the norm |D x|. Defaults to
+            |D x0|
+        max_cg_iter (int): CG iterations (evaluations of J) per step
+        eta (float): minimum ratio of actual to predicted reduction for a
+            step to be accepted
+        accepted (bool): whether the last step was accepted
+    """
+
+    def __init__(
+        self,
+        film,
+        target_spec_ls: Sequence[BaseSpectrum],
+        max_steps,
+        h_tol=1e-5,
+        delta=None,
+        max_cg_iter=None,
+        eta=1e-4,
+        chunk_size=None,
+        max_chunk_bytes=64 << 20,
+        **kwargs
+    ):
+        assert 'batch_size_spec' not in kwargs and 'batch_size_wl' not in kwargs \
+            and 'wl_levels' not in kwargs, \
+            'matrix-free LM is a full batch method on all wavelengths'
+        super().__init__(film, target_spec_ls, max_steps, **kwargs)
+
+        self.h_tol = h_tol
+        self.delta = delta
+        self.eta = eta
+
+        # initialize optimizer
+        self.max_steps = max_steps
+        self.max_patience = self.max_steps if 'patience' not in kwargs else kwargs[
+            'patience']
+        self.current_patience = self.max_patience
+        self.best_loss = 0.
+        self.accepted = False
+
+        self._get_param()  # init variable x
+        self.max_cg_iter = min(self.x.shape[0], 100) \
+            if max_cg_iter is None else max_cg_iter
+
+        self.get_f, get_J, indexed = self._engines()
+        self.n_arrs_ls = stack_init_params(
+            self.film, self.target_spec_ls, indexed=indexed)
+        self.material_idx = film.get_material_idx() if indexed else None
+        self.op = JacobianOperator(
+            self.n_arrs_ls,
+            self.film.get_d().copy(),
+            self.target_spec_ls,
+            get_J,
+            self.x.shape[0],
+            material_idx=self.material_idx,
+            chunk_size=chunk_size,
+            max_chunk_bytes=max_chunk_bytes,
+        )
+        x = self._project(self.x)
+        if not np.array_equal(x, self.x):
+            # start in the feasible domain
+            self.x = x
+            self._set_param()
+
+        # f only. J is never stored
+        self.f = np.empty(self.total_wl_num)
+        self.f_new = np.empty(self.total_wl_num)
+        self.h = np.full(self.x.shape[0], np.inf)
+        self.D = None
+        self._stack_f(self.f, self.x)
+        self._g_outdated = True
+
+    def optimize(self):
+        # in case not do_record, return [initial film], [initial loss]
+        self._record()
+
+        for self.i in range(self.max_steps):
+            self._optimize_step()
+            if self.accepted:
+                self._set_param()
+            if self.is_recorded(self.i):
+                self._record()
+            if self.is_shown:
+                self._show()
+            if not self._update_best_and_patience():
+                break
+            if self._break_because_small_step():
+                break
+        self._restore_best()
+        return self._rearrange_record()
+
+    def _training_loss(self):
+        # f is at self.x, also after rejected steps
+        if self.f_is_full:
+            return rms(self.f), self.x, self.i
+        return None
+
+    def _update_gradient(self):
+        self.g, sq_norms = self.op.rmatvec_and_column_norms(self.f)
+        if sq_norms.max() > 0:
+            D = np.sqrt(np.maximum(sq_norms, 1e-12 * sq_norms.max()))
+        else:
+            D = np.ones_like(sq_norms)
+        self.D = D if self.D is None else np.maximum(self.D, D)
+        if self.delta is None:
+            self.delta = np.linalg.norm(self.D * self.x) or 1.
+        self._g_outdated = False
+
+    def _optimize_step(self):
+        if self._g_outdated:
+            self._update_gradient()
+
+        g_norm = np.linalg.norm(self.g / self.D)
+        h, predicted = steihaug_cg(
+            self.op.normal_matvec,
+            self.g,
+            self.D,
+            self.delta,
+            min(0.5, np.sqrt(g_norm)) * g_norm,
+            self.max_cg_iter,
+        )
+        self.h = h
+
+        x_new = self._project(self.x + h)
+        self._stack_f(self.f_new, x_new)
+        actual = 0.5 * (self.f @ self.f - self.f_new @ self.f_new)
+        rho = actual / predicted if predicted > 0 else -np.inf
+
+        step_norm = np.linalg.norm(self.D * h)
+        if rho < 0.25:
+            self.delta = 0.25 * step_norm
+        elif rho > 0.75 and step_norm >= 0.99 * self.delta:
+            self.delta *= 2
+
+        self.accepted = rho > self.eta
+        if self.accepted:
+            self.x = x_new
+            # keep both buffers
+            self.f, self.f_new = self.f_new, self.f
+            self._g_outdated = True
+
+    def _break_because_small_step(self):
+        return np.max(np.abs(self.h)) < self.h_tol
+
+
+class MatrixFreeLMThicknessOptimizer(ThicknessParams, MatrixFreeLMOptimizer):
+    pass
+
+
+class MatrixFreeLMFreeFormOptimizer(FreeFormIndexParams, MatrixFreeLMOptimizer):
+    pass
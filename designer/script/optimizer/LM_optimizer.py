@@ -2,61 +2,105 @@ import sys
 sys.path.append('./designer/script/')
 
 
-from tmm.get_jacobi_n_adjoint import get_jacobi_free_form
-from tmm.get_jacobi import get_jacobi_simple
-from tmm.get_spectrum import get_spectrum_free, get_spectrum_simple
+import tmm.engines as engines
 
 from optimizer.grad_helper import stack_f, stack_J, stack_init_params
-from utils.loss import calculate_RMS_f_spec, rms
+from utils.loss import rms
 from spectrum import BaseSpectrum
-from film import FreeFormFilm, TwoMaterialFilm
 import numpy as np
+import scipy.linalg
 from typing import Sequence
-import copy
 from optimizer.optimizer import GradientOptimizer
-from abc import abstractmethod
 
-"""adam.py - Adam optimizer for thin film properties.
+"""LM_optimizer.py - Levenberg-Marquardt optimizer of film thicknesses.
 
-This module contains the AdamOptimizer class, which implements the Adam optimization
-algorithm for optimizing thin film properties. This class inherits from the Optimizer
-class defined in optimizer.py.
+Every step solves the damped normal equations (J^T J + mu I) h = -J^T f.
+J is only calculated after accepted steps: a rejected step changes mu only,
+and the decomposition of J used for the damped solves is reused:
 
-(generated by chatGPT)
+    'eig'       J^T J = V diag(lambda) V^T once per J, O(n^2) per mu
+    'qr'        J = QR once per J, then QR of [R; sqrt(mu) I], O(n^3) per
+                mu, independent of the wavelength number. Better
+                conditioned than forming J^T J.
+    'cholesky'  Cholesky factorisation of J^T J + mu I, O(n^3) per mu
+
+Optionally the step is corrected by the geodesic acceleration (Transtrum &
+Sethna 2012), which costs one more spectrum per step.
 """
 
 
 class LMOptimizer(GradientOptimizer):
     """
-
+    Levenberg-Marquardt optimization of the thicknesses of a film. Full
+    batch: mini-batching is not supported.
+
+    Attributes:
+        h_tol (float): stop when the largest step in any layer is smaller
+        mu, nu (float): damping and its increase factor on rejected steps
+            (Madsen, Nielsen & Tingleff, Methods for Non-linear Least
+            Squares Problems, 2004)
+        solver (str): 'eig', 'qr' or 'cholesky', see the module docstring
+        geodesic (bool): use geodesic acceleration
+        geodesic_alpha (float): the acceleration is dropped if
+            2 |a| / |h| exceeds it
+        accepted (bool): whether the last step was accepted
     """
+    SOLVERS = ('eig', 'qr', 'cholesky')
 
     def __init__(
         self,
         film,
         target_spec_ls: Sequence[BaseSpectrum],
         max_steps,
+        h_tol=1e-5,
+        mu=1.,
+        solver='eig',
+        geodesic=False,
+        geodesic_alpha=0.75,
+        geodesic_step=0.1,
         **kwargs
     ):
+        assert 'batch_size_spec' not in kwargs and 'batch_size_wl' not in kwargs, \
+            'LM is a full batch method'
+        assert solver in self.SOLVERS, f'solver should be one of {self.SOLVERS}'
+        assert not film.has_incoherent_substrate(), \
+            'no gradients for incoherent substrates'
         super().__init__(film, target_spec_ls, max_steps, **kwargs)
 
-        # adam hyperparameters
-        self.h_tol = 1e-5 if 'h_tol' not in kwargs else kwargs['h_tol']
+        self.h_tol = h_tol
+        self.solver = solver
+        self.geodesic = geodesic
+        self.geodesic_alpha = geodesic_alpha
+        self.geodesic_step = geodesic_step
 
         # initialize optimizer
         self.max_steps = max_steps
-        self.max_patience = self.max_steps
+        self.max_patience = self.max_steps if 'patience' not in kwargs else kwargs[
+            'patience']
         self.current_patience = self.max_patience
         self.best_loss = 0.
         self.nu = 2
-        self.mu = 1  
-        self.n_arrs_ls = stack_init_params(self.film, self.target_spec_ls)
+        self.mu = mu
+        self.accepted = False
+
+        indexed = film.INDEXED
+        self.get_f = engines.get_engine(
+            'spectrum_indexed' if indexed else 'spectrum_free')
+        self.get_J = engines.get_engine(
+            'jacobi_indexed' if indexed else 'jacobi_simple_direct')
+        self.n_arrs_ls = stack_init_params(
+            self.film, self.target_spec_ls, indexed=indexed)
+        self.material_idx = film.get_material_idx() if indexed else None
 
         self._get_param()  # init variable x
 
         # allocate space for f and J
-        self.J = np.empty((self.total_wl_num, self.x.shape[0]))
-        self.f = np.empty(self.total_wl_num)
+        self.J = self._allocate(self.x.shape[0])
+        self.f = self._allocate()
+        self.f_new = self._allocate()
+        self.h = np.full(self.x.shape[0], np.inf)
+        self._stack_f(self.f, self.x)
+        self._J_outdated = True
 
     def optimize(self):
         # in case not do_record, return [initial film], [initial loss]
@@ -64,8 +108,10 @@ class LMOptimizer(GradientOptimizer):
 
         for self.i in range(self.max_steps):
             self._optimize_step()
-            self._set_param()
-            if self.is_recorded:
+            if self.accepted:
+                # rejected steps leave the film (and its spectra) unchanged
+                self._set_param()
+            if self.is_recorded(self.i):
                 self._record()
             if self.is_shown:
                 self._show()
@@ -73,32 +119,133 @@ class LMOptimizer(GradientOptimizer):
                 break
             if self._break_because_small_step():
                 break
-        self.x = self.best_x
-        self._set_param()  # restore to best x
+        self._restore_best()
         return self._rearrange_record()
 
-    def _validate_loss(self):
-        # return rms(self.f) THIS IS WRONG! should calculate on val set
-        return calculate_RMS_f_spec(self.film, self.target_spec_ls)
+    def _training_loss(self):
+        # f is at self.x, also after rejected steps
+        if self.f_is_full:
+            return rms(self.f), self.x, self.i
+        return None
 
-    def _optimize_step(self):
-        self._mini_batching()  # make sgd params
+    def _stack_f(self, f, x):
         stack_f(
-            self.f,
+            f,
             self.n_arrs_ls,
-            self.film.get_d(),
+            x,
             self.target_spec_ls,
-            get_f=self.get_f
+            spec_batch_idx=self.batcher.spec_batch_idx,
+            wl_batch_idx=self.batcher.wl_batch_idx,
+            get_f=self.get_f,
+            material_idx=self.material_idx
         )
+
+    def _on_refine(self):
+        # f and J on the finer wavelengths
+        self._stack_f(self.f, self.x)
+        self._J_outdated = True
+
+    def _update_J(self):
         stack_J(
             self.J,
             self.n_arrs_ls,
-            self.film.get_d(),
+            self.x,
             self.target_spec_ls,
-            MAX_LAYER_NUMBER=250,  # TODO: refactor. This is not used
-            get_J=self.get_J
+            spec_batch_idx=self.batcher.spec_batch_idx,
+            wl_batch_idx=self.batcher.wl_batch_idx,
+            get_J=self.get_J,
+            material_idx=self.material_idx
         )
+        # the engines return half the derivative
+        self.J *= 2
+        self.g = self.J.T @ self.f
+
+        # decomposition reused for every mu until the next accepted step
+        if self.solver == 'eig':
+            lam, self._V = np.linalg.eigh(self.J.T @ self.J)
+            self._lam = np.maximum(lam, 0.)  # rounding
+        elif self.solver == 'qr':
+            self._R = np.linalg.qr(self.J, mode='r')
+        else:
+            self._A = self.J.T @ self.J
+        self._J_outdated = False
+
+    def _damped_solver(self):
+        '''
+        Returns:
+            callable rhs -> (J^T J + mu I)^-1 rhs at the current mu
+        '''
+        n = self.x.shape[0]
+        if self.solver == 'eig':
+            V, lam, mu = self._V, self._lam, self.mu
+            return lambda rhs: V @ ((V.T @ rhs) / (lam + mu))
+        elif self.solver == 'qr':
+            # R_mu^T R_mu = R^T R + mu I = J^T J + mu I
+            R_mu = np.linalg.qr(
+                np.vstack([self._R, np.sqrt(self.mu) * np.identity(n)]),
+                mode='r'
+            )
+            return lambda rhs: scipy.linalg.solve_triangular(
+                R_mu,
+                scipy.linalg.solve_triangular(R_mu, rhs, trans='T')
+            )
+        else:
+            factor = scipy.linalg.cho_factor(
+                self._A + self.mu * np.identity(n))
+            return lambda rhs: scipy.linalg.cho_solve(factor, rhs)
+
+    def _geodesic_acceleration(self, solve, v):
+        '''
+        Second order correction of the step v along the geodesic, from the
+        second directional derivative of f by finite differences.
+        '''
+        step = self.geodesic_step
+        self._stack_f(self.f_new, self.x + step * v)
+        r = 2 / step * ((self.f_new - self.f) / step - self.J @ v)
+        return solve(-(self.J.T @ r))
 
-        # LM descent step. Including update x. 
-        raise NotImplementedError
-
+    def _optimize_step(self):
+        if self._J_outdated:
+            self._update_J()
+
+        solve = self._damped_solver()
+        h = solve(-self.g)
+        if self.geodesic:
+            a = self._geodesic_acceleration(solve, h)
+            if 2 * np.linalg.norm(a) <= self.geodesic_alpha * np.linalg.norm(h):
+                h = h + 0.5 * a
+        self.h = h
+
+        # Strategy: project back to feasible domain: d_i > 0
+        # should not cause unexpected stopping because there should be other
+        # descending directions
+        x_new = np.maximum(self.x + h, 0.)
+        self._stack_f(self.f_new, x_new)
+
+        F = self.f @ self.f
+        F_new = self.f_new @ self.f_new
+        # reduction predicted by the linear model
+        Jh = self.J @ h
+        predicted = -2 * self.g @ h - Jh @ Jh
+        rho = (F - F_new) / predicted if predicted > 0 else -np.inf
+
+        self.accepted = rho > 0
+        if self.accepted:
+            self.x = x_new
+            # keep both buffers
+            self.f, self.f_new = self.f_new, self.f
+            self._J_outdated = True
+            self.mu *= max(1 / 3, 1 - (2 * rho - 1) ** 3)
+            self.nu = 2
+        else:
+            self.mu *= self.nu
+            self.nu *= 2
+
+    def _break_because_small_step(self):
+        return np.max(np.abs(self.h)) < self.h_tol
+
+    def _set_param(self):
+        self.film.update_d(self.x)
+
+    def _get_param(self):
+        self.x = self.film.get_d().copy()
@@ -2,17 +2,17 @@ import sys
 sys.path.append('./designer/script/')
 
 
-from tmm.get_jacobi_n_adjoint import get_jacobi_free_form
-from tmm.get_jacobi_adjoint import get_jacobi_simple
-from tmm.get_spectrum import get_spectrum_free, get_spectrum_simple
+import tmm.engines as engines
 
-from optimizer.grad_helper import stack_f, stack_J, stack_init_params
+from optimizer.grad_helper import stack_f, stack_f_batched, stack_J, \
+    stack_init_params
 from utils.loss import calculate_RMS_f_spec, rms
 from spectrum import BaseSpectrum
 from film import FreeFormFilm, TwoMaterialFilm
 import numpy as np
 from typing import Sequence
 import copy
+import functools
 from optimizer.optimizer import GradientOptimizer
 from abc import abstractmethod
 from tqdm import trange
@@ -78,6 +78,8 @@ class AdamOptimizer(GradientOptimizer):
         Displays the current state of the optimization process.
     (generated by chatGPT)
     """
+    # use the indexed engines (see grad_helper.stack_init_params)
+    INDEXED = False
 
     def __init__(
         self,
@@ -111,12 +113,20 @@ class AdamOptimizer(GradientOptimizer):
 
     def init_set_params(self,):
         # calculate self n_arr
-        self.n_arrs_ls = stack_init_params(self.film, self.target_spec_ls)
+        self.n_arrs_ls = stack_init_params(
+            self.film,
+            self.target_spec_ls,
+            indexed=self.INDEXED,
+            wl_offsets=None if self.quadrature is None
+            else self.quadrature['wl_offsets'],
+        )
+        self.material_idx = self.film.get_material_idx() \
+            if self.INDEXED else None
         self._get_param()  # init variable x
 
         # allocate space for f and J
-        self.J = np.empty((self.total_wl_num, self.x.shape[0]))
-        self.f = np.empty(self.total_wl_num)
+        self.J = self._allocate(self.x.shape[0])
+        self.f = self._allocate()
 
     def optimize(self):
         # in case not do_record, return [initial film], [initial loss]
@@ -132,13 +142,14 @@ class AdamOptimizer(GradientOptimizer):
                 self._show()
             if not self._update_best_and_patience():
                 break
-        self.x = self.best_x
-        self._set_param()  # restore to best x
+        self._restore_best()
         return self._rearrange_record()
 
-    def _validate_loss(self):
-        # return rms(self.f)
-        return calculate_RMS_f_spec(self.film, self.target_spec_ls)
+    def _training_loss(self):
+        # f was evaluated before the update of this step
+        if self.f_is_full:
+            return rms(self.f), self._x_f, self.i - 1
+        return None
 
     def _optimize_step(self):
         self._mini_batching()  # make mini batching params
@@ -149,7 +160,8 @@ class AdamOptimizer(GradientOptimizer):
             self.target_spec_ls,
             spec_batch_idx=self.spec_batch_idx,
             wl_batch_idx=self.wl_batch_idx,
-            get_f=self.get_f
+            get_f=self.get_f,
+            material_idx=self.material_idx
         )
         stack_J(
             self.J,
@@ -159,20 +171,28 @@ class AdamOptimizer(GradientOptimizer):
             MAX_LAYER_NUMBER=250,  # TODO: refactor. This is not used
             spec_batch_idx=self.spec_batch_idx,
             wl_batch_idx=self.wl_batch_idx,
-            get_J=self.get_J
+            get_J=self.get_J,
+            material_idx=self.material_idx
         )
 
-        self.g = self.J.T @ self.f
+        if self.f_is_full:
+            self._x_f = self.x.copy()  # see _training_loss
+
+        self.batcher.observe(self.f)
+        self.g = self.J.T @ self.batcher.weigh(self.f)
         self.m = self.beta1 * self.m + (1 - self.beta1) * self.g
         self.v = self.beta2 * self.v + (1 - self.beta2) * self.g ** 2
         self.m_hat = self.m / (1 - self.beta1 ** (self.i + 1))
         self.v_hat = self.v / (1 - self.beta2 ** (self.i + 1))
-        self.x -= self.alpha * self.m_hat / \
-            (np.sqrt(self.v_hat) + self.epsilon)
+        p = self.m_hat / (np.sqrt(self.v_hat) + self.epsilon)
+        self.alpha = self._line_search(p, self.alpha)
+        self.x -= self.alpha * p
         
 
 
 class AdamThicknessOptimizer(AdamOptimizer):
+    INDEXED = True
+    AVERAGING = True
 
     def __init__(
             self,
@@ -201,6 +221,7 @@ class AdamThicknessOptimizer(AdamOptimizer):
                 - patience (int): Maximum number of steps without improvement before stopping (default: max_steps).
                 - batch_size_spec (int): Number of spectra in each batch (default: len(target_spec_ls)).
                 - batch_size_wl (int): Number of wavelengths in each batch (default: minimum wavelengths in target_spec_ls).
+                - wl_offsets, wl_weights, ang_offsets, ang_weights (1d NDArray): fit the spectra averaged over these wavelength / incident angle nodes (see tmm.get_spectrum_averaged.gauss_legendre) with the averaging engines (default: not averaged).
         """
         super().__init__(
             film,
@@ -210,8 +231,14 @@ class AdamThicknessOptimizer(AdamOptimizer):
             **kwargs
         )
 
-        self.get_f = get_spectrum_simple
-        self.get_J = get_jacobi_simple
+        if self.quadrature is None:
+            self.get_f = engines.get_engine('spectrum_indexed')
+            self.get_J = engines.get_engine('jacobi_indexed')
+        else:
+            self.get_f = functools.partial(
+                engines.get_engine('spectrum_averaged'), **self.quadrature)
+            self.get_J = functools.partial(
+                engines.get_engine('jacobi_averaged'), **self.quadrature)
         if remove_nonpos_during_optm:
             print('WARNING: not tested!')
         self.remove_nonpos_during_optm = remove_nonpos_during_optm
@@ -233,7 +260,38 @@ class AdamThicknessOptimizer(AdamOptimizer):
                 self.init_adam_optimizer()
 
     def _get_param(self):
-        self.x = self.film.get_d()
+        self.x = self.film.get_d().copy()
+
+    def _bounds(self):
+        return 0., np.inf
+
+    def _trial_f(self, X):
+        F = np.empty((X.shape[0], self.f.shape[0]))
+        if self.quadrature is not None:
+            # no batched averaging engine
+            for x, f in zip(X, F):
+                stack_f(
+                    f,
+                    self.n_arrs_ls,
+                    x,
+                    self.target_spec_ls,
+                    spec_batch_idx=self.spec_batch_idx,
+                    wl_batch_idx=self.wl_batch_idx,
+                    get_f=self.get_f,
+                    material_idx=self.material_idx
+                )
+            return F
+        # all trials in one launch per spectrum
+        stack_f_batched(
+            F,
+            self.n_arrs_ls,
+            X,
+            self.target_spec_ls,
+            self.material_idx,
+            spec_batch_idx=self.spec_batch_idx,
+            wl_batch_idx=self.wl_batch_idx,
+        )
+        return F
 
 
 class AdamFreeFormOptimizer(AdamOptimizer):
@@ -285,8 +343,8 @@ class AdamFreeFormOptimizer(AdamOptimizer):
         else:
             self.n_max = kwargs['n_max']
 
-        self.get_f = get_spectrum_free
-        self.get_J = get_jacobi_free_form
+        self.get_f = engines.get_engine('spectrum_free')
+        self.get_J = engines.get_engine('jacobi_free_form')
 
     def _set_param(self):
         # project back to feasible region
@@ -297,4 +355,26 @@ class AdamFreeFormOptimizer(AdamOptimizer):
             l[0] = self.film.calculate_n_array(s.WLS)
 
     def _get_param(self):
-        self.x = self.film.get_n()
+        self.x = self.film.get_n().copy()
+
+    def _bounds(self):
+        return self.n_min, self.n_max
+
+    def _trial_f(self, X):
+        F = np.empty((X.shape[0], self.f.shape[0]))
+        for x, f in zip(X, F):
+            n_arrs_ls = [
+                [np.tile(x, (s.WLS.shape[0], 1)), n_sub, n_inc]
+                for s, (_, n_sub, n_inc) in zip(
+                    self.target_spec_ls, self.n_arrs_ls)
+            ]
+            stack_f(
+                f,
+                n_arrs_ls,
+                self.film.get_d(),
+                self.target_spec_ls,
+                spec_batch_idx=self.spec_batch_idx,
+                wl_batch_idx=self.wl_batch_idx,
+                get_f=self.get_f
+            )
+        return F
@@ -1,6 +1,4 @@
 import numpy as np
-from tmm.get_jacobi import get_jacobi_simple
-from tmm.get_spectrum import get_spectrum_simple
 
 from film import TwoMaterialFilm
 from spectrum import BaseSpectrum
@@ -2,8 +2,7 @@ import sys
 sys.path.append('./designer/script/')
 
 
-from tmm.get_jacobi import get_jacobi_simple
-from tmm.get_spectrum import get_spectrum_simple
+import tmm.engines as engines
 from optimizer.grad_helper import stack_f, stack_J, stack_init_params
 from utils.loss import calculate_RMS_f_spec, rms
 from spectrum import BaseSpectrum
@@ -99,7 +98,7 @@ def adam_optimize(
             MAX_LAYER_NUMBER=250,
             spec_batch_idx=spec_batch_idx,
             wl_batch_idx=wl_batch_idx,
-            get_J=get_jacobi_simple
+            get_J=engines.get_engine('jacobi_simple_direct')
         )
         stack_f(
             f,
@@ -108,7 +107,7 @@ def adam_optimize(
             target_spec_ls,
             spec_batch_idx=spec_batch_idx,
             wl_batch_idx=wl_batch_idx,
-            get_f=get_spectrum_simple
+            get_f=engines.get_engine('spectrum_simple')
         )
 
         g = J.T @ f
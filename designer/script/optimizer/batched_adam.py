@@ -0,0 +1,234 @@
+import sys
+sys.path.append('./designer/script/')
+
+
+import tmm.engines as engines
+
+from optimizer.grad_helper import stack_init_params
+from spectrum import BaseSpectrum
+import numpy as np
+from typing import Sequence
+from optimizer.optimizer import Optimizer
+
+"""batched_adam.py - Adam on many films at once (multi-start).
+
+Multi-start runs (several initial films, layer numbers, repetitions) used to
+optimize one film after the other, each step launching the spectrum and
+Jacobian kernels for one film. BatchedAdamOptimizer advances K films in
+lock-step: every step is one launch per target spectrum of
+tmm.get_jacobi_batched over (wavelength, film), which returns the spectra
+and the jacobians of all films. The Adam update, early stopping and
+tracking of the best thicknesses are done per film on (K, L) arrays.
+"""
+
+
+class BatchedAdamOptimizer(Optimizer):
+    """
+    Adam optimization of the thicknesses of K films, each as
+    AdamThicknessOptimizer with full batches.
+
+    The films must be made of the same materials (TwoMaterialFilm or
+    MultiMaterialFilm with the same substrate and incident medium) but may
+    have different layer numbers: thinner stacks are padded with
+    zero-thickness layers, which are kept at 0.
+
+    Attributes:
+        films (list): the optimized films. Set to their best thicknesses
+            at the end of optimize
+        x (2d NDArray): K * L thicknesses, padded with 0
+        mask (2d NDArray): K * L, True for the layers of the films
+        alpha (1d NDArray): learning rate of every film
+        active (1d NDArray): K bools, films not stopped by their patience
+        best_x, best_loss, best_i: best thicknesses (padded), their RMS
+            loss and the step after which they were reached (-1 for the
+            initial ones), per film
+        loss (1d NDArray): latest known loss of every film
+    """
+
+    def __init__(
+        self,
+        films,
+        target_spec_ls: Sequence[BaseSpectrum],
+        max_steps,
+        alpha=1.,
+        beta1=0.9,
+        beta2=0.999,
+        epsilon=1e-8,
+        patience=None,
+        **kwargs
+    ):
+        '''
+        Parameters:
+            films (list): K films, see the class docstring
+            alpha (float or 1d NDArray): learning rate, or one per film
+            patience (int): a film stops after that many steps without
+                improvement. Defaults to max_steps
+            **kwargs: record, show, show_condition as in GradientOptimizer
+        '''
+        super().__init__(films, target_spec_ls)
+        self.films = films
+        self.max_steps = max_steps
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.max_patience = max_steps if patience is None else patience
+
+        # user functionalities
+        self.is_recorded = lambda i: False if 'record' not in kwargs else kwargs['record']
+        self.is_shown = False if 'show' not in kwargs else kwargs['show']
+        self.shown_condition = lambda x: True if 'show_condition' not in kwargs else kwargs['show_condition'](x)
+        self.records: list[list] = []
+
+        K = len(films)
+        L = max(f.get_layer_number() for f in films)
+        assert all(f.INDEXED for f in films), \
+            'films should be made of a few materials (indexed engines)'
+        assert not any(f.has_incoherent_substrate() for f in films), \
+            'no gradients for incoherent substrates'
+        self.n_arrs_ls = stack_init_params(
+            films[0], target_spec_ls, indexed=True)
+        for f in films[1:]:
+            for s, n_arrs in zip(target_spec_ls, self.n_arrs_ls):
+                assert np.array_equal(f.calculate_n_table(s.WLS), n_arrs[0]) \
+                    and np.array_equal(f.calculate_n_sub(s.WLS), n_arrs[1]) \
+                    and np.array_equal(f.calculate_n_inc(s.WLS), n_arrs[2]), \
+                    'films should be made of the same materials'
+
+        self.x = np.zeros((K, L))
+        self.mask = np.zeros((K, L), dtype=bool)
+        self.material_idx = np.zeros((K, L), dtype='uint32')
+        for k, f in enumerate(films):
+            l = f.get_layer_number()
+            self.x[k, :l] = f.get_d()
+            self.mask[k, :l] = True
+            self.material_idx[k, :l] = f.get_material_idx()
+        self.material_idx = self.material_idx.astype(
+            np.result_type(*[f.get_material_idx() for f in films]))
+
+        self.alpha = np.broadcast_to(
+            np.asarray(alpha, dtype='float64'), (K,))[:, np.newaxis]
+        self.get_J = engines.get_engine('jacobi_batched')
+
+        # allocate space for the spectra and jacobians of every target
+        self.targets = [np.append(s.get_R(), s.get_T()) for s in target_spec_ls]
+        self.spectra = [np.empty((K, t.shape[0])) for t in self.targets]
+        self.jacobis = [np.empty((K, t.shape[0], L)) for t in self.targets]
+        self.wl_num = sum(t.shape[0] for t in self.targets)
+
+        self.m = np.zeros((K, L))
+        self.v = np.zeros((K, L))
+        self.active = np.ones(K, dtype=bool)
+        self.current_patience = np.full(K, self.max_patience)
+        self.loss = np.full(K, np.nan)
+        self.best_loss = np.full(K, np.inf)
+        self.best_x = self.x.copy()
+        self.best_i = np.full(K, -1)
+        self.i = -1
+
+    def optimize(self):
+        # in case not do_record, return [initial x], [initial losses]
+        self._record()
+
+        for self.i in range(self.max_steps):
+            self._optimize_step()
+            if self.is_recorded(self.i):
+                self._record()
+            if self.is_shown:
+                self._show()
+            if not np.any(self.active):
+                break
+
+        # thicknesses after the last step were not evaluated
+        active = np.flatnonzero(self.active)
+        if active.shape[0] > 0:
+            loss, _ = self._evaluate(active)
+            self._update_best(active, loss, self.i)
+        for k, f in enumerate(self.films):
+            f.update_d(self.best_x[k, self.mask[k]])
+        return self._rearrange_record()
+
+    def _evaluate(self, members):
+        '''
+        Returns:
+            RMS loss and gradient J^T f (half, as the Adam optimizers) of
+            the films of index members
+        '''
+        K = members.shape[0]
+        d = self.x[members]
+        material_idx = self.material_idx[members]
+        sq_sum = np.zeros(K)
+        g = np.zeros((K, self.x.shape[1]))
+        for s, n_arrs, target, spectrum, jacobi in zip(
+            self.target_spec_ls, self.n_arrs_ls, self.targets,
+            self.spectra, self.jacobis
+        ):
+            self.get_J(
+                spectrum[:K],
+                jacobi[:K],
+                s.WLS,
+                d,
+                n_arrs[0],
+                material_idx,
+                n_arrs[1],
+                n_arrs[2],
+                s.INC_ANG
+            )
+            f = spectrum[:K] - target
+            sq_sum += np.einsum('kw,kw->k', f, f)
+            g += np.einsum('kwl,kw->kl', jacobi[:K], f)
+        loss = np.sqrt(sq_sum / self.wl_num)
+        self.loss[members] = loss
+        return loss, g
+
+    def _update_best(self, members, loss, i):
+        '''
+        Returns:
+            bools, whether each of members improved
+        '''
+        improved = loss < self.best_loss[members]
+        better = members[improved]
+        self.best_loss[better] = loss[improved]
+        self.best_x[better] = self.x[better]
+        self.best_i[better] = i
+        return improved
+
+    def _optimize_step(self):
+        active = np.flatnonzero(self.active)
+        loss, g = self._evaluate(active)
+        g *= self.mask[active]
+
+        # f is at the thicknesses before this step
+        improved = self._update_best(active, loss, self.i - 1)
+        self.current_patience[active] = np.where(
+            improved, self.max_patience, self.current_patience[active] - 1)
+        keep = self.current_patience[active] > 0
+        self.active[active] = keep
+        # stopped films keep their last evaluated thicknesses
+        active, g = active[keep], g[keep]
+
+        m = self.beta1 * self.m[active] + (1 - self.beta1) * g
+        v = self.beta2 * self.v[active] + (1 - self.beta2) * g ** 2
+        self.m[active], self.v[active] = m, v
+        m_hat = m / (1 - self.beta1 ** (self.i + 1))
+        v_hat = v / (1 - self.beta2 ** (self.i + 1))
+        x = self.x[active] - self.alpha[active] * m_hat / \
+            (np.sqrt(v_hat) + self.epsilon)
+        # project back to feasible domain, padding stays 0
+        self.x[active] = np.maximum(x, 0.) * self.mask[active]
+
+    def _validate_loss(self):
+        '''RMS losses of the current thicknesses of all films'''
+        loss, _ = self._evaluate(np.arange(self.x.shape[0]))
+        return loss
+
+    def _record(self):
+        '''
+        Append the thicknesses (padded) and losses of all films. Stopped
+        films keep their last thicknesses.
+        '''
+        self.records.append([self.x.copy(), self._validate_loss()])
+
+    def _show(self):
+        if self.shown_condition(self.i):
+            print(f'iter {self.i}, best loss {np.min(self.best_loss)}, '
+                  f'{np.count_nonzero(self.active)} films active')
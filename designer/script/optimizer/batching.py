@@ -0,0 +1,217 @@
+"""batching.py - mini-batches of wavelengths for the gradient optimizers.
+
+A Batcher picks, every step, the spectra and the wavelengths of each of
+them whose rows make up f and J (grad_helper.stack_f / stack_J with
+spec_batch_idx and a list of wl_batch_idx, one array per spectrum). Each
+spectrum is sampled from its own wavelengths, so spectra with more
+wavelengths than the shortest one are fully covered.
+
+    sampling='uniform'      wavelengths without replacement, as before
+    sampling='importance'   wavelengths with replacement, with probability
+                            proportional to the last seen residual
+                            sqrt(f_R^2 + f_T^2) at that wavelength, mixed
+                            with uniform by uniform_mix so that no
+                            probability is 0
+    stratified=True         every spectrum in every batch, the
+                            batch_size_spec * batch_size_wl wavelengths
+                            split in proportion to their wavelength numbers
+                            instead of a random subset of spectra
+
+Importance sampled rows are weighted by 1 / (N p_i) (N wavelengths of the
+spectrum), so that J^T (weights * f) is an unbiased estimate of the
+gradient of uniform sampling. The number of rows is the same every step,
+so f and J are allocated once by the optimizer; the index buffers and the
+random generator are kept by the Batcher.
+
+Wavelength continuation: with levels, e.g. [16, 4, 1], the batches are
+first taken from every 16th wavelength of each spectrum only, then from
+every 4th and finally from all of them (refine). The rows of a coarse
+level are fewer: the buffers (of the Batcher, and f and J of the
+optimizer) are allocated for the finest level, max_rows, and the leading
+rows are used at the coarser ones.
+"""
+import numpy as np
+from typing import Sequence
+from spectrum import BaseSpectrum
+
+
+class Batcher:
+    '''
+    Attributes:
+        spec_batch_idx (1d NDArray): spectra of the current batch, sorted
+        wl_batch_idx (list of 1d NDArray): wavelength indices of every
+            spectrum of the batch, sorted
+        weights (1d NDArray): weight of every row of f. Ones unless
+            importance sampling
+        residual (list of 1d NDArray): last seen residual of every
+            wavelength of every spectrum
+        levels (list of int): wavelength strides of the continuation
+            levels, decreasing to 1
+        level (int): current level, see refine
+        max_rows (int): rows of f at the level with the most
+        is_full (bool): every wavelength of every spectrum in every batch.
+            Then the batch never changes
+    '''
+    SAMPLINGS = ('uniform', 'importance')
+
+    def __init__(
+        self,
+        target_spec_ls: Sequence[BaseSpectrum],
+        batch_size_spec,
+        batch_size_wl,
+        sampling='uniform',
+        stratified=False,
+        uniform_mix=0.1,
+        seed=None,
+        levels=None,
+    ):
+        assert sampling in self.SAMPLINGS, \
+            f'sampling should be one of {self.SAMPLINGS}'
+        self.levels = [1] if levels is None else list(levels)
+        assert self.levels[-1] == 1 and \
+            all(a > b for a, b in zip(self.levels, self.levels[1:])), \
+            'levels should be strides decreasing to 1'
+        self.sampling = sampling
+        self.stratified = stratified
+        self.uniform_mix = uniform_mix
+        self.batch_size_spec = batch_size_spec
+        self.batch_size_wl = batch_size_wl
+        self.rng = np.random.default_rng(seed)
+        self.wl_nums = np.array([s.WLS.shape[0] for s in target_spec_ls])
+        self.residual = [np.ones(n) for n in self.wl_nums]
+
+        # buffers for every level, see _set_level
+        self.max_rows = max(
+            2 * np.sum(np.sort(self._batch_sizes(stride))[::-1][
+                :self._spec_batch_size()])
+            for stride in self.levels
+        )
+        self._weights = np.ones(self.max_rows)
+        self._wl_idx_buf = [np.empty(n, dtype=int) for n in self.wl_nums]
+        self.level = 0
+        self._set_level(0)
+
+    def _spec_batch_size(self):
+        return self.wl_nums.shape[0] if self.stratified \
+            else self.batch_size_spec
+
+    def _batch_sizes(self, stride):
+        '''wavelengths of every spectrum in a batch at a level'''
+        grid_nums = -(-self.wl_nums // stride)  # of wls[::stride]
+        if self.stratified:
+            return _split(self.batch_size_spec * self.batch_size_wl, grid_nums)
+        return np.full(
+            self.wl_nums.shape[0], min(self.batch_size_wl, grid_nums.min()))
+
+    def _set_level(self, level):
+        self.stride = self.levels[level]
+        self.batch_sizes = self._batch_sizes(self.stride)
+        spec_num = self.wl_nums.shape[0]
+        self.spec_batch_idx = np.arange(self._spec_batch_size())
+        # the whole grid of every spectrum: the batch never changes
+        self._fixed = self.spec_batch_idx.shape[0] == spec_num and \
+            np.all(self.batch_sizes == -(-self.wl_nums // self.stride))
+        self.is_full = self._fixed and self.stride == 1
+
+        # index buffers of each spectrum, filled by sample
+        self._wl_idx = [
+            buf[:n] for buf, n in zip(self._wl_idx_buf, self.batch_sizes)]
+        for idx in self._wl_idx:
+            idx[:] = np.arange(idx.shape[0]) * self.stride
+        self.wl_batch_idx = [self._wl_idx[i] for i in self.spec_batch_idx]
+        self.weights = self._weights[
+            :2 * np.sum(self.batch_sizes[self.spec_batch_idx])]
+        self.weights[:] = 1.
+        self._rows = None  # rows of f of each spectrum of the batch
+
+    def refine(self):
+        '''
+        Continue on the next finer level.
+
+        Returns:
+            False if already at the finest level
+        '''
+        if self.level == len(self.levels) - 1:
+            return False
+        self.level += 1
+        self._set_level(self.level)
+        return True
+
+    def sample(self):
+        '''Draw the next batch'''
+        if self._fixed:
+            return
+        if not self.stratified:
+            self.spec_batch_idx = np.sort(self.rng.choice(
+                self.wl_nums.shape[0], self.spec_batch_idx.shape[0],
+                replace=False))
+
+        self.wl_batch_idx = []
+        row = 0
+        self._rows = []
+        for i in self.spec_batch_idx:
+            # wavelengths of the level: wls[::stride]
+            n, N = self.batch_sizes[i], -(-self.wl_nums[i] // self.stride)
+            idx = self._wl_idx[i]
+            if self.sampling == 'uniform':
+                idx[:] = self.rng.choice(N, n, replace=False)
+                idx.sort()
+            else:
+                p = self._probabilities(i)
+                idx[:] = self.rng.choice(N, n, replace=True, p=p)
+                idx.sort()
+                w = 1 / (N * p[idx])
+                self.weights[row: row + n] = w  # R
+                self.weights[row + n: row + 2 * n] = w  # T
+            if self.stride > 1:
+                idx *= self.stride
+            self.wl_batch_idx.append(idx)
+            self._rows.append(row)
+            row += 2 * n
+
+    def _probabilities(self, i):
+        r = self.residual[i][::self.stride]
+        total = r.sum()
+        uniform = np.full(r.shape[0], 1 / r.shape[0])
+        if not total > 0:
+            return uniform
+        return (1 - self.uniform_mix) * r / total + self.uniform_mix * uniform
+
+    def observe(self, f):
+        '''
+        Remember the residuals f (rows of stack_f of the current batch) for
+        importance sampling
+        '''
+        if self.sampling != 'importance' or self._rows is None:
+            return
+        for i, idx, row in zip(self.spec_batch_idx, self.wl_batch_idx,
+                               self._rows):
+            n = idx.shape[0]
+            self.residual[i][idx] = np.hypot(
+                f[row: row + n], f[row + n: row + 2 * n])
+
+    def weigh(self, f):
+        '''f weighted for an unbiased gradient J^T weigh(f)'''
+        if self.sampling != 'importance' or self._fixed:
+            return f
+        return self.weights * f
+
+
+def _split(total, wl_nums):
+    '''
+    Split total wavelengths in proportion to wl_nums (largest remainder),
+    at least 1 and at most wl_nums[i] for every spectrum.
+    '''
+    total = min(max(total, wl_nums.shape[0]), np.sum(wl_nums))
+    share = total * wl_nums / np.sum(wl_nums)
+    sizes = np.clip(np.floor(share).astype(int), 1, wl_nums)
+    order = np.argsort(-(share - np.floor(share)))
+    while sizes.sum() < total:
+        for i in order:
+            if sizes.sum() == total:
+                break
+            if sizes[i] < wl_nums[i]:
+                sizes[i] += 1
+    while sizes.sum() > total:
+        sizes[np.argmax(sizes)] -= 1
+    return sizes
@@ -1,7 +1,6 @@
 
 import numpy as np
-from tmm.get_jacobi import get_jacobi_simple
-from tmm.get_spectrum import get_spectrum_simple
+import tmm.engines as engines
 from typing import Sequence
 from film import TwoMaterialFilm, BaseFilm
 from spectrum import BaseSpectrum, Spectrum
@@ -10,7 +9,29 @@ from spectrum import BaseSpectrum, Spectrum
 def stack_init_params(
     film: BaseFilm,
     target_spec_ls: Sequence[BaseSpectrum],
+    indexed=False,
+    wl_offsets=None,
 ):
+    '''
+    Arguments:
+        indexed (bool):
+            store the (wls, materials) table of refractive indices
+            (film.calculate_n_table) instead of the dense (wls, layers) array.
+            For the indexed engines, which also need material_idx in stack_f
+            and stack_J.
+        wl_offsets (1d NDArray):
+            wavelength quadrature nodes of the averaging engines
+            (tmm.get_spectrum_averaged). Refractive indices are then stored
+            at wls[i] + wl_offsets[q], with the nodes on axis 1. Requires
+            indexed.
+    '''
+    if wl_offsets is not None:
+        assert indexed, 'averaging engines are indexed engines'
+        return [
+            list(film.calculate_node_n_tables(s.WLS, wl_offsets))
+            for s in target_spec_ls
+        ]
+
     # stack parameters & preparations
     n_arrs_ls = []
     for s in target_spec_ls:
@@ -21,6 +42,7 @@ def stack_init_params(
         # implementation in LM descent for reusing code
 
         n_arrs_ls.append([
+            film.calculate_n_table(s.WLS) if indexed else
             film.calculate_n_array(s.WLS),
             film.calculate_n_sub(s.WLS),
             film.calculate_n_inc(s.WLS)
@@ -35,7 +57,8 @@ def stack_f(
     target_spec_ls: Sequence[BaseSpectrum],
     spec_batch_idx=None,
     wl_batch_idx=None,
-    get_f=get_spectrum_simple,
+    get_f=engines.lazy('spectrum_simple'),
+    material_idx=None,
 ):
     """
     Calculates f  w.r.t a list objective spectrums and add them together.
@@ -56,29 +79,21 @@ def stack_f(
             sum of number of wl points in the wls_ls
         layer_num (int):
             layer number
+        material_idx (1d NDArray):
+            material of each layer. When given, n_arrs_ls must be made with
+            stack_init_params(indexed=True) and get_f is an indexed engine.
     """
-    if spec_batch_idx is None:
-        spec_batch_idx = list(range(len(target_spec_ls)))
-    if wl_batch_idx is None:
-        wl_num_min = np.min([s.WLS.shape[0] for s in target_spec_ls])
-        wl_batch_idx = np.arange(wl_num_min)
-
     wl_idx = 0
-    for i, (s, n_arrs) in enumerate(zip(target_spec_ls, n_arrs_ls)):
-
+    for s, n_arrs, wl_batch_idx in _batches(
+            n_arrs_ls, target_spec_ls, spec_batch_idx, wl_batch_idx):
         wl_num = wl_batch_idx.shape[0]
 
-        if i not in spec_batch_idx:  # for SGD
-            continue
-
         # note that numpy array slicing does not allocate new space in memory
         get_f(
             f_old[wl_idx: wl_idx + wl_num * 2],  # R & T
             s.WLS[wl_batch_idx],
             d,
-            n_arrs[0][wl_batch_idx, :],
-            n_arrs[1][wl_batch_idx],  # n_sub
-            n_arrs[2][wl_batch_idx],  # n_inc
+            *_n_args(n_arrs, wl_batch_idx, material_idx),
             s.INC_ANG
         )
 
@@ -90,15 +105,61 @@ def stack_f(
     return
 
 
+def stack_f_batched(
+    F,
+    n_arrs_ls,
+    D,
+    target_spec_ls: Sequence[BaseSpectrum],
+    material_idx,
+    spec_batch_idx=None,
+    wl_batch_idx=None,
+    get_f=engines.lazy('spectrum_batched'),
+):
+    """
+    stack_f of K films in one launch per spectrum: F[k] is f of thicknesses
+    D[k]. The films share material_idx (1d) and n_arrs_ls, made with
+    stack_init_params(indexed=True).
+
+    Arguments:
+        F (2d NDArray): K * rows of stack_f, pre-allocated
+        D (2d NDArray): K * layer number
+    """
+    D = np.ascontiguousarray(D)
+    material_idx = np.broadcast_to(material_idx, D.shape)
+    wl_idx = 0
+    for s, n_arrs, wl_batch_idx in _batches(
+            n_arrs_ls, target_spec_ls, spec_batch_idx, wl_batch_idx):
+        wl_num = wl_batch_idx.shape[0]
+        rows = F[:, wl_idx: wl_idx + wl_num * 2]  # R & T
+
+        spectrum = np.empty(rows.shape)
+        get_f(
+            spectrum,
+            s.WLS[wl_batch_idx],
+            D,
+            n_arrs[0][wl_batch_idx, :],
+            material_idx,
+            n_arrs[1][wl_batch_idx],
+            n_arrs[2][wl_batch_idx],
+            s.INC_ANG
+        )
+        rows[:, :wl_num] = spectrum[:, :wl_num] - s.get_R()[wl_batch_idx]
+        rows[:, wl_num:] = spectrum[:, wl_num:] - s.get_T()[wl_batch_idx]
+
+        wl_idx += wl_num * 2
+    return
+
+
 def stack_J(
     J_old,
     n_arrs_ls,
     d: np.typing.NDArray,
     target_spec_ls: Sequence[BaseSpectrum],
-    get_J=get_jacobi_simple,
+    get_J=engines.lazy('jacobi_simple_direct'),
     MAX_LAYER_NUMBER=250,
     spec_batch_idx=None,
     wl_batch_idx=None,
+    material_idx=None,
 ):
     """
     Calculates J  w.r.t a list objective spectrums and add them together.
@@ -107,29 +168,154 @@ def stack_J(
 
     Note that calculation of Jacobian consumes a memory that scales
     with layer number. When too large, must split up.
-    """
-    if spec_batch_idx is None:
-        spec_batch_idx = list(range(len(target_spec_ls)))
-    if wl_batch_idx is None:
-        wl_num_min = np.min([s.WLS.shape[0] for s in target_spec_ls])
-        wl_batch_idx = np.arange(wl_num_min)
 
+    material_idx: see stack_f
+    """
     wl_count = 0
-    for i, (s, n_arrs) in enumerate(zip(target_spec_ls, n_arrs_ls)):
-
+    for s, n_arrs, wl_batch_idx in _batches(
+            n_arrs_ls, target_spec_ls, spec_batch_idx, wl_batch_idx):
         wl_num = wl_batch_idx.shape[0]  # R and T: batch can be 2 #wl long
 
-        if i not in spec_batch_idx:  # mini-batching
-            continue
-
         get_J(
             J_old[wl_count: wl_count + wl_num * 2, :],  # R & T
             s.WLS[wl_batch_idx],
             d[:],
-            n_arrs[0][wl_batch_idx, :],
-            n_arrs[1][wl_batch_idx],  # n_sub
-            n_arrs[2][wl_batch_idx],  # n_inc
+            *_n_args(n_arrs, wl_batch_idx, material_idx),
             s.INC_ANG,
         )
         wl_count += wl_num * 2
     return
+
+
+def _batches(n_arrs_ls, target_spec_ls, spec_batch_idx, wl_batch_idx):
+    '''
+    (spectrum, n_arrs, wavelength indices) of the spectra in the batch, in
+    the order of the rows of stack_f and stack_J.
+
+    spec_batch_idx defaults to all spectra. wl_batch_idx is either one
+    array of indices shared by the spectra, or a list with an array per
+    entry of spec_batch_idx (see optimizer.batching), and defaults to the
+    first wl_num_min wavelengths.
+    '''
+    if spec_batch_idx is None:
+        spec_batch_idx = range(len(target_spec_ls))
+    if wl_batch_idx is None:
+        wl_num_min = np.min([s.WLS.shape[0] for s in target_spec_ls])
+        wl_batch_idx = np.arange(wl_num_min)
+    if isinstance(wl_batch_idx, np.ndarray):
+        wl_batch_idx = [wl_batch_idx] * len(spec_batch_idx)
+    for i, wl_idx in zip(spec_batch_idx, wl_batch_idx):
+        yield target_spec_ls[i], n_arrs_ls[i], wl_idx
+
+
+def _n_args(n_arrs, wl_batch_idx, material_idx):
+    '''refractive index arguments of dense or indexed engines'''
+    n = (n_arrs[0][wl_batch_idx, :],)  # n_layers or n_table
+    if material_idx is not None:
+        n += (material_idx,)
+    return n + (
+        n_arrs[1][wl_batch_idx],  # n_sub
+        n_arrs[2][wl_batch_idx],  # n_inc
+    )
+
+
+class JacobianOperator:
+    '''
+    Products with the Jacobian J of stack_f w.r.t. the parameters, without
+    storing J. The rows of J are calculated by get_J (a stack_J engine) in
+    blocks of at most chunk_size wavelengths and discarded after use, so
+    memory is O(chunk_size * L) instead of O(W * L). Every product costs
+    one evaluation of the whole Jacobian.
+
+    Rows are in the order of stack_f with the first wl_num wavelengths of
+    every spectrum: R then T of every spectrum.
+
+    Attributes:
+        d (1d NDArray): thicknesses passed to get_J. Set after every change
+        n_arrs_ls: see stack_init_params. Modified in place by the caller
+            when refractive indices are optimized
+        scale (float): factor applied to the output of get_J. The engines
+            return half the derivative, hence 2 by default
+    '''
+
+    def __init__(
+        self,
+        n_arrs_ls,
+        d,
+        target_spec_ls: Sequence[BaseSpectrum],
+        get_J,
+        param_number,
+        material_idx=None,
+        chunk_size=None,
+        max_chunk_bytes=64 << 20,
+        scale=2.,
+    ):
+        self.n_arrs_ls = n_arrs_ls
+        self.d = d
+        self.target_spec_ls = target_spec_ls
+        self.get_J = get_J
+        self.material_idx = material_idx
+        self.scale = scale
+        self.wl_num = np.min([s.WLS.shape[0] for s in target_spec_ls])
+        if chunk_size is None:
+            # R and T rows of float64
+            chunk_size = max(1, max_chunk_bytes // (16 * param_number))
+        self.chunk_size = min(chunk_size, self.wl_num)
+        self._buf = np.empty((2 * self.chunk_size, param_number))
+        self.shape = (2 * self.wl_num * len(target_spec_ls), param_number)
+
+    def _blocks(self):
+        '''
+        Yields:
+            rows (1d NDArray): row indices of the block in J
+            J_block (2d NDArray): the rows of J, valid until the next block
+        '''
+        for i, (s, n_arrs) in enumerate(zip(self.target_spec_ls, self.n_arrs_ls)):
+            base = 2 * self.wl_num * i
+            for start in range(0, self.wl_num, self.chunk_size):
+                wl_idx = np.arange(start, min(start + self.chunk_size, self.wl_num))
+                k = wl_idx.shape[0]
+                J_block = self._buf[:2 * k]
+                self.get_J(
+                    J_block,
+                    s.WLS[wl_idx],
+                    self.d,
+                    *_n_args(n_arrs, wl_idx, self.material_idx),
+                    s.INC_ANG,
+                )
+                J_block *= self.scale
+                yield np.r_[base + wl_idx, base + self.wl_num + wl_idx], J_block
+
+    def matvec(self, v):
+        '''J v'''
+        out = np.empty(self.shape[0])
+        for rows, J_block in self._blocks():
+            out[rows] = J_block @ v
+        return out
+
+    def rmatvec(self, u):
+        '''J^T u'''
+        out = np.zeros(self.shape[1])
+        for rows, J_block in self._blocks():
+            out += J_block.T @ u[rows]
+        return out
+
+    def normal_matvec(self, v):
+        '''J^T J v, in one evaluation of J'''
+        out = np.zeros(self.shape[1])
+        for _, J_block in self._blocks():
+            out += J_block.T @ (J_block @ v)
+        return out
+
+    def rmatvec_and_column_norms(self, u):
+        '''
+        Returns:
+            J^T u and the squared norms of the columns of J (the diagonal of
+            J^T J), in one evaluation of J
+        '''
+        out = np.zeros(self.shape[1])
+        sq_norms = np.zeros(self.shape[1])
+        for rows, J_block in self._blocks():
+            out += J_block.T @ u[rows]
+            sq_norms += np.einsum('ij,ij->j', J_block, J_block)
+        return out, sq_norms
@@ -0,0 +1,241 @@
+import sys
+sys.path.append('./designer/script/')
+
+
+from optimizer.grad_helper import stack_init_params, JacobianOperator
+from utils.loss import rms
+from spectrum import BaseSpectrum
+import numpy as np
+from collections import deque
+from typing import Sequence
+from optimizer.optimizer import GradientOptimizer, ThicknessParams, \
+    FreeFormIndexParams
+
+"""lbfgsb.py - bound constrained L-BFGS optimizer.
+
+Adam and SGD clip the parameters into their bounds after every step, so
+steps pushing against a bound are wasted and the moments keep pointing out
+of the feasible domain. Here the bounds are part of the step (projected
+L-BFGS, two-metric projection as in L-BFGS-B):
+
+    - parameters on a bound whose gradient points outwards are held fixed,
+    - the L-BFGS direction is computed on the free parameters only,
+    - the step length is found by backtracking along the projected path
+      P(x + alpha p) with the Armijo condition, which only needs spectra,
+      no Jacobian. The lengths 1, 1/2, 1/4, ... are evaluated ls_batch at
+      a time (_trial_f): in one launch per spectrum for thicknesses of
+      films made of a few materials (tmm.get_spectrum_batched).
+
+The gradient J^T f is full batch, from grad_helper.JacobianOperator.
+"""
+
+
+class LBFGSBOptimizer(GradientOptimizer):
+    """
+    Minimizes 1/2 |f|^2 within the bounds of the parameters. Full batch:
+    mini-batching is not supported. The parameters (thicknesses or
+    refractive indices) are defined by the mixins ThicknessParams and
+    FreeFormIndexParams, see the subclasses below.
+
+    Attributes:
+        memory (int): number of (s, y) pairs of the L-BFGS approximation
+        h_tol (float): stop when the largest step in any parameter is
+            smaller
+        g_tol (float): stop when the largest entry of the projected
+            gradient is smaller
+        c1 (float): Armijo constant
+        max_ls (int): maximum spectra evaluated per line search
+        ls_batch (int): step lengths evaluated together
+        accepted (bool): whether the line search of the last step succeeded
+    """
+
+    def __init__(
+        self,
+        film,
+        target_spec_ls: Sequence[BaseSpectrum],
+        max_steps,
+        memory=10,
+        h_tol=1e-5,
+        g_tol=1e-10,
+        c1=1e-4,
+        max_ls=20,
+        ls_batch=4,
+        chunk_size=None,
+        max_chunk_bytes=64 << 20,
+        **kwargs
+    ):
+        assert 'batch_size_spec' not in kwargs and 'batch_size_wl' not in kwargs \
+            and 'wl_levels' not in kwargs, \
+            'L-BFGS-B is a full batch method on all wavelengths'
+        super().__init__(film, target_spec_ls, max_steps, **kwargs)
+
+        self.h_tol = h_tol
+        self.g_tol = g_tol
+        self.c1 = c1
+        self.max_ls = max_ls
+        self.ls_batch = ls_batch
+
+        # initialize optimizer
+        self.max_steps = max_steps
+        self.max_patience = self.max_steps if 'patience' not in kwargs else kwargs[
+            'patience']
+        self.current_patience = self.max_patience
+        self.best_loss = 0.
+        self.accepted = False
+        self.s_ls = deque(maxlen=memory)
+        self.y_ls = deque(maxlen=memory)
+
+        self._get_param()  # init variable x
+        self.get_f, get_J, indexed = self._engines()
+        self.n_arrs_ls = stack_init_params(
+            self.film, self.target_spec_ls, indexed=indexed)
+        self.material_idx = film.get_material_idx() if indexed else None
+        self.op = JacobianOperator(
+            self.n_arrs_ls,
+            self.film.get_d().copy(),
+            self.target_spec_ls,
+            get_J,
+            self.x.shape[0],
+            material_idx=self.material_idx,
+            chunk_size=chunk_size,
+            max_chunk_bytes=max_chunk_bytes,
+        )
+        x = self._project(self.x)
+        if not np.array_equal(x, self.x):
+            # start in the feasible domain
+            self.x = x
+            self._set_param()
+
+        self.f = np.empty(self.total_wl_num)
+        self.f_new = np.empty(self.total_wl_num)
+        self.h = np.full(self.x.shape[0], np.inf)
+        self.g = None
+        self._x_old, self._g_old = None, None
+        self._stack_f(self.f, self.x)
+
+    def optimize(self):
+        # in case not do_record, return [initial film], [initial loss]
+        self._record()
+
+        for self.i in range(self.max_steps):
+            self._optimize_step()
+            if self.accepted:
+                self._set_param()
+            if self.is_recorded(self.i):
+                self._record()
+            if self.is_shown:
+                self._show()
+            if not self._update_best_and_patience():
+                break
+            if self._break_because_small_step():
+                break
+        self._restore_best()
+        return self._rearrange_record()
+
+    def _training_loss(self):
+        # f is at self.x, also after rejected steps
+        if self.f_is_full:
+            return rms(self.f), self.x, self.i
+        return None
+
+    def _update_gradient(self):
+        self.g = self.op.rmatvec(self.f)
+        if self._x_old is not None:
+            s, y = self.x - self._x_old, self.g - self._g_old
+            # keep the approximation positive definite
+            if s @ y > 1e-10 * (y @ y):
+                self.s_ls.append(s)
+                self.y_ls.append(y)
+
+    def _free(self):
+        '''parameters not held on a bound by the gradient'''
+        lower, upper = self._bounds()
+        return ~(((self.x <= lower) & (self.g > 0))
+                 | ((self.x >= upper) & (self.g < 0)))
+
+    def _direction(self, free):
+        '''-H g on the free parameters (L-BFGS two-loop recursion)'''
+        q = np.where(free, self.g, 0.)
+        alphas = []
+        pairs = []
+        for s, y in zip(reversed(self.s_ls), reversed(self.y_ls)):
+            s, y = np.where(free, s, 0.), np.where(free, y, 0.)
+            sy = s @ y
+            if sy <= 0:
+                continue
+            alpha = (s @ q) / sy
+            q -= alpha * y
+            alphas.append(alpha)
+            pairs.append((s, y, sy))
+        if pairs:
+            s, y, sy = pairs[0]  # the latest
+            q *= sy / (y @ y)
+        else:
+            # no curvature information: at most a unit step
+            q /= max(1., np.max(np.abs(q)))
+        for (s, y, sy), alpha in zip(reversed(pairs), reversed(alphas)):
+            q += (alpha - (y @ q) / sy) * s
+        return -q
+
+    def _optimize_step(self):
+        if self.g is None:
+            self._update_gradient()
+
+        free = self._free()
+        p = self._direction(free)
+        if self.g @ p >= 0:
+            # not a descent direction: forget the curvature information
+            self.s_ls.clear()
+            self.y_ls.clear()
+            p = self._direction(free)
+
+        # backtracking along the projected path
+        F = 0.5 * self.f @ self.f
+        alphas = 0.5 ** np.arange(self.max_ls)
+        self.accepted = False
+        for start in range(0, self.max_ls, self.ls_batch):
+            alpha = alphas[start: start + self.ls_batch]
+            X = self._project(self.x + alpha[:, np.newaxis] * p)
+            F_trial = self._trial_f(X)
+            armijo = 0.5 * np.einsum('kw,kw->k', F_trial, F_trial) <= \
+                F + self.c1 * (X - self.x) @ self.g
+            if np.any(armijo):
+                # the longest step satisfying the Armijo condition
+                k = np.argmax(armijo)
+                x_new = X[k]
+                self.f_new[:] = F_trial[k]
+                self.accepted = True
+                break
+
+        if self.accepted:
+            self.h = x_new - self.x
+            self._x_old, self._g_old = self.x, self.g
+            self.x = x_new
+            # keep both buffers
+            self.f, self.f_new = self.f_new, self.f
+            self.g = None  # at the next step, after _set_param
+        elif self.s_ls:
+            # retry along the projected gradient
+            self.h = np.full(self.x.shape[0], np.inf)
+            self.s_ls.clear()
+            self.y_ls.clear()
+        else:
+            self.h = np.zeros_like(self.x)
+
+    def _projected_gradient(self):
+        return self._project(self.x - self.g) - self.x
+
+    def _break_because_small_step(self):
+        if self.g is None:
+            # the film is set to the new x by now
+            self._update_gradient()
+        return np.max(np.abs(self.h)) < self.h_tol or \
+            np.max(np.abs(self._projected_gradient())) < self.g_tol
+
+
+class LBFGSBThicknessOptimizer(ThicknessParams, LBFGSBOptimizer):
+    pass
+
+
+class LBFGSBFreeFormOptimizer(FreeFormIndexParams, LBFGSBOptimizer):
+    pass
@@ -7,7 +7,7 @@ import copy
 from film import TwoMaterialFilm
 from spectrum import BaseSpectrum
 from optimizer.grad_helper import stack_f, stack_J, stack_init_params
-from tmm.get_jacobi_adjoint import get_jacobi_simple
+import tmm.engines as engines
 
 MAX_LAYER = 50000000000
 
@@ -62,7 +62,9 @@ def insert_1_layer(
 def get_insert_grad(film: TwoMaterialFilm, target_spec_ls):
     # prepare initial params
     assert len(target_spec_ls) == 1, 'needle only supports single target spectrum for now.'
-    target_spec, n_arrs_ls = target_spec_ls[0].get_R(), stack_init_params(film, target_spec_ls)
+    target_spec, n_arrs_ls = target_spec_ls[0].get_R(), stack_init_params(
+        film, target_spec_ls, indexed=True)
+    material_idx = film.get_material_idx()
     # allocate space and calculate J and f
     d = film.get_d()
     total_wl_num = sum([s.get_R().shape[0] for s in target_spec_ls])
@@ -74,13 +76,16 @@ def get_insert_grad(film: TwoMaterialFilm, target_spec_ls):
         n_arrs_ls,
         d,
         target_spec_ls,
+        get_f=engines.get_engine('spectrum_indexed'),
+        material_idx=material_idx,
     )
     stack_J(
         J,
         n_arrs_ls,
         d,
         target_spec_ls,
-        get_J=get_jacobi_simple, # this function only returns wl * 1 (no T spec)
+        get_J=engines.get_engine('jacobi_indexed'),
+        material_idx=material_idx,
     )
 
     # find insertion place with largest negative gradient
@@ -101,20 +106,14 @@ def make_test_insert_film(film, insert_search_pts, split=False):
         assert film.get_layer_number() * (insert_search_pts * 2 + 1) <= MAX_LAYER, \
             'too many search points.'  # should have been caught earlier
 
-    insert_idx_arr = [j * 2 + i * (2 * insert_search_pts + 1) + 1
-                      for i in range(film.get_layer_number())
-                      for j in range(insert_search_pts)]  # max: L(2N + 1) - 2
-    d_before = film.get_d().copy()
-    for i in range(film.get_layer_number()):
-        for j in range(insert_search_pts):
-            insert_position = 1 / (insert_search_pts + 1) * d_before[i]
-            # insert new layer: zero thickness
-            try:
-                film.insert_layer(
-                    j * 2 + i * (2 * insert_search_pts + 1), insert_position, 0)
-            except Exception as e:
-                print(f'i:{i}, j: {j}')
-                print(e.args)
-                print('WARNING: there is a missing insertion layer at the interface.')
-                continue
+    # split every layer evenly by insert_search_pts new layers of zero
+    # thickness, inserted at indices j * 2 + i * (2 * insert_search_pts + 1) + 1
+    # max: L(2N + 1) - 2
+    layer_idx = np.repeat(
+        np.arange(film.get_layer_number()), insert_search_pts)
+    fraction = np.tile(
+        np.arange(1, insert_search_pts + 1) / (insert_search_pts + 1),
+        film.get_layer_number())
+    insert_idx_arr = film.insert_layers(
+        layer_idx, fraction * film.get_d()[layer_idx], 0.).tolist()
     return insert_idx_arr
@@ -2,17 +2,18 @@ import sys
 sys.path.append('./designer/script/')
 
 
-from tmm.get_jacobi_n_adjoint import get_jacobi_free_form
-from tmm.get_jacobi import get_jacobi_simple
-from tmm.get_spectrum import get_spectrum_free, get_spectrum_simple
 
-from optimizer.grad_helper import stack_f, stack_J, stack_init_params
-from utils.loss import calculate_RMS_f_spec, rms
+import tmm.engines as engines
+from optimizer.grad_helper import stack_f, stack_f_batched, stack_J, \
+    stack_init_params
+from optimizer.recorder import TrajectoryRecorder
+from optimizer.batching import Batcher
+from utils.loss import calculate_RMS_f_spec, calculate_RMS_f_spec_averaged, \
+    rms
 from spectrum import BaseSpectrum
 from film import FreeFormFilm, TwoMaterialFilm
 import numpy as np
 from typing import Sequence
-import copy
 from abc import ABC, abstractmethod
 
 
@@ -64,59 +65,235 @@ class Optimizer(ABC):
     
 
 class GradientOptimizer(Optimizer):
+    """
+    Validation: _update_best_and_patience validates every validate_every
+    steps (kwarg, default 1) and keeps the best parameters in best_x,
+    best_loss and best_i (the step after which best_x was reached, -1 for
+    the initial parameters). Patience counts validations. The loss is the
+    RMS over validate_spec_ls (kwarg, default target_spec_ls: pass a
+    held-out list of spectra to validate on those).
+
+    When the training step evaluates f on every wavelength of every
+    validation spectrum (full batch on the targets), rms(f) is the loss and
+    no spectrum is calculated for validation, see _training_loss. Otherwise
+    (or when the film has an incoherent substrate, whose loss rms(f) is
+    not) calculate_RMS_f_spec is evaluated at the validated steps only.
+
+    Records: with record=True, every record_stride-th step (kwarg, default
+    1) is recorded as a FilmSnapshot and its loss, kept in memory. With
+    record_path (kwarg) the records are streamed to that directory instead
+    (optimizer.recorder; kwargs record_chunk_size, record_overwrite), and
+    optimize returns the films lazily read back from it.
+
+    Line search: with line_search=K (kwarg, default 0: off) the fixed step
+    length of Adam and SGD is searched for every line_search_every steps
+    (kwarg, default 1) among step * line_search_factors (kwarg, default K
+    powers of 2 centered on 1), see _line_search. The chosen length
+    becomes the step length of the following steps.
+
+    Wavelength continuation: with wl_levels (kwarg, e.g. [16, 4, 1], see
+    optimizer.batching) f and J are first evaluated on every 16th
+    wavelength of each target spectrum only, and on a finer level after
+    refine_every steps (kwarg, default None: never) or when the patience
+    runs out, which only stops the optimization at the finest level. f and
+    J are allocated for the finest level (_allocate) and their leading
+    rows are used at the coarser ones; the refractive index tables are
+    shared by all levels.
+
+    Averaged spectra: with any of wl_offsets, wl_weights, ang_offsets,
+    ang_weights (kwargs, see tmm.get_spectrum_averaged and gauss_legendre)
+    the targets are fitted by the spectra of the film averaged over these
+    wavelength and incident angle nodes (finite bandwidth of the
+    instrument, converging beam), in training and validation. Only for the
+    optimizers with AVERAGING.
+    """
+    # supports averaged spectra, see quadrature
+    AVERAGING = False
+
     def __init__(self, film, target_spec_ls, max_steps, **kwargs):
+        assert not film.has_incoherent_substrate(), \
+            'no gradients for incoherent substrates'
         super().__init__(film, target_spec_ls)
 
         # user functionalities
-        self.is_recorded = lambda i: False if 'record' not in kwargs else kwargs['record']
+        record_path = None if 'record_path' not in kwargs else kwargs['record_path']
+        record = record_path is not None if 'record' not in kwargs else kwargs['record']
+        stride = 1 if 'record_stride' not in kwargs else kwargs['record_stride']
+        self.is_recorded = lambda i: record and i % stride == 0
         self.is_shown = False if 'show' not in kwargs else kwargs['show']
         self.shown_condition = lambda x: True if 'show_condition' not in kwargs else kwargs['show_condition'](x)
         self.records: list[list] = []
+        # stream the records to disk instead, see optimizer.recorder
+        self.recorder = None if record_path is None else TrajectoryRecorder(
+            record_path,
+            chunk_size=1024 if 'record_chunk_size' not in kwargs else kwargs[
+                'record_chunk_size'],
+            overwrite=False if 'record_overwrite' not in kwargs else kwargs[
+                'record_overwrite'],
+        )
 
         # check batch size
         self.wl_num_min = np.min([s.WLS.shape[0] for s in target_spec_ls])
         if 'batch_size_spec' not in kwargs:
             self.batch_size_spec = len(target_spec_ls)
         else:
-            self.batch_size_spec = kwargs['batch_size_wl']
+            self.batch_size_spec = kwargs['batch_size_spec']
         if 'batch_size_wl' not in kwargs:
             self.batch_size_wl = self.wl_num_min
         else:
             self.batch_size_wl = kwargs['batch_size_wl']
         assert self.batch_size_spec <= len(target_spec_ls) \
             and self.batch_size_wl <= self.wl_num_min  # spec with smallest wl
-        self.total_wl_num = self.batch_size_wl * self.batch_size_spec * 2  # R & T
+        # see optimizer.batching
+        self.batcher = Batcher(
+            target_spec_ls,
+            self.batch_size_spec,
+            self.batch_size_wl,
+            sampling='uniform' if 'sampling' not in kwargs else kwargs['sampling'],
+            stratified=False if 'stratified' not in kwargs else kwargs['stratified'],
+            seed=None if 'seed' not in kwargs else kwargs['seed'],
+            levels=None if 'wl_levels' not in kwargs else kwargs['wl_levels'],
+        )
+        self.refine_every = None if 'refine_every' not in kwargs else kwargs[
+            'refine_every']
 
+        # quadrature of the averaged spectra, None if not averaged
+        quadrature = {
+            k: np.asarray(kwargs[k], dtype='float64')
+            for k in ('wl_offsets', 'wl_weights', 'ang_offsets', 'ang_weights')
+            if k in kwargs
+        }
+        self.quadrature = None
+        if quadrature:
+            assert self.AVERAGING, \
+                f'{type(self).__name__} does not support averaged spectra'
+            self.quadrature = dict(
+                wl_offsets=np.zeros(1),
+                wl_weights=np.ones(1),
+                ang_offsets=np.zeros(1),
+                ang_weights=np.ones(1),
+            )
+            self.quadrature.update(quadrature)
+            for x in ('wl', 'ang'):
+                assert self.quadrature[f'{x}_offsets'].shape == \
+                    self.quadrature[f'{x}_weights'].shape, \
+                    f'one weight per {x}_offsets node'
+        self._level_start = 0  # first step of the current level
 
-    def _update_best_and_patience(self):
-        cur_loss = self._validate_loss()
-        if cur_loss < self.best_loss or self.i == 0:
-            self.best_loss = cur_loss
-            self.best_x = copy.deepcopy(self.x)
-            self.best_i = self.i
-            self.current_patience = self.max_patience
+        # validation
+        self.validate_every = 1 if 'validate_every' not in kwargs else kwargs[
+            'validate_every']
+        assert self.validate_every >= 1
+        self.validate_spec_ls = target_spec_ls if 'validate_spec_ls' not in kwargs \
+            else kwargs['validate_spec_ls']
+        assert type(self.validate_spec_ls) == list, \
+            'validate_spec_ls must be a list of Spectrums'
+        self._set_rows()
+        # line search, see _line_search
+        if 'line_search_factors' in kwargs:
+            self.line_search_factors = np.asarray(
+                kwargs['line_search_factors'], dtype='float64')
         else:
-            self.current_patience -= 1
+            K = 0 if 'line_search' not in kwargs else kwargs['line_search']
+            self.line_search_factors = 2. ** (np.arange(K) - (K - 1) / 2)
+        self.line_search_every = 1 if 'line_search_every' not in kwargs \
+            else kwargs['line_search_every']
+        # Armijo constant. None: the trial of smallest loss
+        self.line_search_c1 = 1e-4 if 'line_search_c1' not in kwargs \
+            else kwargs['line_search_c1']
 
+        self.best_x = None
+        self.best_i = None
+        self.i = -1  # before the first step
+        self._x_validated = False
+
+    def _validate_loss(self):
+        '''RMS loss of the current film on the validation spectra'''
+        if self.quadrature is not None:
+            return calculate_RMS_f_spec_averaged(
+                self.film, self.validate_spec_ls, **self.quadrature)
+        return calculate_RMS_f_spec(self.film, self.validate_spec_ls)
+
+    def _training_loss(self):
+        '''
+        Loss known from the last training step, without calculating spectra.
+
+        Returns:
+            None if unknown, else (loss, x, i): rms(f) and the parameters
+            and step at which f was evaluated. x may not be self.x, e.g.
+            for optimizers evaluating f before their update.
+        '''
+        return None
+
+    def _update_best_and_patience(self):
+        '''
+        Validate if scheduled at this step and keep the best parameters.
+
+        Returns:
+            False if the patience ran out
+        '''
+        self._x_validated = False
+        if self.i % self.validate_every == 0:
+            # rms(f) is the coherent model's loss: not the loss of a film
+            # given an incoherent substrate after the initialization
+            known = None if self.film.has_incoherent_substrate() else \
+                self._training_loss()
+            if known is None:
+                known = self._validate_loss(), self.x, self.i
+            cur_loss, x, i = known
+            self._x_validated = x is self.x
+            if self._update_best(cur_loss, x, i):
+                self.current_patience = self.max_patience
+            else:
+                self.current_patience -= 1
+
+        # plateau or end of the level: continue on finer wavelengths
+        if self.current_patience <= 0 or self.refine_every is not None and \
+                self.i + 1 - self._level_start >= self.refine_every:
+            if self._refine():
+                return True
         return self.current_patience > 0
 
+    def _update_best(self, loss, x, i):
+        if self.best_x is None or loss < self.best_loss:
+            self.best_loss = loss
+            self.best_x = x.copy()
+            self.best_i = i
+            return True
+        return False
+
+    def _restore_best(self):
+        '''
+        Set the film to the best parameters at the end of optimize. The
+        final parameters are validated first if they were not.
+        '''
+        if not self._x_validated:
+            self._update_best(self._validate_loss(), self.x, self.i)
+        self.x = self.best_x
+        self._set_param()
+
     def _record(self):
         '''
         Append info of current step.
 
         Returned res list as: [films], [losses] since transformed
-        with _rearrange_record once more before returning
+        with _rearrange_record once more before returning. The films are
+        FilmSnapshot, which only copy the parameters
+        (FilmSnapshot.to_film gives a full film).
         '''
-        if len(self.records) != 0:
-            self.records.append([
-                copy.deepcopy(self.film),
-                self._validate_loss()
-            ])
-        else:
-            self.records.append([
-                copy.deepcopy(self.film),
-                self._validate_loss()
-            ])
+        if self.recorder is not None:
+            self.recorder.append(self.i, self._validate_loss(), self.film)
+            return
+        self.records.append([
+            self.film.snapshot(),
+            self._validate_loss()
+        ])
+
+    def _rearrange_record(self):
+        if self.recorder is None:
+            return super()._rearrange_record()
+        trajectory = self.recorder.close()
+        return [trajectory.films, tuple(trajectory.losses)]
 
     def _show(self):
         if self.shown_condition(self.i):
@@ -125,29 +302,108 @@ class GradientOptimizer(Optimizer):
             
     def _mini_batching(self):
         '''
-        Make mini-batches.
-        mat: #wls \cross #spec; pick out elem on the crossing of
-            rows=wl_idx and cols=spec_idx. For selected wl, R and T
-            are calculated simultaneously.
+        Make mini-batches: the spectra (spec_batch_idx) and the wavelengths
+        of each of them (wl_batch_idx, a list of index arrays) whose R and T
+        are stacked into f and J. See optimizer.batching for the sampling
+        strategies (kwargs sampling, stratified, seed).
 
         The size of J is fixed but the stored grads are different
             in each epoch according to the random shuffle.
         '''
-        self.spec_batch_idx = np.random.default_rng().choice(
-            len(self.target_spec_ls),
-            self.batch_size_spec,
-            replace=False
-        )
-        self.spec_batch_idx = np.sort(self.spec_batch_idx)
+        self.batcher.sample()
+        self.spec_batch_idx = self.batcher.spec_batch_idx
+        self.wl_batch_idx = self.batcher.wl_batch_idx
 
-        self.wl_batch_idx = np.random.default_rng().choice(
-            self.wl_num_min,
-            self.batch_size_wl,
-            replace=False
-        )
-        self.wl_batch_idx = np.sort(self.wl_batch_idx)
+    def _set_rows(self):
+        self.total_wl_num = self.batcher.weights.shape[0]  # R & T
+        # f of a step covers every validation wavelength
+        self.f_is_full = self.validate_spec_ls is self.target_spec_ls \
+            and self.batcher.is_full
+
+    def _allocate(self, *shape):
+        '''
+        Returns:
+            buffer of the rows of f (shape: further dimensions, e.g. the
+            parameter number for J), allocated for the finest wavelength
+            level, of which the rows of the current level are used
+        '''
+        return np.empty((self.batcher.max_rows,) + shape)[:self.total_wl_num]
+
+    def _refine(self):
+        '''
+        Continue on the next finer wavelength level, see wl_levels.
+
+        Returns:
+            False if already at the finest level
+        '''
+        if not self.batcher.refine():
+            return False
+        self._set_rows()
+        for name in ('f', 'f_new', 'J'):
+            if hasattr(self, name):
+                buf = getattr(self, name)
+                buf = buf if buf.base is None else buf.base
+                setattr(self, name, buf[:self.total_wl_num])
+        self.current_patience = self.max_patience
+        self._level_start = self.i + 1
+        self._on_refine()
+        return True
 
+    def _on_refine(self):
+        '''Called after a refinement, e.g. to evaluate f on the new level'''
+        pass
+
+    def _line_search(self, p, step):
+        '''
+        Step length along -p, from the f and J of this step (the current
+        batch). All trials x - step * line_search_factors[k] * p, projected
+        into _bounds, are evaluated at once by _trial_f.
 
+        The trial of smallest loss is taken if it satisfies the Armijo
+        condition
+            |f_k|^2 / 2 <= |f|^2 / 2 + c1 * g^T (x_k - x)
+        (g = 2 J^T f: the engines return half the derivative), or with
+        line_search_c1=None if it improves on x. Otherwise, e.g. if p is not
+        a descent direction, step is returned unchanged (the plain update).
+
+        Returns:
+            the step length
+        '''
+        if self.line_search_factors.shape[0] == 0 or \
+                self.i % self.line_search_every != 0:
+            return step
+        steps = step * self.line_search_factors
+        X = self._project(self.x - steps[:, np.newaxis] * p)
+        F = self._trial_f(X)
+        loss = 0.5 * np.einsum('kw,kw->k', F, F)
+        loss_x = 0.5 * self.f @ self.f
+
+        best = np.argmin(loss)
+        if self.line_search_c1 is None:
+            accepted = loss[best] < loss_x
+        else:
+            g = 2 * self.J.T @ self.f
+            # .real: refractive indices are complex, their steps are not
+            accepted = g @ p > 0 and loss[best] <= loss_x + \
+                self.line_search_c1 * ((X[best] - self.x) @ g).real
+        return steps[best] if accepted else step
+
+    def _trial_f(self, X):
+        '''
+        Returns:
+            f (rows of the current batch) at every row of the parameters X,
+            without changing the film
+        '''
+        raise NotImplementedError(
+            f'{type(self).__name__} does not support line search')
+
+    def _bounds(self):
+        '''lower and upper bounds of the parameters, see _set_param'''
+        return -np.inf, np.inf
+
+    def _project(self, x):
+        '''x projected into _bounds'''
+        return np.clip(x, *self._bounds())
 
     @abstractmethod
     def _get_param(self):
@@ -165,3 +421,125 @@ class GradientOptimizer(Optimizer):
         Along with different projection strategies
         '''
         raise NotImplementedError
+
+
+# Parameters of the full batch optimizers (LM_matrix_free, lbfgsb). These
+# keep a grad_helper.JacobianOperator as self.op and evaluate f at trial
+# parameters with _stack_f (_trial_f: several at once), without changing
+# the film.
+
+class ThicknessParams:
+    '''Optimize the thicknesses of a film, d >= 0'''
+
+    def _engines(self):
+        '''
+        Returns:
+            get_f, get_J, whether they are indexed engines
+        '''
+        if self.film.INDEXED:
+            return engines.get_engine('spectrum_indexed'), \
+                engines.get_engine('jacobi_indexed'), True
+        # adjoint: O(L) memory per wavelength
+        return engines.get_engine('spectrum_free'), \
+            engines.get_engine('jacobi_simple'), False
+
+    def _stack_f(self, f, x):
+        '''f at parameters x, without changing the film'''
+        stack_f(
+            f,
+            self.n_arrs_ls,
+            x,
+            self.target_spec_ls,
+            get_f=self.get_f,
+            material_idx=self.material_idx
+        )
+
+    def _trial_f(self, X):
+        F = np.empty((X.shape[0], self.f.shape[0]))
+        if self.material_idx is not None:
+            # all trials in one launch per spectrum
+            stack_f_batched(
+                F,
+                self.n_arrs_ls,
+                X,
+                self.target_spec_ls,
+                self.material_idx
+            )
+        else:
+            for x, f in zip(X, F):
+                self._stack_f(f, x)
+        return F
+
+    def _bounds(self):
+        return 0., np.inf
+
+    def _set_param(self):
+        self.film.update_d(self.x)
+        self.op.d = self.x
+
+    def _get_param(self):
+        self.x = self.film.get_d().copy()
+
+
+class FreeFormIndexParams:
+    '''
+    Optimize the (real) refractive indices of a FreeFormFilm.
+
+    n_min, n_max (float): bounds of the refractive indices, see
+        AdamFreeFormOptimizer
+    '''
+
+    def __init__(
+        self,
+        film: FreeFormFilm,
+        target_spec_ls: Sequence[BaseSpectrum],
+        max_steps,
+        n_min=None,
+        n_max=float('inf'),
+        **kwargs
+    ):
+        # avoid grad explode by asserting no total reflection
+        if n_min is None:
+            n_min = film.calculate_n_inc(target_spec_ls[0].WLS)[0].real * \
+                np.sin(target_spec_ls[0].INC_ANG)
+        self.n_min = n_min
+        self.n_max = n_max
+        super().__init__(film, target_spec_ls, max_steps, **kwargs)
+
+    def _engines(self):
+        return engines.get_engine('spectrum_free'), \
+            engines.get_engine('jacobi_free_form'), False
+
+    def _n_arrs_ls(self, x):
+        n = x + 1j * self.film.get_n().imag
+        return [
+            [np.tile(n, (s.WLS.shape[0], 1)), n_sub, n_inc]
+            for s, (_, n_sub, n_inc) in zip(self.target_spec_ls, self.n_arrs_ls)
+        ]
+
+    def _stack_f(self, f, x):
+        stack_f(
+            f,
+            self._n_arrs_ls(x),
+            self.film.get_d(),
+            self.target_spec_ls,
+            get_f=self.get_f,
+        )
+
+    def _trial_f(self, X):
+        F = np.empty((X.shape[0], self.f.shape[0]))
+        for x, f in zip(X, F):
+            self._stack_f(f, x)
+        return F
+
+    def _bounds(self):
+        return self.n_min, self.n_max
+
+    def _set_param(self):
+        self.film.update_n(self.x + 1j * self.film.get_n().imag)
+        # shared with self.op
+        for l, s in zip(self.n_arrs_ls, self.target_spec_ls):
+            l[0] = self.film.calculate_n_array(s.WLS)
+
+    def _get_param(self):
+        self.x = self.film.get_n().real.copy()
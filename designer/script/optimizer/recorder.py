@@ -0,0 +1,225 @@
+import sys
+sys.path.append('./designer/script/')
+
+
+import os
+import bisect
+import glob
+import pickle
+import time
+import numpy as np
+from collections.abc import Sequence
+
+"""recorder.py - streaming record of an optimization on disk.
+
+GradientOptimizer keeps its records (film snapshot, loss) in memory by
+default. Given record_path, they are streamed to a directory instead by a
+TrajectoryRecorder, in segments of chunk_size records:
+
+    segment-000000.npz      step, loss, time, offset of each record, and
+                            the thicknesses (d) and refractive indices (n)
+                            of all records concatenated
+    template-<record>.pkl   FilmSnapshot from which the films of the
+                            following records are rebuilt. Written for the
+                            first record and whenever the layer number
+                            changes
+
+Every file is written to a temporary file and renamed, so a crash loses at
+most the records not yet flushed (< chunk_size) and never leaves a broken
+segment. Trajectory reads a directory lazily: the losses etc. of all
+segments, but the parameters of one segment at a time.
+"""
+
+SEGMENT = 'segment-{:06d}.npz'
+TEMPLATE = 'template-{:09d}.pkl'
+
+
+def _write_atomic(path, write):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def _film_params(film):
+    '''d, and n for films with a refractive index per layer'''
+    params = {'d': np.asarray(film.get_d())}
+    if isinstance(getattr(film, 'n', None), np.ndarray):
+        params['n'] = np.asarray(film.get_n())
+    return params
+
+
+class TrajectoryRecorder:
+    '''
+    Appends the records of an optimization to segment files in path.
+
+    Attributes:
+        path (str): directory of the files
+        chunk_size (int): records per segment
+        record_number (int): records appended so far
+    '''
+
+    def __init__(self, path, chunk_size=1024, overwrite=False):
+        self.path = path
+        self.chunk_size = chunk_size
+        os.makedirs(path, exist_ok=True)
+        old_files = self._files()
+        if old_files:
+            if not overwrite:
+                raise FileExistsError(
+                    f'{path} already holds a trajectory. Use overwrite=True')
+            for fname in old_files:
+                os.remove(fname)
+
+        self.record_number = 0
+        self._segment_number = 0
+        self._layer_number = None
+        self._start = time.perf_counter()
+        self._clear_buffer()
+
+    def _files(self):
+        return glob.glob(os.path.join(self.path, 'segment-*.npz')) + \
+            glob.glob(os.path.join(self.path, 'template-*.pkl'))
+
+    def _clear_buffer(self):
+        self._steps, self._losses, self._times = [], [], []
+        self._params = {}
+
+    def append(self, step, loss, film):
+        '''Record the current parameters of film at step with loss'''
+        params = _film_params(film)
+        if film.get_layer_number() != self._layer_number:
+            snapshot = film.snapshot()
+            _write_atomic(
+                os.path.join(self.path, TEMPLATE.format(self.record_number)),
+                lambda f: pickle.dump(snapshot, f)
+            )
+            self._layer_number = film.get_layer_number()
+
+        self._steps.append(step)
+        self._losses.append(loss)
+        self._times.append(time.perf_counter() - self._start)
+        for k, v in params.items():
+            self._params.setdefault(k, []).append(v.copy())
+        self.record_number += 1
+        if len(self._steps) == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        '''Write the buffered records as a new segment'''
+        if not self._steps:
+            return
+        sizes = [p.shape[0] for p in self._params['d']]
+        arrays = {
+            'step': np.array(self._steps, dtype='int64'),
+            'loss': np.array(self._losses, dtype='float64'),
+            'time': np.array(self._times, dtype='float64'),
+            'offset': np.cumsum([0] + sizes, dtype='int64'),
+        }
+        for k, v in self._params.items():
+            arrays[k] = np.concatenate(v)
+        _write_atomic(
+            os.path.join(self.path, SEGMENT.format(self._segment_number)),
+            lambda f: np.savez(f, **arrays)
+        )
+        self._segment_number += 1
+        self._clear_buffer()
+
+    def close(self):
+        '''
+        Returns:
+            Trajectory reading the records
+        '''
+        self.flush()
+        return Trajectory(self.path)
+
+
+class Trajectory:
+    '''
+    Records in a directory written by TrajectoryRecorder.
+
+    Attributes:
+        steps, losses, times (1d NDArray): of every record, times in
+            seconds from the start of the recording
+        films (Sequence): films of the records, rebuilt on access
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._segments = sorted(
+            glob.glob(os.path.join(path, 'segment-*.npz')))
+        templates = sorted(glob.glob(os.path.join(path, 'template-*.pkl')))
+        self._template_starts = [
+            int(os.path.basename(t)[len('template-'):-len('.pkl')])
+            for t in templates
+        ]
+        self._template_paths = templates
+        self._templates = {}
+
+        meta = {'step': [], 'loss': [], 'time': []}
+        self._segment_starts = [0]
+        for fname in self._segments:
+            with np.load(fname) as segment:
+                for k in meta:
+                    meta[k].append(segment[k])
+                self._segment_starts.append(
+                    self._segment_starts[-1] + segment['step'].shape[0])
+        self.steps, self.losses, self.times = [
+            np.concatenate(meta[k]) if meta[k] else np.empty(0)
+            for k in ['step', 'loss', 'time']
+        ]
+        self.films = _Films(self)
+        self._loaded = (None, None)  # segment index, its params
+
+    def __len__(self):
+        return self.steps.shape[0]
+
+    def params(self, i):
+        '''
+        Returns:
+            dict of the recorded parameters of record i: 'd', and 'n' for
+            free form films
+        '''
+        if not -len(self) <= i < len(self):
+            raise IndexError(f'record {i} out of range')
+        i %= len(self)
+        seg = bisect.bisect_right(self._segment_starts, i) - 1
+        if self._loaded[0] != seg:
+            with np.load(self._segments[seg]) as segment:
+                self._loaded = (seg, {k: segment[k] for k in segment.files})
+        arrays = self._loaded[1]
+        j = i - self._segment_starts[seg]
+        start, stop = arrays['offset'][j], arrays['offset'][j + 1]
+        return {
+            k: arrays[k][start: stop].copy()
+            for k in ['d', 'n'] if k in arrays
+        }
+
+    def film(self, i):
+        '''A new film with the parameters of record i'''
+        params = self.params(i)
+        i %= len(self)
+        template = bisect.bisect_right(self._template_starts, i) - 1
+        if template not in self._templates:
+            with open(self._template_paths[template], 'rb') as f:
+                self._templates[template] = pickle.load(f)
+        film = self._templates[template].to_film()
+        film.update_d(params['d'])
+        if 'n' in params:
+            film.update_n(params['n'])
+        return film
+
+
+class _Films(Sequence):
+    '''Films of a Trajectory, rebuilt on access'''
+
+    def __init__(self, trajectory):
+        self._trajectory = trajectory
+
+    def __len__(self):
+        return len(self._trajectory)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._trajectory.film(j) for j in range(len(self))[i]]
+        return self._trajectory.film(i)
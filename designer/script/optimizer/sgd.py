@@ -2,11 +2,10 @@ import sys
 sys.path.append('./designer/script/')
 
 
-from tmm.get_jacobi_n_adjoint import get_jacobi_free_form
-from tmm.get_jacobi import get_jacobi_simple
-from tmm.get_spectrum import get_spectrum_free, get_spectrum_simple
+import tmm.engines as engines
 
-from optimizer.grad_helper import stack_f, stack_J, stack_init_params
+from optimizer.grad_helper import stack_f, stack_f_batched, stack_J, \
+    stack_init_params
 from utils.loss import calculate_RMS_f_spec, rms
 from spectrum import BaseSpectrum
 from film import FreeFormFilm, TwoMaterialFilm
@@ -16,6 +15,8 @@ import copy
 from optimizer.optimizer import GradientOptimizer
 
 class SGDOptimizer(GradientOptimizer):
+    # use the indexed engines (see grad_helper.stack_init_params)
+    INDEXED = False
 
     def __init__(
         self,
@@ -36,14 +37,17 @@ class SGDOptimizer(GradientOptimizer):
             'patience']
         self.current_patience = self.max_patience
         self.best_loss = 0.
-        self.n_arrs_ls = stack_init_params(self.film, self.target_spec_ls)
+        self.n_arrs_ls = stack_init_params(
+            self.film, self.target_spec_ls, indexed=self.INDEXED)
+        self.material_idx = self.film.get_material_idx() \
+            if self.INDEXED else None
         self.b = 0.
 
         self._get_param()  # init variable x
 
         # allocate space for f and J
-        self.J = np.empty((self.total_wl_num, self.x.shape[0]))
-        self.f = np.empty(self.total_wl_num)
+        self.J = self._allocate(self.x.shape[0])
+        self.f = self._allocate()
     
     def optimize(self):
         # in case not do_record, return [initial film], [initial loss]
@@ -52,19 +56,20 @@ class SGDOptimizer(GradientOptimizer):
         for self.i in range(self.max_steps):
             self._optimize_step()
             self._set_param()
-            if self.is_recorded:
+            if self.is_recorded(self.i):
                 self._record()
             if self.is_shown:
                 self._show()
             if not self._update_best_and_patience():
                 break
-        self.x = self.best_x
-        self._set_param()  # restore to best x
+        self._restore_best()
         return self._rearrange_record()
 
-    def _validate_loss(self):
-        # return rms(self.f) 
-        return calculate_RMS_f_spec(self.film, self.target_spec_ls)
+    def _training_loss(self):
+        # f was evaluated before the update of this step
+        if self.f_is_full:
+            return rms(self.f), self._x_f, self.i - 1
+        return None
 
     def _optimize_step(self):
         self._mini_batching()  # make sgd params
@@ -75,7 +80,8 @@ class SGDOptimizer(GradientOptimizer):
             self.target_spec_ls,
             spec_batch_idx=self.spec_batch_idx,
             wl_batch_idx=self.wl_batch_idx,
-            get_f=self.get_f
+            get_f=self.get_f,
+            material_idx=self.material_idx
         )
         stack_J(
             self.J,
@@ -85,20 +91,28 @@ class SGDOptimizer(GradientOptimizer):
             MAX_LAYER_NUMBER=250,  # TODO: refactor. This is not used
             spec_batch_idx=self.spec_batch_idx,
             wl_batch_idx=self.wl_batch_idx,
-            get_J=self.get_J
+            get_J=self.get_J,
+            material_idx=self.material_idx
         )
 
-        self.g = self.J.T @ self.f
+        if self.f_is_full:
+            self._x_f = self.x.copy()  # see _training_loss
+
+        self.batcher.observe(self.f)
+        self.g = self.J.T @ self.batcher.weigh(self.f)
         self.b = self.mu * self.b + (1 - self.tau) * self.g
         if self.nesterov:
             self.g = self.g + self.mu * self.b
         else:
             self.g = self.b
 
+        self.lr = self._line_search(self.g, self.lr)
         self.x -= self.lr * self.g
 
 
 class SGDThicknessOptimizer(SGDOptimizer):
+    INDEXED = True
+
     def __init__(
             self,
             film,
@@ -109,8 +123,8 @@ class SGDThicknessOptimizer(SGDOptimizer):
     ):
         
         super().__init__(film, target_spec_ls, max_steps, lr=lr, **kwargs)
-        self.get_f = get_spectrum_simple
-        self.get_J = get_jacobi_simple
+        self.get_f = engines.get_engine('spectrum_indexed')
+        self.get_J = engines.get_engine('jacobi_indexed')
 
     def _set_param(self):
         # Project back to feasible domain
@@ -118,4 +132,21 @@ class SGDThicknessOptimizer(SGDOptimizer):
         self.film.update_d(self.x)
 
     def _get_param(self):
-        self.x = self.film.get_d()
\ No newline at end of file
+        self.x = self.film.get_d().copy()
+
+    def _bounds(self):
+        return 0., np.inf
+
+    def _trial_f(self, X):
+        # all trials in one launch per spectrum
+        F = np.empty((X.shape[0], self.f.shape[0]))
+        stack_f_batched(
+            F,
+            self.n_arrs_ls,
+            X,
+            self.target_spec_ls,
+            self.material_idx,
+            spec_batch_idx=self.spec_batch_idx,
+            wl_batch_idx=self.wl_batch_idx,
+        )
+        return F
\ No newline at end of file
@@ -1,5 +1,6 @@
 import numpy as np
-import tmm.get_spectrum as get_spectrum
+import tmm.engines as engines
+from tmm.incoherent import get_spectrum_incoherent
 from abc import ABC, abstractmethod
 
 
@@ -61,26 +62,75 @@ class SpectrumSimple(BaseSpectrum):
     INC_ANG (float):
     WLS (NDArray):
     spec (NDArray):
-        The REFLECTANCE spectrum. In FilmSimple instances, no absorption so 
-        only R is considered
+        [R, T] spectrum of the last calculation. Every calculation stores
+        a new read-only array, so R and T handed out earlier never change.
+    n_sub, n_inc (NDArray):
+        refractive indices of the substrate and incident material at WLS.
+        Re-evaluated when the film's substrate or incident material changes.
     updated:
         When an instance of Film has a SpectrumSimple, update denotes whether 
-        this spectrum is updated in regard to the current film structure.
+        this spectrum is updated in regard to the current film structure,
+        i.e. whether it was calculated with the default engine at the
+        current BaseFilm.get_version().
     """
 
     def __init__(self, incident_angle, wavelengths, film):
         self.INC_ANG = incident_angle
         self.WLS = wavelengths
-        self.n_sub = film.calculate_n_sub(self.WLS)
-        self.n_inc = film.calculate_n_inc(self.WLS)
-        self.spec = np.empty(self.WLS.shape[0] * 2)
         self.film = film
-        self.updated = False
+        self._n_materials = None
+        # film version of self.spec. None if not calculated yet, or calculated
+        # with a non-default engine or arguments
+        self._version = None
+        self._store(np.zeros(self.WLS.shape[0] * 2))
 
-    def calculate(self, spec_func=get_spectrum.get_spectrum_free, **kwargs):
-        # only R spectrum
+    @property
+    def n_sub(self):
+        self._update_n_sub_inc()
+        return self._n_sub
+
+    @property
+    def n_inc(self):
+        self._update_n_sub_inc()
+        return self._n_inc
+
+    def _update_n_sub_inc(self):
+        materials = (self.film.materials['sub'], self.film.materials['inc'])
+        if materials != self._n_materials:
+            self._n_sub = self.film.calculate_n_sub(self.WLS)
+            self._n_inc = self.film.calculate_n_inc(self.WLS)
+            self._n_materials = materials
+
+    def _store(self, spec):
+        '''Make spec the current spectrum. Not up to date until calculate
+        marks it so.'''
+        spec.flags.writeable = False
+        self.spec = spec
+        self.spec_R = spec[:self.WLS.shape[0]]
+        self.spec_T = spec[self.WLS.shape[0]:]
+        self._version = None
+
+    def calculate(self, spec_func=None, **kwargs):
+        # only the default engine without extra arguments gives the spectrum
+        # that get_R / get_T may serve from the cache
+        version = self.film.get_version()
+        if spec_func is None:
+            if self.film.has_incoherent_substrate():
+                self.calculate_incoherent(**kwargs)
+            elif self.film.INDEXED:
+                self.calculate_indexed(**kwargs)
+            else:
+                self._calculate_dense(
+                    engines.get_engine('spectrum_free'), **kwargs)
+            if not kwargs:
+                self._version = version
+        else:
+            self._calculate_dense(spec_func, **kwargs)
+
+    def _calculate_dense(self, spec_func, **kwargs):
+        spec = np.empty(self.WLS.shape[0] * 2)
         spec_func(
-            self.spec,
+            spec,
             self.WLS,
             self.film.get_d(),
             self.film.calculate_n_array(self.WLS),
@@ -89,26 +139,254 @@ class SpectrumSimple(BaseSpectrum):
             self.INC_ANG, 
             **kwargs
         )
-        self.spec_R = self.spec[:self.WLS.shape[0]]
-        self.spec_T = self.spec[self.WLS.shape[0]:]
-        self.updated = True
+        self._store(spec)
+
+    def calculate_indexed(self, spec_func=None, **kwargs):
+        '''
+        Same as calculate, but passes the refractive indices of the materials
+        and the material of each layer (see tmm.get_spectrum_indexed) instead
+        of the dense wls * layers array.
+        '''
+        if spec_func is None:
+            spec_func = engines.get_engine('spectrum_indexed')
+        spec = np.empty(self.WLS.shape[0] * 2)
+        spec_func(
+            spec,
+            self.WLS,
+            self.film.get_d(),
+            self.film.calculate_n_table(self.WLS),
+            self.film.get_material_idx(),
+            self.n_sub,
+            self.n_inc,
+            self.INC_ANG,
+            **kwargs
+        )
+        self._store(spec)
+
+    def calculate_averaged(
+        self,
+        wl_offsets=np.zeros(1),
+        wl_weights=np.ones(1),
+        ang_offsets=np.zeros(1),
+        ang_weights=np.ones(1),
+        **kwargs
+    ):
+        '''
+        Spectrum averaged over a wavelength window around each sample and /
+        or a range of incident angles, as measured by an instrument with
+        finite bandwidth or a converging beam. One launch, see
+        tmm.get_spectrum_averaged (gauss_legendre makes nodes and weights).
+
+        Parameters:
+            wl_offsets, wl_weights:
+                wavelength quadrature nodes relative to WLS, and weights
+            ang_offsets, ang_weights:
+                incident angle nodes in degree relative to INC_ANG, and
+                weights
+        '''
+        film = self.film
+        n_table, n_sub, n_inc = film.calculate_node_n_tables(
+            self.WLS, wl_offsets)
+        spec = np.empty(self.WLS.shape[0] * 2)
+        engines.get_engine('spectrum_averaged')(
+            spec,
+            self.WLS,
+            film.get_d(),
+            n_table,
+            film.get_material_idx(),
+            n_sub,
+            n_inc,
+            self.INC_ANG,
+            wl_offsets,
+            wl_weights,
+            ang_offsets,
+            ang_weights,
+            **kwargs
+        )
+        self._store(spec)
+
+    def _calculate_at(self, wls, **kwargs):
+        '''
+        Spectrum [R, T] of the film at arbitrary wavelengths with this
+        spectrum's incident angle. Does not touch self.spec.
+        '''
+        film = self.film
+        spec = np.empty(wls.shape[0] * 2)
+        if film.has_incoherent_substrate():
+            get_spectrum_incoherent(
+                spec, wls, film.get_d(), film.calculate_n_array(wls),
+                film.calculate_n_sub(wls), film.calculate_n_inc(wls),
+                self.INC_ANG, film.sub_thickness, film.calculate_n_exit(wls),
+                film.back_d, film.calculate_n_back_array(wls), **kwargs
+            )
+        else:
+            engines.get_engine('spectrum_indexed')(
+                spec, wls, film.get_d(), film.calculate_n_table(wls),
+                film.get_material_idx(), film.calculate_n_sub(wls),
+                film.calculate_n_inc(wls), self.INC_ANG, **kwargs
+            )
+        return spec
+
+    def calculate_wl_derivative(self, wls, **kwargs):
+        '''
+        dR / dwl and dT / dwl of the film at wls, neglecting dispersion.
+
+        Without dispersion the phase thicknesses only depend on d / wl, so
+        scaling all layers and the wavelength by the same factor leaves the
+        spectrum unchanged and dR / dwl = -1 / wl sum_i d_i dR / dd_i. This
+        costs one jacobian launch (tmm.get_jacobi_indexed).
+
+        Returns:
+            1d NDArray, size 2 * wls.shape[0]. [dR / dwl, dT / dwl]
+        '''
+        film = self.film
+        assert not film.has_incoherent_substrate(), \
+            'no gradients for incoherent substrates'
+        jacobi = np.empty((wls.shape[0] * 2, film.get_layer_number()))
+        engines.get_engine('jacobi_indexed')(
+            jacobi, wls, film.get_d(), film.calculate_n_table(wls),
+            film.get_material_idx(), film.calculate_n_sub(wls),
+            film.calculate_n_inc(wls), self.INC_ANG, **kwargs
+        )
+        # the adjoint jacobian is half the derivative
+        return -2 * (jacobi @ film.get_d()) / np.tile(wls, 2)
+
+    def calculate_adaptive(
+        self,
+        wl_min=None,
+        wl_max=None,
+        n_init=33,
+        tol=1e-3,
+        min_step=1e-3,
+        max_points=100000,
+        use_derivative=False,
+        **kwargs
+    ):
+        '''
+        Evaluate the spectrum on an adaptively refined, non-uniform grid.
+
+        Starts from n_init evenly spaced wavelengths. In every round the
+        midpoints of all unconverged intervals are calculated in one launch
+        and compared with the prediction from the interval ends (linear, or
+        cubic Hermite when use_derivative). Intervals where R or T deviates
+        more than tol are split and checked again; the others are done.
+        Flat stop bands are thus resolved with a few points while the edges
+        and the fringes get as many as they need.
+
+        The result is not stored in self.spec; WLS of this spectrum is
+        only used for the default wavelength range.
+
+        Parameters:
+            wl_min, wl_max (float):
+                wavelength range. Defaults to the range of WLS
+            n_init (int):
+                number of points of the initial grid
+            tol (float):
+                tolerated deviation of R and T from the interpolation
+            min_step (float):
+                intervals are not split below this width
+            max_points (int):
+                refinement stops when the grid would exceed this size
+            use_derivative (bool):
+                use dR / dwl (calculate_wl_derivative, neglects dispersion)
+                for a cubic prediction, which converges with fewer points in
+                smooth regions at the cost of one jacobian per round
+
+        Returns:
+            wls, R, T (1d NDArray): sorted non-uniform grid and spectrum
+        '''
+        wl_min = np.min(self.WLS) if wl_min is None else wl_min
+        wl_max = np.max(self.WLS) if wl_max is None else wl_max
+
+        def evaluate(wls):
+            spec = self._calculate_at(wls, **kwargs)
+            if use_derivative:
+                return np.append(
+                    spec, self.calculate_wl_derivative(wls, **kwargs))
+            return spec
+
+        def split(vals, n):
+            # [R, T(, dR, dT)] -> rows
+            return vals.reshape((-1, n))
+
+        wls = np.linspace(wl_min, wl_max, n_init)
+        vals = split(evaluate(wls), wls.shape[0])
+        # indices of the left ends of intervals to check
+        active = np.arange(wls.shape[0] - 1)
+
+        while active.shape[0] > 0 and \
+                wls.shape[0] + active.shape[0] <= max_points:
+            left, right = wls[active], wls[active + 1]
+            mid = (left + right) / 2
+            mid_vals = split(evaluate(mid), mid.shape[0])
+
+            v_l, v_r = vals[:2, active], vals[:2, active + 1]
+            pred = (v_l + v_r) / 2
+            if use_derivative:
+                h = right - left
+                pred += h * (vals[2:, active] - vals[2:, active + 1]) / 8
+            err = np.max(np.abs(mid_vals[:2] - pred), axis=0)
+            refine = (err > tol) & (right - left > 2 * min_step)
+
+            # keep all calculated points
+            order = np.argsort(np.append(wls, mid), kind='stable')
+            new_pos = np.empty(order.shape[0], dtype=int)
+            new_pos[order] = np.arange(order.shape[0])
+            wls = np.append(wls, mid)[order]
+            vals = np.append(vals, mid_vals, axis=1)[:, order]
+
+            # both halves of refined intervals: [left, mid] and [mid, right]
+            mid_pos = new_pos[wls.shape[0] - mid.shape[0]:][refine]
+            active = np.sort(np.append(mid_pos - 1, mid_pos))
+
+        return wls, vals[0], vals[1]
+
+    def calculate_incoherent(self, **kwargs):
+        '''
+        Spectrum of the film on a thick substrate which is passed
+        incoherently, including the back side. See
+        film.set_incoherent_substrate and tmm.incoherent.
+        '''
+        film = self.film
+        spec = np.empty(self.WLS.shape[0] * 2)
+        get_spectrum_incoherent(
+            spec,
+            self.WLS,
+            film.get_d(),
+            film.calculate_n_array(self.WLS),
+            self.n_sub,
+            self.n_inc,
+            self.INC_ANG,
+            film.sub_thickness,
+            film.calculate_n_exit(self.WLS),
+            film.back_d,
+            film.calculate_n_back_array(self.WLS),
+            **kwargs
+        )
+        self._store(spec)
 
     def outdate(self):
-        self.updated = False
+        self._version = None
 
     def is_updated(self):
-        return self.updated
+        return self._version is not None and \
+            self._version == self.film.get_version()
+
+    @property
+    def updated(self):
+        return self.is_updated()
 
     def get_R(self, **kwargs):
-        # if self.updated:
-        #     return self.spec_R
-        # else:
-        self.calculate(**kwargs)
+        '''
+        Reflectance of the current film. Calculated only if the film changed
+        since the last calculation, or if engine arguments are given.
+        The returned array is read-only.
+        '''
+        if kwargs or not self.is_updated():
+            self.calculate(**kwargs)
         return self.spec_R
 
     def get_T(self, **kwargs):
-        # if self.updated:
-        #     return self.spec_T
-        # else:
-        self.calculate(**kwargs)
+        if kwargs or not self.is_updated():
+            self.calculate(**kwargs)
         return self.spec_T
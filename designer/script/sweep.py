@@ -0,0 +1,225 @@
+"""sweep.py - parameter studies over a process pool, with checkpoint and
+resume.
+
+A sweep runs a case function on every point of a parameter grid, e.g.
+
+    def run_case(n_size, each_ot, rep):
+        film = EqOTFilm(np.zeros(n_size) + 2, each_ot * n_size, substrate=1.5)
+        AdamFreeFormOptimizer(film, target, 1000, ...).optimize()
+        return calculate_RMS_f_spec(film, target), film
+
+    runner = SweepRunner(run_case, 'results/total_ot', warmup=FreeFormFilm)
+    runner.run(grid(n_size=n_sizes, each_ot=each_ots, rep=range(3)))
+    records = runner.results(grid(...))
+
+The cases are executed in worker processes (spawned: CUDA contexts do not
+survive a fork), each of which warms up the engines once (see
+tmm.engines.warmup). Every case is written to its own pickle file in
+out_dir by the worker as soon as it completes, through a temporary file
+and a rename, so an interrupted sweep keeps everything finished so far and
+running it again skips those cases. Failures are captured with their
+traceback instead of stopping the sweep, and retried on the next run.
+
+The case function must be importable by the workers (defined at module
+level, not in __main__ of an interactive session) and its keyword
+arguments and result must be picklable.
+"""
+import hashlib
+import itertools
+import os
+import pickle
+import sys
+import time
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+
+
+def grid(**axes):
+    '''
+    Cartesian product of the parameter axes, the last varying fastest.
+
+    Returns:
+        list of dicts of keyword arguments
+    '''
+    names = list(axes.keys())
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*axes.values())
+    ]
+
+
+def _canonical(value):
+    '''
+    value with numpy scalars as python scalars and arrays as their full
+    contents, so that its repr does not depend on the numpy version and
+    does not elide long arrays
+    '''
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return ('ndarray', value.dtype.str, value.shape,
+                np.ascontiguousarray(value).tobytes())
+    if isinstance(value, (list, tuple)):
+        return type(value)(_canonical(v) for v in value)
+    if isinstance(value, dict):
+        return {k: _canonical(v) for k, v in value.items()}
+    return value
+
+
+def case_id(params):
+    '''File name stem of the case with keyword arguments params'''
+    key = repr(sorted(
+        (k, _canonical(v)) for k, v in params.items())).encode()
+    return 'case-' + hashlib.blake2b(key, digest_size=10).hexdigest()
+
+
+def _write_atomic(path, obj):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def _init_worker(path, engine_names):
+    # spawned workers start with a fresh interpreter
+    sys.path[:] = path
+    if engine_names:
+        import tmm.engines as engines
+        engines.warmup(engines=engine_names)
+
+
+def _run_case(run_case, params, path):
+    '''Run one case and write its record. Executed in the workers.'''
+    start = time.perf_counter()
+    try:
+        result, error = run_case(**params), None
+    except Exception:
+        result, error = None, traceback.format_exc()
+    record = {
+        'params': params,
+        'result': result,
+        'error': error,
+        'time': time.perf_counter() - start,
+    }
+    try:
+        _write_atomic(path, record)
+    except Exception:
+        # e.g. an unpicklable result
+        record = dict(record, result=None, error=traceback.format_exc())
+        _write_atomic(path, record)
+    return record['error'], record['time']
+
+
+class SweepRunner:
+    '''
+    Runs a case function on many keyword argument dicts in a process pool.
+
+    Attributes:
+        run_case (callable): params -> result, module level function
+        out_dir (str): one file per case, see case_id
+        processes (int): worker processes. Defaults to the CPU number. 0
+            runs the cases in this process
+        engine_names (list of str): engines every worker warms up
+        retry_failed (bool): run failed cases again when resuming
+    '''
+
+    def __init__(
+        self,
+        run_case,
+        out_dir,
+        processes=None,
+        warmup=None,
+        retry_failed=True,
+        show=False,
+    ):
+        '''
+        Parameters:
+            warmup: film type (its ENGINES) or list of engine names to warm
+                up in every worker. None for no warm-up
+        '''
+        self.run_case = run_case
+        self.out_dir = out_dir
+        self.processes = os.cpu_count() if processes is None else processes
+        if warmup is None or isinstance(warmup, (list, tuple)):
+            self.engine_names = list(warmup or [])
+        else:
+            self.engine_names = list(warmup.ENGINES)
+        self.retry_failed = retry_failed
+        self.show = show
+        os.makedirs(out_dir, exist_ok=True)
+
+    def path(self, params):
+        return os.path.join(self.out_dir, case_id(params) + '.pkl')
+
+    def load(self, params):
+        '''
+        Returns:
+            record of a completed case: dict of params, result, error
+            (traceback or None) and time (s). None if not run yet
+        '''
+        try:
+            with open(self.path(params), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _done(self, params):
+        record = self.load(params)
+        return record is not None and \
+            (record['error'] is None or not self.retry_failed)
+
+    def run(self, cases):
+        '''
+        Run the cases not completed in out_dir yet.
+
+        Returns:
+            dict case_id -> error of the cases run now: None, the traceback,
+            or a message if the worker died
+        '''
+        ids = [case_id(p) for p in cases]
+        assert len(set(ids)) == len(ids), 'duplicated cases'
+        todo = [p for p in cases if not self._done(p)]
+        if self.show:
+            print(f'{len(cases) - len(todo)} of {len(cases)} cases done, '
+                  f'running {len(todo)}')
+
+        errors = {}
+        if self.processes == 0:
+            _init_worker(sys.path, self.engine_names)
+            for params in todo:
+                errors[case_id(params)] = self._report(
+                    params, *_run_case(self.run_case, params, self.path(params)))
+            return errors
+
+        with ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(list(sys.path), self.engine_names),
+        ) as pool:
+            futures = {
+                pool.submit(_run_case, self.run_case, p, self.path(p)): p
+                for p in todo
+            }
+            for future in as_completed(futures):
+                params = futures[future]
+                try:
+                    error, t = future.result()
+                except BrokenProcessPool as e:
+                    # the worker died (e.g. out of memory): not written
+                    error, t = f'worker process died: {e!r}', float('nan')
+                errors[case_id(params)] = self._report(params, error, t)
+        return errors
+
+    def _report(self, params, error, t):
+        if self.show:
+            status = 'done' if error is None else 'FAILED'
+            print(f'{params}: {status} in {t:.1f} s')
+        return error
+
+    def results(self, cases):
+        '''Records of the cases (see load), None for those not completed'''
+        return [self.load(p) for p in cases]
@@ -0,0 +1,321 @@
+"""autotune.py - launch configuration autotuner for the CUDA kernels.
+
+The best number of threads per block depends on the kernel (local arrays of
+the adjoint kernels limit occupancy), the number of wavelengths (how many
+blocks there are to fill the SMs) and the device. Instead of hard-coding it,
+the entry points in tmm/ launch their kernels through launch() / launch_2d().
+The first time a (kernel, problem shape, device) combination is seen every
+candidate configuration is timed and the winner is persisted in a json file,
+so later launches (also in other processes) only do a dict lookup.
+
+Problem shapes are bucketed to the next power of 2 so that the cache does not
+grow with every new layer number.
+
+Set the environment variable TFD_AUTOTUNE=0 to disable tuning and launch with
+the previous fixed block size of 16. TFD_AUTOTUNE_CACHE sets the cache file.
+"""
+import json
+import os
+import time
+import numpy as np
+
+
+DEFAULT_BLOCK_SIZE = 16
+DEFAULT_BLOCK_SHAPE_2D = (16, 1)
+CANDIDATES = (16, 32, 64, 128, 256)
+# (threads along wavelengths, threads along batch)
+CANDIDATES_2D = ((16, 1), (32, 1), (64, 1), (16, 4), (32, 4), (8, 8), (16, 16))
+
+
+def default_cache_path():
+    return os.environ.get(
+        'TFD_AUTOTUNE_CACHE',
+        os.path.join(
+            os.path.expanduser('~'),
+            '.cache',
+            'thin_film_designer',
+            'launch_config.json'
+        )
+    )
+
+
+def _bucket(x):
+    '''Round up to the next power of 2'''
+    x = int(x)
+    return 1 if x <= 1 else 1 << (x - 1).bit_length()
+
+
+def _cuda_synchronize():
+    from numba import cuda
+    cuda.synchronize()
+
+
+def _launch_errors():
+    '''errors of a launch configuration the device cannot run'''
+    from numba.cuda.cudadrv.driver import CudaAPIError
+    return (CudaAPIError,)
+
+
+def _cuda_device_name():
+    from numba import cuda
+    try:
+        name = cuda.get_current_device().name
+    except Exception:
+        return 'unknown'
+    if isinstance(name, bytes):
+        name = name.decode()
+    return str(name)
+
+
+class LaunchAutotuner:
+    '''
+    Benchmarks launch configurations of CUDA kernels and remembers the best.
+
+    Attributes:
+        cache_path (str):
+            json file the winners are persisted in. None to keep them in
+            memory only.
+        candidates (tuple of int):
+            block sizes tried for 1-d launches
+        candidates_2d (tuple of (int, int)):
+            block shapes tried for 2-d launches (batched kernels)
+        repeats (int):
+            timed launches per candidate. The minimum is taken.
+        timer (callable):
+            returns the current time in seconds. Injectable for testing.
+        synchronize (callable):
+            blocks until the launched kernel finished. Injectable for testing.
+        device_name (str):
+            part of the cache key since the optimum differs between GPUs
+    '''
+
+    def __init__(
+        self,
+        cache_path=None,
+        candidates=CANDIDATES,
+        candidates_2d=CANDIDATES_2D,
+        repeats=3,
+        timer=time.perf_counter,
+        synchronize=_cuda_synchronize,
+        device_name=None,
+    ):
+        self.cache_path = cache_path
+        self.candidates = tuple(candidates)
+        self.candidates_2d = tuple(tuple(c) for c in candidates_2d)
+        self.repeats = repeats
+        self.timer = timer
+        self.synchronize = synchronize
+        self._device_name = device_name
+        self.configs = {}
+        self._load()
+
+    # persistence
+
+    def _load(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r') as f:
+                self.configs = json.load(f)
+        except (OSError, ValueError):
+            # corrupted cache: start over
+            self.configs = {}
+
+    def _save(self):
+        if self.cache_path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)),
+                    exist_ok=True)
+        # merge with winners other processes found in the meantime
+        configs = {}
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, 'r') as f:
+                    configs = json.load(f)
+            except (OSError, ValueError):
+                pass
+        configs.update(self.configs)
+        tmp_path = f'{self.cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(configs, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.cache_path)
+        self.configs = configs
+
+    def get_device_name(self):
+        if self._device_name is None:
+            self._device_name = _cuda_device_name()
+        return self._device_name
+
+    def make_key(self, name, shape):
+        shape = '_'.join(str(_bucket(s)) for s in shape)
+        return f'{self.get_device_name()}|{name}|{shape}'
+
+    # benchmarking
+
+    def _time(self, kernel, grid, block, args, reset):
+        '''
+        Minimum time of the launch with the given configuration. inf when
+        the device refuses it (e.g. too many resources requested for
+        launch); any other error is raised.
+        '''
+        launch_errors = _launch_errors()
+        best = float('inf')
+        for _ in range(self.repeats):
+            if reset is not None:
+                reset()
+            start = self.timer()
+            try:
+                kernel[grid, block](*args)
+                self.synchronize()
+            except launch_errors:
+                return float('inf')
+            best = min(best, self.timer() - start)
+        return best
+
+    def _tune(self, key, configs, grid_of, kernel, args, reset):
+        # the first launch includes compilation: do not time it
+        if reset is not None:
+            reset()
+        kernel[grid_of(configs[0]), configs[0]](*args)
+        self.synchronize()
+
+        times = [self._time(kernel, grid_of(c), c, args, reset)
+                 for c in configs]
+        if np.isinf(np.min(times)):
+            raise RuntimeError(f'no launch configuration of {key} works')
+        best = configs[int(np.argmin(times))]
+        self.configs[key] = list(best) if isinstance(best, tuple) else best
+        self._save()
+        return best
+
+    def block_size(self, name, kernel, n_threads, args, shape=None,
+                   reset=None, candidates=None):
+        '''
+        Returns the best block size for a 1-d launch over n_threads threads,
+        benchmarking the candidates with args if not known yet.
+
+        Parameters:
+            name (str): key of the kernel in the cache
+            kernel: the cuda kernel
+            n_threads (int): number of threads needed (e.g. wavelengths)
+            args (tuple): arguments of the kernel
+            shape (tuple of int):
+                problem size the best configuration depends on, e.g.
+                (wls_size, layer_number). Defaults to (n_threads,)
+            reset (callable):
+                called before every launch, for kernels that accumulate into
+                their output
+            candidates (tuple of int):
+                overrides self.candidates for this kernel
+        '''
+        key = self.make_key(name, (n_threads,) if shape is None else shape)
+        if key in self.configs:
+            return self.configs[key]
+        candidates = self.candidates if candidates is None else candidates
+        # no need to try blocks much larger than the problem
+        configs = [c for c in candidates if c < 2 * _bucket(n_threads)]
+        configs = configs if len(configs) > 0 else [min(candidates)]
+
+        return self._tune(
+            key,
+            configs,
+            lambda b: (n_threads + b - 1) // b,
+            kernel,
+            args,
+            reset
+        )
+
+    def block_shape_2d(self, name, kernel, n_threads, args, shape=None,
+                       reset=None, candidates=None):
+        '''
+        Same as block_size, for a 2-d launch over n_threads = (nx, ny)
+        threads. Returns a (bx, by) tuple.
+        '''
+        nx, ny = n_threads
+        key = self.make_key(name, n_threads if shape is None else shape)
+        if key in self.configs:
+            return tuple(self.configs[key])
+        candidates = self.candidates_2d if candidates is None else \
+            tuple(tuple(c) for c in candidates)
+        configs = [c for c in candidates
+                   if c[0] < 2 * _bucket(nx) and c[1] < 2 * _bucket(ny)]
+        configs = configs if len(configs) > 0 else [candidates[0]]
+
+        return self._tune(
+            key,
+            configs,
+            lambda b: ((nx + b[0] - 1) // b[0], (ny + b[1] - 1) // b[1]),
+            kernel,
+            args,
+            reset
+        )
+
+    def launch(self, name, kernel, n_threads, args, shape=None, reset=None,
+               candidates=None):
+        '''Launch kernel over n_threads threads with the best block size.'''
+        b = self.block_size(
+            name, kernel, n_threads, args, shape, reset, candidates)
+        if reset is not None:
+            reset()
+        kernel[(n_threads + b - 1) // b, b](*args)
+
+    def launch_2d(self, name, kernel, n_threads, args, shape=None,
+                  reset=None, candidates=None):
+        '''Launch kernel over n_threads = (nx, ny) threads'''
+        b = self.block_shape_2d(
+            name, kernel, n_threads, args, shape, reset, candidates)
+        nx, ny = n_threads
+        if reset is not None:
+            reset()
+        kernel[((nx + b[0] - 1) // b[0], (ny + b[1] - 1) // b[1]), b](*args)
+
+
+_tuner = None
+
+
+def enabled():
+    return os.environ.get('TFD_AUTOTUNE', '1') != '0'
+
+
+def get_tuner():
+    '''Process wide autotuner persisting to default_cache_path()'''
+    global _tuner
+    if _tuner is None:
+        _tuner = LaunchAutotuner(cache_path=default_cache_path())
+    return _tuner
+
+
+def set_tuner(tuner):
+    '''Replace the process wide autotuner, e.g. with an in-memory one'''
+    global _tuner
+    _tuner = tuner
+
+
+def launch(name, kernel, n_threads, args, shape=None, reset=None,
+           candidates=None):
+    '''
+    Launch a 1-d kernel over n_threads threads with the autotuned block size.
+    When autotuning is disabled, DEFAULT_BLOCK_SIZE or the first of the
+    given candidates is used.
+    '''
+    if not enabled():
+        b = DEFAULT_BLOCK_SIZE if candidates is None else candidates[0]
+        if reset is not None:
+            reset()
+        kernel[(n_threads + b - 1) // b, b](*args)
+        return
+    get_tuner().launch(name, kernel, n_threads, args, shape, reset, candidates)
+
+
+def launch_2d(name, kernel, n_threads, args, shape=None, reset=None,
+              candidates=None):
+    '''2-d counterpart of launch. n_threads is (nx, ny)'''
+    if not enabled():
+        b = DEFAULT_BLOCK_SHAPE_2D if candidates is None else candidates[0]
+        nx, ny = n_threads
+        if reset is not None:
+            reset()
+        kernel[((nx + b[0] - 1) // b[0], (ny + b[1] - 1) // b[1]), b](*args)
+        return
+    get_tuner().launch_2d(
+        name, kernel, n_threads, args, shape, reset, candidates)
@@ -0,0 +1,161 @@
+"""engines.py - lazy access to the TMM engines.
+
+Importing a CUDA engine module imports numba.cuda, which probes the driver,
+and defining the kernels is not free either. Films, spectra and optimizers
+therefore look the engines up by name here and the module is only imported
+the first time the engine is actually called.
+
+All kernels are compiled with cache=True so that the machine code is stored
+on disk (next to the sources in __pycache__, or in NUMBA_CACHE_DIR) and a
+fresh process only has to load it. warmup() can be used to pay the remaining
+cost (loading / compiling the signatures a film needs) up front.
+"""
+import importlib
+import numpy as np
+
+
+# name -> (module, function)
+ENGINES = {
+    'spectrum_simple': ('tmm.get_spectrum', 'get_spectrum_simple'),
+    'spectrum_free': ('tmm.get_spectrum', 'get_spectrum_free'),
+    # also parallel over layers. For very deep stacks at few wavelengths
+    'spectrum_free_scan': ('tmm.get_spectrum_scan', 'get_spectrum_free_scan'),
+    'jacobi_simple': ('tmm.get_jacobi_adjoint', 'get_jacobi_simple'),
+    # non-adjoint implementation, kept as the default of grad_helper.stack_J
+    'jacobi_simple_direct': ('tmm.get_jacobi', 'get_jacobi_simple'),
+    'jacobi_free_form': ('tmm.get_jacobi_n_adjoint', 'get_jacobi_free_form'),
+    # take a (wls, materials) table of n and the material of each layer
+    # instead of a dense (wls, layers) array
+    'spectrum_indexed': ('tmm.get_spectrum_indexed', 'get_spectrum_indexed'),
+    'jacobi_indexed': ('tmm.get_jacobi_indexed', 'get_jacobi_indexed'),
+    # indexed, averaged over wavelength and angle quadrature nodes
+    'spectrum_averaged': ('tmm.get_spectrum_averaged', 'get_spectrum_averaged'),
+    'jacobi_averaged': ('tmm.get_spectrum_averaged', 'get_jacobi_averaged'),
+    # indexed spectra and jacobians of a batch of films in one launch
+    'jacobi_batched': ('tmm.get_jacobi_batched', 'get_jacobi_batched'),
+    'spectrum_batched': ('tmm.get_spectrum_batched', 'get_spectrum_batched'),
+}
+
+_loaded = {}
+
+
+def get_engine(name):
+    '''
+    Returns the engine function registered under name. The module defining
+    it is imported on first use.
+    '''
+    if name not in _loaded:
+        try:
+            module_name, func_name = ENGINES[name]
+        except KeyError:
+            raise ValueError(f'unknown engine: {name}')
+        module = importlib.import_module(module_name)
+        _loaded[name] = getattr(module, func_name)
+    return _loaded[name]
+
+
+def lazy(name):
+    '''
+    Returns a function that forwards to the engine registered under name
+    without importing it. Useful for default arguments and class attributes.
+    '''
+    def engine(*args, **kwargs):
+        return get_engine(name)(*args, **kwargs)
+    engine.__name__ = name
+    engine.engine_name = name
+    return engine
+
+
+def _warmup_spectrum(engine, wls, d, n_layers, n_sub, n_inc):
+    engine(np.empty(wls.shape[0] * 2), wls, d, n_layers, n_sub, n_inc, 0.)
+
+
+def _warmup_jacobi(engine, wls, d, n_layers, n_sub, n_inc):
+    engine(np.empty((wls.shape[0] * 2, d.shape[0])),
+           wls, d, n_layers, n_sub, n_inc, 0.)
+
+
+def _warmup_spectrum_indexed(engine, wls, d, n_layers, n_sub, n_inc):
+    material_idx = np.arange(d.shape[0], dtype='uint8')
+    engine(np.empty(wls.shape[0] * 2), wls, d, n_layers, material_idx,
+           n_sub, n_inc, 0.)
+
+
+def _warmup_jacobi_indexed(engine, wls, d, n_layers, n_sub, n_inc):
+    material_idx = np.arange(d.shape[0], dtype='uint8')
+    engine(np.empty((wls.shape[0] * 2, d.shape[0])), wls, d, n_layers,
+           material_idx, n_sub, n_inc, 0.)
+
+
+
+def _warmup_spectrum_averaged(engine, wls, d, n_layers, n_sub, n_inc):
+    material_idx = np.arange(d.shape[0], dtype='uint8')
+    engine(np.empty(wls.shape[0] * 2), wls, d, n_layers[:, np.newaxis, :],
+           material_idx, n_sub[:, np.newaxis], n_inc[:, np.newaxis], 0.)
+
+
+def _warmup_jacobi_averaged(engine, wls, d, n_layers, n_sub, n_inc):
+    material_idx = np.arange(d.shape[0], dtype='uint8')
+    engine(np.empty((wls.shape[0] * 2, d.shape[0])), wls, d,
+           n_layers[:, np.newaxis, :], material_idx, n_sub[:, np.newaxis],
+           n_inc[:, np.newaxis], 0.)
+
+
+def _warmup_jacobi_batched(engine, wls, d, n_layers, n_sub, n_inc):
+    material_idx = np.arange(d.shape[0], dtype='uint8')[np.newaxis, :]
+    engine(np.empty((1, wls.shape[0] * 2)),
+           np.empty((1, wls.shape[0] * 2, d.shape[0])), wls,
+           d[np.newaxis, :], n_layers, material_idx, n_sub, n_inc, 0.)
+
+
+def _warmup_spectrum_batched(engine, wls, d, n_layers, n_sub, n_inc):
+    material_idx = np.arange(d.shape[0], dtype='uint8')[np.newaxis, :]
+    engine(np.empty((1, wls.shape[0] * 2)), wls, d[np.newaxis, :], n_layers,
+           material_idx, n_sub, n_inc, 0.)
+
+
+_WARMUP = {
+    'spectrum_simple': _warmup_spectrum,
+    'spectrum_free': _warmup_spectrum,
+    'spectrum_free_scan': _warmup_spectrum,
+    'jacobi_simple': _warmup_jacobi,
+    'jacobi_simple_direct': _warmup_jacobi,
+    'jacobi_free_form': _warmup_jacobi,
+    'spectrum_indexed': _warmup_spectrum_indexed,
+    'jacobi_indexed': _warmup_jacobi_indexed,
+    'spectrum_averaged': _warmup_spectrum_averaged,
+    'jacobi_averaged': _warmup_jacobi_averaged,
+    'jacobi_batched': _warmup_jacobi_batched,
+    'spectrum_batched': _warmup_spectrum_batched,
+}
+
+
+def warmup(film_type=None, engines=None):
+    '''
+    Compiles (or loads from the on-disk cache) the engines a film type needs
+    by running them once on a tiny problem with the same argument types as
+    in production: float64 wls and d, complex128 refractive indices.
+
+    Parameters:
+        film_type:
+            a Film class or instance. Its ENGINES attribute lists the names
+            of the engines to warm up.
+        engines (list of str):
+            names of engines to warm up. Overrides film_type.
+    Returns:
+        list of the names of warmed up engines
+    '''
+    if engines is None:
+        if film_type is None:
+            engines = list(ENGINES.keys())
+        else:
+            engines = list(film_type.ENGINES)
+
+    wls = np.array([500., 600.])
+    d = np.array([100., 100.])
+    n_layers = np.array([[1.5, 2.], [1.5, 2.]], dtype='complex128')
+    n_sub = np.array([1.5, 1.5], dtype='complex128')
+    n_inc = np.array([1., 1.], dtype='complex128')
+    for name in engines:
+        _WARMUP[name](get_engine(name), wls, d, n_layers, n_sub, n_inc)
+    return engines
@@ -1,5 +1,6 @@
 import numpy as np
 from numba import cuda
+from tmm import autotune
 from film import TwoMaterialFilm
 import cmath
 from tmm.mat_lib import mul_right, tsp  # 2 * 2 matrix optr
@@ -47,21 +48,24 @@ def get_E(wls, d, n_layers, n_sub, n_inc, inc_ang):
     # allocate space for E spec on GPU
     E_spec_device = cuda.device_array((wls_size * 2, 2), dtype="complex128")
 
-    # invoke kernel
-    block_size = 16  # threads per block
-    grid_size = (wls_size + block_size - 1) // block_size  # blocks per grid
-
-    forward_propagation_simple_E[grid_size, block_size](
-        E_spec_device,
-        wls_device,
-        d_device,
-        n_A_device,
-        n_B_device,
-        n_sub_device,
-        n_inc_device,
-        inc_ang_rad,
+    # invoke kernel with the autotuned block size. See tmm.autotune
+    autotune.launch(
+        'get_E.forward_propagation_simple_E',
+        forward_propagation_simple_E,
         wls_size,
-        layer_number
+        (
+            E_spec_device,
+            wls_device,
+            d_device,
+            n_A_device,
+            n_B_device,
+            n_sub_device,
+            n_inc_device,
+            inc_ang_rad,
+            wls_size,
+            layer_number
+        ),
+        shape=(wls_size, layer_number)
     )
     cuda.synchronize()
     # copy to pre-allocated space
@@ -69,7 +73,7 @@ def get_E(wls, d, n_layers, n_sub, n_inc, inc_ang):
     return E_spec
 
 
-@cuda.jit
+@cuda.jit(cache=True)
 def forward_propagation_simple_E(E_spec, wls, d, n_A_arr, n_B_arr,
                                  n_sub_arr, n_inc_arr, inc_ang, wls_size, layer_number):
     """
@@ -1,6 +1,7 @@
 import numpy as np
 import cmath
 from numba import cuda
+from tmm import autotune
 from tmm.mat_lib import mul_to  # multiply
 from tmm.mat_lib import tsp  # transpose
 
@@ -73,28 +74,34 @@ def get_jacobi_simple(
         dtype="float64"
     )
 
-    # invoke kernel
-    block_size = 1  # threads per block
-    grid_size = (wls_size + block_size - 1) // block_size  # blocks per grid
-
-    forward_and_backward_propagation[grid_size, block_size](
-        jacobi_device,
-        wls_device,
-        d_device,
-        n_A_device,
-        n_B_device,
-        n_sub_device,
-        n_inc_device,
-        inc_ang_rad,
+    # invoke kernel with the autotuned block size. See tmm.autotune
+    autotune.launch(
+        'get_jacobi.forward_and_backward_propagation',
+        forward_and_backward_propagation,
         wls_size,
-        layer_number
+        (
+            jacobi_device,
+            wls_device,
+            d_device,
+            n_A_device,
+            n_B_device,
+            n_sub_device,
+            n_inc_device,
+            inc_ang_rad,
+            wls_size,
+            layer_number
+        ),
+        shape=(wls_size, layer_number),
+        # large local arrays: this kernel used to be launched with 1 thread
+        # per block
+        candidates=(1, 2, 4, 8, 16)
     )
     cuda.synchronize()
     # copy to pre-allocated space
     jacobi_device.copy_to_host(jacobi)
 
 
-@cuda.jit
+@cuda.jit(cache=True)
 def forward_and_backward_propagation(jacobi, wls, d, n_A_arr, n_B_arr,
                                      n_sub_arr, n_inc_arr, inc_ang, wls_size, layer_number):
     """
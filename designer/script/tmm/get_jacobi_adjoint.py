@@ -1,6 +1,7 @@
 import numpy as np
 import cmath
 from numba import cuda
+from tmm import autotune
 from tmm.mat_lib import mul_to, mul_right, mul_left, hadm_mul  # multiply
 from tmm.mat_lib import tsp  # transpose
 
@@ -76,30 +77,33 @@ def get_jacobi_simple(
         dtype="float64"
     )
 
-    # invoke kernel
-    block_size = 16  # threads per block
-    grid_size = (wls_size + block_size - 1) // block_size  # blocks per grid
-
-    forward_and_backward_propagation[grid_size, block_size](
-        jacobi_device,
-        wls_device,
-        d_device,
-        n_A_device,
-        n_B_device,
-        n_sub_device,
-        n_inc_device,
-        inc_ang_rad,
+    # invoke kernel with the autotuned block size. See tmm.autotune
+    autotune.launch(
+        'get_jacobi_adjoint.forward_and_backward_propagation',
+        forward_and_backward_propagation,
         wls_size,
-        layer_number,
-        s_ratio,
-        p_ratio
+        (
+            jacobi_device,
+            wls_device,
+            d_device,
+            n_A_device,
+            n_B_device,
+            n_sub_device,
+            n_inc_device,
+            inc_ang_rad,
+            wls_size,
+            layer_number,
+            s_ratio,
+            p_ratio
+        ),
+        shape=(wls_size, layer_number)
     )
     cuda.synchronize()
     # copy to pre-allocated space
     jacobi_device.copy_to_host(jacobi)
 
 
-@cuda.jit
+@cuda.jit(cache=True)
 def forward_and_backward_propagation(
     jacobi,
     wls,
@@ -326,7 +330,7 @@ def forward_and_backward_propagation(
         (partial_d_Ts * s_ratio + partial_d_Tp * p_ratio).real / (s_ratio + p_ratio)
 
 
-@cuda.jit
+@cuda.jit(device=True, cache=True)
 def calc_M(Ms, Mp, cosi, ni, di, wl):
 
     phi = 2 * cmath.pi * 1j * cosi * ni * di / wl
@@ -344,7 +348,7 @@ def calc_M(Ms, Mp, cosi, ni, di, wl):
     Mp[1, 1] = coshi
 
 
-@cuda.jit
+@cuda.jit(device=True, cache=True)
 def calc_M_inv(Ms, Mp, cosi, ni, di, wl):
 
     phi = 2 * cmath.pi * 1j * cosi * ni * di / wl
@@ -362,7 +366,7 @@ def calc_M_inv(Ms, Mp, cosi, ni, di, wl):
     Mp[1, 1] = coshi
 
 
-@cuda.jit
+@cuda.jit(device=True, cache=True)
 def fill_arr(A, a00, a01, a10, a11):
     A[0, 0] = a00
     A[0, 1] = a01
@@ -370,7 +374,7 @@ def fill_arr(A, a00, a01, a10, a11):
     A[1, 1] = a11
 
 
-@cuda.jit
+@cuda.jit(device=True, cache=True)
 def calc_partial_d_M(res_mat_s, res_mat_p, cosi, ni, di, wl):
 
     phi = 2 * cmath.pi * 1j * cosi * ni * di / wl
@@ -0,0 +1,267 @@
+import numpy as np
+import cmath
+from numba import cuda
+from tmm import autotune
+from tmm.mat_lib import mul_to, mul_right, mul_left, hadm_mul  # multiply
+from tmm.get_jacobi_adjoint import calc_M, calc_M_inv, fill_arr, \
+    calc_partial_d_M
+
+
+def get_jacobi_batched(
+    spectrum,
+    jacobi,
+    wls,
+    d,
+    n_table,
+    material_idx,
+    n_sub,
+    n_inc,
+    inc_ang,
+    s_ratio=1,
+    p_ratio=1
+):
+    """
+    Spectra and Jacobi matrices w.r.t. the thicknesses of a batch of films
+    made of the same materials, in one launch over (wavelength, film).
+    Per film the same as tmm.get_spectrum_indexed and
+    tmm.get_jacobi_indexed (half the derivative, as get_jacobi_adjoint).
+
+    Films with fewer layers are padded with zero-thickness layers, which do
+    not change the spectrum.
+
+    Parameters:
+        spectrum (2d np.array):
+            size: films number \cross 2wls.shape[0]
+            pre-allocated memory space for returning the spectra
+            (R spectrum + T spectrum of every film)
+        jacobi (3d np.array):
+            size: films number \cross 2wls.shape[0] \cross d.shape[1]
+            pre-allocated memory space for returning the jacobians
+        wls (1d np.array):
+            wavelengths of the target spectrum
+        d (2d np.array):
+            films number \cross layer number. Thicknesses of every film
+        n_table (2d np.array):
+            wls.shape[0] \cross number of materials.
+            refractive indices of each *material*, shared by the films
+        material_idx (2d np.array):
+            same size as d, small unsigned int. Column of n_table of each
+            layer of every film
+        n_sub (1d np.array):
+            refractive indices of the substrate
+        n_inc (1d np.array):
+            refractive indices of the incident material
+        inc_ang (float):
+            incident angle in degree
+        s_ratio, p_ratio (float):
+            portions of s and p polarized light
+    """
+    film_number, layer_number = d.shape
+    inc_ang_rad = inc_ang / 180 * np.pi
+    wls_size = wls.shape[0]
+
+    n_table = np.ascontiguousarray(n_table, dtype='complex128')
+    cos_table = np.sqrt(
+        1 - ((n_inc.reshape((-1, 1)) / n_table) * np.sin(inc_ang_rad)) ** 2)
+
+    wls_device = cuda.to_device(wls)
+    d_device = cuda.to_device(np.ascontiguousarray(d))
+    n_table_device = cuda.to_device(n_table)
+    cos_table_device = cuda.to_device(cos_table)
+    material_idx_device = cuda.to_device(np.ascontiguousarray(material_idx))
+    n_sub_device = cuda.to_device(n_sub)
+    n_inc_device = cuda.to_device(n_inc)
+
+    spectrum_device = cuda.device_array(
+        (film_number, wls_size * 2), dtype="float64")
+    jacobi_device = cuda.device_array(
+        (film_number, wls_size * 2, layer_number), dtype="float64")
+
+    # invoke kernel with the autotuned block shape. See tmm.autotune
+    autotune.launch_2d(
+        'get_jacobi_batched.forward_and_backward_propagation_batched',
+        forward_and_backward_propagation_batched,
+        (wls_size, film_number),
+        (
+            spectrum_device,
+            jacobi_device,
+            wls_device,
+            d_device,
+            n_table_device,
+            cos_table_device,
+            material_idx_device,
+            n_sub_device,
+            n_inc_device,
+            inc_ang_rad,
+            wls_size,
+            film_number,
+            layer_number,
+            s_ratio,
+            p_ratio
+        ),
+        shape=(wls_size, film_number, layer_number)
+    )
+    cuda.synchronize()
+    spectrum_device.copy_to_host(spectrum)
+    jacobi_device.copy_to_host(jacobi)
+
+
+@cuda.jit(cache=True)
+def forward_and_backward_propagation_batched(
+    spectrum,
+    jacobi,
+    wls,
+    d,
+    n_table,
+    cos_table,
+    material_idx,
+    n_sub_arr,
+    n_inc_arr,
+    inc_ang,
+    wls_size,
+    film_number,
+    layer_number,
+    s_ratio,
+    p_ratio
+):
+    """
+    Each thread calculates R, T and their jacobians of one film at one
+    wavelength, as in get_jacobi_indexed.
+    """
+    wl_idx, k = cuda.grid(2)
+    if wl_idx > wls_size - 1 or k > film_number - 1:
+        return
+    wl = wls[wl_idx]
+    n_sub = n_sub_arr[wl_idx]
+    n_inc = n_inc_arr[wl_idx]
+    cos_inc = cmath.cos(inc_ang)
+    cos_sub = cmath.sqrt(1 - ((n_inc / n_sub) * cmath.sin(inc_ang)) ** 2)
+
+    '''
+    FORWARD PROPAGATION
+    '''
+    W_back_s = cuda.local.array((2, 2), dtype="complex128")
+    W_back_p = cuda.local.array((2, 2), dtype="complex128")
+
+    fill_arr(W_back_s, 0.5, 0.5 / cos_inc / n_inc, 0.5, -0.5 / cos_inc / n_inc)
+    fill_arr(W_back_p, 0.5 / n_inc, 0.5 / cos_inc, 0.5 / n_inc, -0.5 / cos_inc)
+
+    Ms = cuda.local.array((2, 2), dtype="complex128")
+    Mp = cuda.local.array((2, 2), dtype="complex128")
+
+    for i in range(layer_number):
+        m = material_idx[k, i]
+        calc_M(Ms, Mp, cos_table[wl_idx, m], n_table[wl_idx, m], d[k, i], wl)
+        mul_right(W_back_s, Ms)
+        mul_right(W_back_p, Mp)
+
+    fill_arr(Ms, 1, 1, n_sub * cos_sub, -n_sub * cos_sub)
+    fill_arr(Mp, n_sub, n_sub, cos_sub, -cos_sub)
+    mul_right(W_back_s, Ms)
+    mul_right(W_back_p, Mp)
+
+    rs = W_back_s[1, 0] / W_back_s[0, 0]
+    rp = W_back_p[1, 0] / W_back_p[0, 0]
+    ts = 1 / W_back_s[0, 0]
+    tp = 1 / W_back_p[0, 0]
+
+    R = (s_ratio * rs * rs.conjugate() + p_ratio * rp * rp.conjugate()) \
+        / (s_ratio + p_ratio)
+    spectrum[k, wl_idx] = R.real
+    T = cos_sub * n_sub / (cos_inc * n_inc) * \
+        (s_ratio * ts * ts.conjugate() + p_ratio * tp * tp.conjugate()) \
+        / (s_ratio + p_ratio)
+    spectrum[k, wl_idx + wls_size] = T.real
+
+    '''
+    BACKWARD PROPAGATION
+    '''
+    partial_Ws_R = cuda.local.array((2, 2), dtype="complex128")
+    partial_Wp_R = cuda.local.array((2, 2), dtype="complex128")
+    partial_Ws_T = cuda.local.array((2, 2), dtype="complex128")
+    partial_Wp_T = cuda.local.array((2, 2), dtype="complex128")
+
+    fill_arr(
+        partial_Ws_R,
+        rs.conjugate() * -(W_back_s[1, 0] / W_back_s[0, 0] ** 2),
+        0,
+        rs.conjugate() * 1 / W_back_s[0, 0],
+        0
+    )
+    fill_arr(
+        partial_Wp_R,
+        rp.conjugate() * -(W_back_p[1, 0] / W_back_p[0, 0] ** 2),
+        0,
+        rp.conjugate() * 1 / W_back_p[0, 0],
+        0
+    )
+    fill_arr(
+        partial_Ws_T,
+        ts.conjugate() * (-1 / W_back_s[0, 0] ** 2) *
+            (cos_sub * n_sub / (cos_inc * n_inc)),
+        0,
+        0,
+        0
+    )
+    fill_arr(
+        partial_Wp_T,
+        tp.conjugate() * (-1 / W_back_p[0, 0] ** 2) *
+            (cos_sub * n_sub / (cos_inc * n_inc)),
+        0,
+        0,
+        0
+    )
+
+    W_front_s = cuda.local.array((2, 2), dtype="complex128")
+    W_front_p = cuda.local.array((2, 2), dtype="complex128")
+    Ms_inv = cuda.local.array((2, 2), dtype='complex128')
+    Mp_inv = cuda.local.array((2, 2), dtype='complex128')
+    partial_d_Ms = cuda.local.array((2, 2), dtype='complex128')
+    partial_d_Mp = cuda.local.array((2, 2), dtype='complex128')
+    tmp_res_s = cuda.local.array((2, 2), dtype='complex128')
+    tmp_res_p = cuda.local.array((2, 2), dtype='complex128')
+
+    fill_arr(W_front_s, 0.5, 0.5 / cos_inc /
+             n_inc, 0.5, -0.5 / cos_inc / n_inc)
+    fill_arr(W_front_p, 0.5 / n_inc, 0.5 /
+             cos_inc, 0.5 / n_inc, -0.5 / cos_inc)
+
+    fill_arr(Ms_inv, 1, 1, n_inc * cos_inc, -n_inc * cos_inc)
+    fill_arr(Mp_inv, n_inc, n_inc, cos_inc, -cos_inc)
+    mul_left(Ms_inv, W_back_s)  # D_0 to left
+    mul_left(Mp_inv, W_back_p)
+
+    for i in range(layer_number):
+        m = material_idx[k, i]
+        cosi = cos_table[wl_idx, m]
+        ni = n_table[wl_idx, m]
+
+        # W_back: from layer i + 1 to the substrate
+        calc_M_inv(Ms_inv, Mp_inv, cosi, ni, d[k, i], wl)
+        mul_left(Ms_inv, W_back_s)
+        mul_left(Mp_inv, W_back_p)
+
+        calc_partial_d_M(partial_d_Ms, partial_d_Mp, cosi, ni, d[k, i], wl)
+
+        mul_to(W_front_s, partial_d_Ms, tmp_res_s)
+        mul_to(tmp_res_s, W_back_s, tmp_res_s)
+
+        mul_to(W_front_p, partial_d_Mp, tmp_res_p)
+        mul_to(tmp_res_p, W_back_p, tmp_res_p)
+
+        partial_d_Rs = hadm_mul(tmp_res_s, partial_Ws_R)
+        partial_d_Rp = hadm_mul(tmp_res_p, partial_Wp_R)
+        jacobi[k, wl_idx, i] = \
+            (partial_d_Rs * s_ratio + partial_d_Rp *
+             p_ratio).real / (s_ratio + p_ratio)
+
+        partial_d_Ts = hadm_mul(tmp_res_s, partial_Ws_T)
+        partial_d_Tp = hadm_mul(tmp_res_p, partial_Wp_T)
+        jacobi[k, wl_idx + wls_size, i] = \
+            (partial_d_Ts * s_ratio + partial_d_Tp *
+             p_ratio).real / (s_ratio + p_ratio)
+
+        # W_front: from the incident medium to layer i
+        calc_M(Ms, Mp, cosi, ni, d[k, i], wl)
+        mul_right(W_front_s, Ms)
+        mul_right(W_front_p, Mp)
@@ -0,0 +1,283 @@
+import numpy as np
+import cmath
+from numba import cuda
+from tmm import autotune
+from tmm.mat_lib import mul_to, mul_right, mul_left, hadm_mul  # multiply
+from tmm.get_jacobi_adjoint import calc_M, calc_M_inv, fill_arr, \
+    calc_partial_d_M
+
+
+def get_jacobi_indexed(
+    jacobi,
+    wls,
+    d,
+    n_table,
+    material_idx,
+    n_sub,
+    n_inc,
+    inc_ang,
+    s_ratio=1,
+    p_ratio=1
+):
+    """
+    This function calculates the Jacobi matrix w.r.t. the thicknesses of a
+    film made of a few materials. Back propagation (adjoint method) as in
+    tmm.get_jacobi_adjoint.get_jacobi_simple, but the refractive indices are
+    given per *material* as in tmm.get_spectrum_indexed, so that the layers
+    do not have to alternate between 2 materials.
+
+    Like every jacobian engine (get_jacobi_simple, get_jacobi_adjoint), the
+    returned entries are half the derivatives dR / dd_i and dT / dd_i.
+    Multiply by 2 for the derivative, as optimizer.grad_helper.
+    JacobianOperator and LMOptimizer do.
+
+    Parameters:
+        jacobi (2d np.array):
+            size: 2wls.shape[0] \cross d.shape[0]
+            pre-allocated memory space for returning half the jacobi
+        wls (1d np.array):
+            wavelengths of the target spectrum
+        d (1d np.array):
+            multi-layer thicknesses after last iteration
+        n_table (2d np.array):
+            wls.shape[0] \cross number of materials.
+            refractive indices of each *material*
+        material_idx (1d np.array):
+            d.shape[0], small unsigned int. Column of n_table of each layer
+        n_sub (1d np.array):
+            refractive indices of the substrate
+        n_inc (1d np.array):
+            refractive indices of the incident material
+        inc_ang (float):
+            incident angle in degree
+        s_ratio (float):
+            portion of s-polarized light. Only intensity is taken into account,
+            which means randomized phase difference is assumed.
+        p_ratio (float):
+            p-polarized light
+    """
+    layer_number = d.shape[0]
+    inc_ang_rad = inc_ang / 180 * np.pi
+    wls_size = wls.shape[0]
+
+    n_table = np.ascontiguousarray(n_table, dtype='complex128')
+    cos_table = np.sqrt(
+        1 - ((n_inc.reshape((-1, 1)) / n_table) * np.sin(inc_ang_rad)) ** 2)
+
+    wls_device = cuda.to_device(wls)
+    d_device = cuda.to_device(d)
+    n_table_device = cuda.to_device(n_table)
+    cos_table_device = cuda.to_device(cos_table)
+    material_idx_device = cuda.to_device(material_idx)
+    n_sub_device = cuda.to_device(n_sub)
+    n_inc_device = cuda.to_device(n_inc)
+
+    jacobi_device = cuda.device_array(
+        (wls_size * 2, layer_number),
+        dtype="float64"
+    )
+
+    # invoke kernel with the autotuned block size. See tmm.autotune
+    autotune.launch(
+        'get_jacobi_indexed.forward_and_backward_propagation_indexed',
+        forward_and_backward_propagation_indexed,
+        wls_size,
+        (
+            jacobi_device,
+            wls_device,
+            d_device,
+            n_table_device,
+            cos_table_device,
+            material_idx_device,
+            n_sub_device,
+            n_inc_device,
+            inc_ang_rad,
+            wls_size,
+            layer_number,
+            s_ratio,
+            p_ratio
+        ),
+        shape=(wls_size, layer_number)
+    )
+    cuda.synchronize()
+    jacobi_device.copy_to_host(jacobi)
+
+
+@cuda.jit(cache=True)
+def forward_and_backward_propagation_indexed(
+    jacobi,
+    wls,
+    d,
+    n_table,
+    cos_table,
+    material_idx,
+    n_sub_arr,
+    n_inc_arr,
+    inc_ang,
+    wls_size,
+    layer_number,
+    s_ratio,
+    p_ratio
+):
+    """
+    Parameters:
+        jacobi (cuda.device_array):
+            size: wls_size * 2 \corss layer_number
+            device array for storing calculated jacobi matrix
+        wls (cuda.device_array):
+            wavelengths
+        d (cuda.device_array):
+        n_table (cuda.device_array):
+            n of the materials at different wls
+        cos_table (cuda.device_array):
+            cos of the angle in the materials at different wls
+        material_idx (cuda.device_array):
+            material of each layer
+        n_sub
+        n_inc
+        inc_ang (float):
+            incident angle in rad
+        wls_size:
+            number of wavelengths
+        layer_number:
+            number of layers
+    """
+    thread_id = cuda.grid(1)
+    if thread_id > wls_size - 1:
+        return
+    wl = wls[thread_id]
+    n_sub = n_sub_arr[thread_id]
+    n_inc = n_inc_arr[thread_id]
+    cos_inc = cmath.cos(inc_ang)
+    cos_sub = cmath.sqrt(1 - ((n_inc / n_sub) * cmath.sin(inc_ang)) ** 2)
+
+    '''
+    FORWARD PROPAGATION
+    '''
+
+    # E_in = W_front M_i W_back E_out.
+
+    W_back_s = cuda.local.array((2, 2), dtype="complex128")
+    W_back_p = cuda.local.array((2, 2), dtype="complex128")
+
+    fill_arr(W_back_s, 0.5, 0.5 / cos_inc / n_inc, 0.5, -0.5 / cos_inc / n_inc)
+    fill_arr(W_back_p, 0.5 / n_inc, 0.5 / cos_inc, 0.5 / n_inc, -0.5 / cos_inc)
+
+    Ms = cuda.local.array((2, 2), dtype="complex128")
+    Mp = cuda.local.array((2, 2), dtype="complex128")
+
+    for i in range(layer_number):
+        m = material_idx[i]
+        calc_M(Ms, Mp, cos_table[thread_id, m], n_table[thread_id, m], d[i],
+               wl)
+        mul_right(W_back_s, Ms)
+        mul_right(W_back_p, Mp)
+
+    # construct the last term D_{n+1}
+    fill_arr(Ms, 1, 1, n_sub * cos_sub, -n_sub * cos_sub)
+    fill_arr(Mp, n_sub, n_sub, cos_sub, -cos_sub)
+    mul_right(W_back_s, Ms)
+    mul_right(W_back_p, Mp)
+
+    rs = W_back_s[1, 0] / W_back_s[0, 0]
+    rp = W_back_p[1, 0] / W_back_p[0, 0]
+    ts = 1 / W_back_s[0, 0]
+    tp = 1 / W_back_p[0, 0]
+
+    '''
+    BACKWARD PROPAGATION
+    '''
+    partial_Ws_R = cuda.local.array((2, 2), dtype="complex128")
+    partial_Wp_R = cuda.local.array((2, 2), dtype="complex128")
+    partial_Ws_T = cuda.local.array((2, 2), dtype="complex128")
+    partial_Wp_T = cuda.local.array((2, 2), dtype="complex128")
+
+    # \partial_{W_{tot}} R = r^* \partial_{W_{tot}} r
+    fill_arr(
+        partial_Ws_R,
+        rs.conjugate() * -(W_back_s[1, 0] / W_back_s[0, 0] ** 2),
+        0,
+        rs.conjugate() * 1 / W_back_s[0, 0],
+        0
+    )
+    fill_arr(
+        partial_Wp_R,
+        rp.conjugate() * -(W_back_p[1, 0] / W_back_p[0, 0] ** 2),
+        0,
+        rp.conjugate() * 1 / W_back_p[0, 0],
+        0
+    )
+
+    # \partial_{W_{tot}} T = t^* \partial_{W_{tot}} t
+    fill_arr(
+        partial_Ws_T,
+        ts.conjugate() * (-1 / W_back_s[0, 0] ** 2) *
+            (cos_sub * n_sub / (cos_inc * n_inc)),
+        0,
+        0,
+        0
+    )
+    fill_arr(
+        partial_Wp_T,
+        tp.conjugate() * (-1 / W_back_p[0, 0] ** 2) *
+            (cos_sub * n_sub / (cos_inc * n_inc)),
+        0,
+        0,
+        0
+    )
+
+    W_front_s = cuda.local.array((2, 2), dtype="complex128")
+    W_front_p = cuda.local.array((2, 2), dtype="complex128")
+    Ms_inv = cuda.local.array((2, 2), dtype='complex128')
+    Mp_inv = cuda.local.array((2, 2), dtype='complex128')
+    partial_d_Ms = cuda.local.array((2, 2), dtype='complex128')
+    partial_d_Mp = cuda.local.array((2, 2), dtype='complex128')
+    tmp_res_s = cuda.local.array((2, 2), dtype='complex128')
+    tmp_res_p = cuda.local.array((2, 2), dtype='complex128')
+
+    # make front matrix
+    fill_arr(W_front_s, 0.5, 0.5 / cos_inc /
+             n_inc, 0.5, -0.5 / cos_inc / n_inc)
+    fill_arr(W_front_p, 0.5 / n_inc, 0.5 /
+             cos_inc, 0.5 / n_inc, -0.5 / cos_inc)
+
+    # make back matrix
+    fill_arr(Ms_inv, 1, 1, n_inc * cos_inc, -n_inc * cos_inc)
+    fill_arr(Mp_inv, n_inc, n_inc, cos_inc, -cos_inc)
+    mul_left(Ms_inv, W_back_s)  # D_0 to left
+    mul_left(Mp_inv, W_back_p)
+
+    for i in range(layer_number):
+        m = material_idx[i]
+        cosi = cos_table[thread_id, m]
+        ni = n_table[thread_id, m]
+
+        # W_back: from layer i + 1 to the substrate
+        calc_M_inv(Ms_inv, Mp_inv, cosi, ni, d[i], wl)
+        mul_left(Ms_inv, W_back_s)
+        mul_left(Mp_inv, W_back_p)
+
+        calc_partial_d_M(partial_d_Ms, partial_d_Mp, cosi, ni, d[i], wl)
+
+        mul_to(W_front_s, partial_d_Ms, tmp_res_s)
+        mul_to(tmp_res_s, W_back_s, tmp_res_s)
+
+        mul_to(W_front_p, partial_d_Mp, tmp_res_p)
+        mul_to(tmp_res_p, W_back_p, tmp_res_p)
+
+        partial_d_Rs = hadm_mul(tmp_res_s, partial_Ws_R)
+        partial_d_Rp = hadm_mul(tmp_res_p, partial_Wp_R)
+        jacobi[thread_id, i] = \
+            (partial_d_Rs * s_ratio + partial_d_Rp *
+             p_ratio).real / (s_ratio + p_ratio)
+
+        partial_d_Ts = hadm_mul(tmp_res_s, partial_Ws_T)
+        partial_d_Tp = hadm_mul(tmp_res_p, partial_Wp_T)
+        jacobi[thread_id + wls_size, i] = \
+            (partial_d_Ts * s_ratio + partial_d_Tp *
+             p_ratio).real / (s_ratio + p_ratio)
+
+        # W_front: from the incident medium to layer i
+        calc_M(Ms, Mp, cosi, ni, d[i], wl)
+        mul_right(W_front_s, Ms)
+        mul_right(W_front_p, Mp)
@@ -1,6 +1,7 @@
 import numpy as np
 import cmath
 from numba import cuda
+from tmm import autotune
 from tmm.mat_lib import mul_right, mul_left, tsp  # 2 * 2 matrix optr
 
 
@@ -93,30 +94,33 @@ def get_spectrum_simple(
     # allocate space for R and T spec
     spectrum_device = cuda.device_array(wls_size * 2, dtype="float64")
 
-    # invoke kernel
-    block_size = 16  # threads per block
-    grid_size = (wls_size + block_size - 1) // block_size  # blocks per grid
-
-    forward_propagation_simple[grid_size, block_size](
-        spectrum_device,
-        wls_device,
-        d_device,
-        n_A_device,
-        n_B_device,
-        n_sub_device,
-        n_inc_device,
-        inc_ang_rad,
+    # invoke kernel with the autotuned block size. See tmm.autotune
+    autotune.launch(
+        'get_spectrum.forward_propagation_simple',
+        forward_propagation_simple,
         wls_size,
-        layer_number,
-        s_ratio,
-        p_ratio
+        (
+            spectrum_device,
+            wls_device,
+            d_device,
+            n_A_device,
+            n_B_device,
+            n_sub_device,
+            n_inc_device,
+            inc_ang_rad,
+            wls_size,
+            layer_number,
+            s_ratio,
+            p_ratio
+        ),
+        shape=(wls_size, layer_number)
     )
     cuda.synchronize()
     # copy to pre-allocated space
     spectrum_device.copy_to_host(spectrum)
 
 
-@cuda.jit
+@cuda.jit(cache=True)
 def forward_propagation_simple(
     spectrum,
     wls,
@@ -319,29 +323,32 @@ def get_spectrum_free(
     # allocate space for R and T spec
     spectrum_device = cuda.device_array(wls_size * 2, dtype="float64")
 
-    # invoke kernel
-    block_size = 16  # threads per block
-    grid_size = (wls_size + block_size - 1) // block_size  # blocks per grid
-
-    forward_propagation_free[grid_size, block_size](
-        spectrum_device,
-        wls_device,
-        d_device,
-        n_layers_device,
-        n_sub_device,
-        n_inc_device,
-        inc_ang_rad,
+    # invoke kernel with the autotuned block size. See tmm.autotune
+    autotune.launch(
+        'get_spectrum.forward_propagation_free',
+        forward_propagation_free,
         wls_size,
-        layer_number,
-        s_ratio,
-        p_ratio
+        (
+            spectrum_device,
+            wls_device,
+            d_device,
+            n_layers_device,
+            n_sub_device,
+            n_inc_device,
+            inc_ang_rad,
+            wls_size,
+            layer_number,
+            s_ratio,
+            p_ratio
+        ),
+        shape=(wls_size, layer_number)
     )
     cuda.synchronize()
     # copy to pre-allocated space
     spectrum_device.copy_to_host(spectrum)
 
 
-@cuda.jit
+@cuda.jit(cache=True)
 def forward_propagation_free(
     spectrum,
     wls,
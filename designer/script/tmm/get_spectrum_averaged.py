@@ -0,0 +1,476 @@
+import numpy as np
+import cmath
+from numba import cuda
+from tmm import autotune
+from tmm.mat_lib import mul_to, mul_right, mul_left, hadm_mul  # multiply
+from tmm.get_jacobi_adjoint import calc_M, calc_M_inv, fill_arr, \
+    calc_partial_d_M
+
+
+def gauss_legendre(half_width, n):
+    """
+    Gauss-Legendre quadrature over [-half_width, half_width].
+
+    Returns:
+        offsets (1d np.array): n nodes, relative to the center
+        weights (1d np.array): n weights, summing up to 1 (average)
+    """
+    x, w = np.polynomial.legendre.leggauss(n)
+    return half_width * x, w / 2
+
+
+def node_wls(wls, wl_offsets):
+    """
+    Wavelengths at which refractive indices have to be given to the
+    averaging engines: wls.shape[0] \cross wl_offsets.shape[0]
+    """
+    return wls.reshape((-1, 1)) + wl_offsets.reshape((1, -1))
+
+
+def _prepare(n_table, n_inc, inc_ang, wl_offsets, wl_weights, ang_offsets,
+             ang_weights):
+    # incident angles of the nodes in rad
+    inc_angs = (inc_ang + ang_offsets) / 180 * np.pi
+    # product rule, normalized s.t. the result is a weighted average
+    weights = np.outer(wl_weights, ang_weights)
+    weights = weights / weights.sum()
+
+    n_table = np.ascontiguousarray(n_table, dtype='complex128')
+    # cos of the angle in each material: (wls, wl nodes, ang nodes, materials)
+    cos_table = np.sqrt(1 - (
+        n_inc[:, :, np.newaxis, np.newaxis] *
+        np.sin(inc_angs)[np.newaxis, np.newaxis, :, np.newaxis] /
+        n_table[:, :, np.newaxis, :]
+    ) ** 2)
+    return inc_angs, weights, n_table, cos_table
+
+
+def get_spectrum_averaged(
+    spectrum,
+    wls,
+    d,
+    n_table,
+    material_idx,
+    n_sub,
+    n_inc,
+    inc_ang,
+    wl_offsets=np.zeros(1),
+    wl_weights=np.ones(1),
+    ang_offsets=np.zeros(1),
+    ang_weights=np.ones(1),
+    s_ratio=1,
+    p_ratio=1
+):
+    """
+    Spectrum averaged over a wavelength window (finite bandwidth of the
+    instrument) and / or a range of incident angles (converging beam), as in
+    tmm.get_spectrum_indexed.
+
+    Each output sample i is sum_{q, k} w_q v_k spec(wls[i] + wl_offsets[q],
+    inc_ang + ang_offsets[k]) / sum w_q v_k. All (wavelength, node) pairs are
+    evaluated in one launch and accumulated with atomics.
+
+    Use gauss_legendre to make the nodes and weights, or pass your own (e.g.
+    the slit function of the instrument).
+
+    Arguments:
+        spectrum (1d np.array):
+            2 * wls.shape[0], type: float64
+            pre-allocated memory space for returning spectrum
+        wls (1d np.array):
+            center wavelengths of the samples
+        d (1d np.array):
+            multi-layer thicknesses
+        n_table (3d np.array):
+            wls.shape[0] \cross wl_offsets.shape[0] \cross number of materials.
+            refractive indices of each *material* at node_wls(wls, wl_offsets)
+        material_idx (1d np.array):
+            d.shape[0], small unsigned int. Material of each layer
+        n_sub, n_inc (2d np.array):
+            wls.shape[0] \cross wl_offsets.shape[0]. refractive indices of the
+            substrate and the incident material at the wavelength nodes
+        inc_ang (float):
+            center incident angle in degree
+        wl_offsets, wl_weights (1d np.array):
+            wavelength nodes relative to wls, and their weights
+        ang_offsets, ang_weights (1d np.array):
+            incident angle nodes in degree relative to inc_ang, and their
+            weights. For a cone, include the solid angle factor in the
+            weights.
+        s_ratio, p_ratio (float):
+            portions of s and p polarized light
+
+    Returns:
+        size: 2 \cross wls.shape[0] spectrum
+        (Reflectance spectrum + Transmittance spectrum).
+    """
+    layer_number = d.shape[0]
+    wls_size = wls.shape[0]
+    n_wl_nodes = wl_offsets.shape[0]
+    n_ang_nodes = ang_offsets.shape[0]
+    inc_angs, weights, n_table, cos_table = _prepare(
+        n_table, n_inc, inc_ang, wl_offsets, wl_weights, ang_offsets,
+        ang_weights)
+
+    wls_device = cuda.to_device(wls)
+    d_device = cuda.to_device(d)
+    n_table_device = cuda.to_device(n_table)
+    cos_table_device = cuda.to_device(cos_table)
+    material_idx_device = cuda.to_device(material_idx)
+    n_sub_device = cuda.to_device(n_sub)
+    n_inc_device = cuda.to_device(n_inc)
+    inc_angs_device = cuda.to_device(inc_angs)
+    wl_offsets_device = cuda.to_device(wl_offsets.astype('float64'))
+    weights_device = cuda.to_device(weights)
+
+    # accumulated with atomics: zero before every (also autotuning) launch
+    zeros = np.zeros(wls_size * 2)
+    spectrum_device = cuda.to_device(zeros)
+
+    autotune.launch_2d(
+        'get_spectrum_averaged.forward_propagation_averaged',
+        forward_propagation_averaged,
+        (wls_size, n_wl_nodes * n_ang_nodes),
+        (
+            spectrum_device,
+            wls_device,
+            d_device,
+            n_table_device,
+            cos_table_device,
+            material_idx_device,
+            n_sub_device,
+            n_inc_device,
+            inc_angs_device,
+            wl_offsets_device,
+            weights_device,
+            wls_size,
+            n_wl_nodes,
+            n_ang_nodes,
+            layer_number,
+            s_ratio,
+            p_ratio
+        ),
+        shape=(wls_size, n_wl_nodes * n_ang_nodes, layer_number),
+        reset=lambda: spectrum_device.copy_to_device(zeros)
+    )
+    cuda.synchronize()
+    spectrum_device.copy_to_host(spectrum)
+
+
+def get_jacobi_averaged(
+    jacobi,
+    wls,
+    d,
+    n_table,
+    material_idx,
+    n_sub,
+    n_inc,
+    inc_ang,
+    wl_offsets=np.zeros(1),
+    wl_weights=np.ones(1),
+    ang_offsets=np.zeros(1),
+    ang_weights=np.ones(1),
+    s_ratio=1,
+    p_ratio=1
+):
+    """
+    Jacobi matrix w.r.t. thicknesses of get_spectrum_averaged, i.e. the
+    jacobians of tmm.get_jacobi_indexed averaged with the same weights.
+    Same convention as get_jacobi_adjoint (half the derivative).
+
+    Parameters:
+        jacobi (2d np.array):
+            size: 2wls.shape[0] \cross d.shape[0]
+            pre-allocated memory space for returning jacobi
+        others: see get_spectrum_averaged
+    """
+    layer_number = d.shape[0]
+    wls_size = wls.shape[0]
+    n_wl_nodes = wl_offsets.shape[0]
+    n_ang_nodes = ang_offsets.shape[0]
+    inc_angs, weights, n_table, cos_table = _prepare(
+        n_table, n_inc, inc_ang, wl_offsets, wl_weights, ang_offsets,
+        ang_weights)
+
+    wls_device = cuda.to_device(wls)
+    d_device = cuda.to_device(d)
+    n_table_device = cuda.to_device(n_table)
+    cos_table_device = cuda.to_device(cos_table)
+    material_idx_device = cuda.to_device(material_idx)
+    n_sub_device = cuda.to_device(n_sub)
+    n_inc_device = cuda.to_device(n_inc)
+    inc_angs_device = cuda.to_device(inc_angs)
+    wl_offsets_device = cuda.to_device(wl_offsets.astype('float64'))
+    weights_device = cuda.to_device(weights)
+
+    zeros = np.zeros((wls_size * 2, layer_number))
+    jacobi_device = cuda.to_device(zeros)
+
+    autotune.launch_2d(
+        'get_spectrum_averaged.forward_and_backward_propagation_averaged',
+        forward_and_backward_propagation_averaged,
+        (wls_size, n_wl_nodes * n_ang_nodes),
+        (
+            jacobi_device,
+            wls_device,
+            d_device,
+            n_table_device,
+            cos_table_device,
+            material_idx_device,
+            n_sub_device,
+            n_inc_device,
+            inc_angs_device,
+            wl_offsets_device,
+            weights_device,
+            wls_size,
+            n_wl_nodes,
+            n_ang_nodes,
+            layer_number,
+            s_ratio,
+            p_ratio
+        ),
+        shape=(wls_size, n_wl_nodes * n_ang_nodes, layer_number),
+        reset=lambda: jacobi_device.copy_to_device(zeros)
+    )
+    cuda.synchronize()
+    jacobi_device.copy_to_host(jacobi)
+
+
+@cuda.jit(cache=True)
+def forward_propagation_averaged(
+    spectrum,
+    wls,
+    d,
+    n_table,
+    cos_table,
+    material_idx,
+    n_sub_arr,
+    n_inc_arr,
+    inc_angs,
+    wl_offsets,
+    weights,
+    wls_size,
+    n_wl_nodes,
+    n_ang_nodes,
+    layer_number,
+    s_ratio,
+    p_ratio
+):
+    """
+    Each thread calculates R and T of one (sample, quadrature node) pair and
+    adds them, weighted, to the sample.
+    """
+    wl_idx, node = cuda.grid(2)
+    if wl_idx > wls_size - 1 or node > n_wl_nodes * n_ang_nodes - 1:
+        return
+    q = node // n_ang_nodes
+    k = node % n_ang_nodes
+    wl = wls[wl_idx] + wl_offsets[q]
+    inc_ang = inc_angs[k]
+    weight = weights[q, k]
+
+    n_sub = n_sub_arr[wl_idx, q]
+    n_inc = n_inc_arr[wl_idx, q]
+    cos_inc = cmath.cos(inc_ang)
+    cos_sub = cmath.sqrt(1 - ((n_inc / n_sub) * cmath.sin(inc_ang)) ** 2)
+
+    Ms = cuda.local.array((2, 2), dtype="complex128")
+    Mp = cuda.local.array((2, 2), dtype="complex128")
+    Ws = cuda.local.array((2, 2), dtype="complex128")
+    Wp = cuda.local.array((2, 2), dtype="complex128")
+
+    # Fill W with first term D_{0}^{-1}
+    fill_arr(Ws, 0.5, 0.5 / cos_inc / n_inc, 0.5, -0.5 / cos_inc / n_inc)
+    fill_arr(Wp, 0.5 / n_inc, 0.5 / cos_inc, 0.5 / n_inc, -0.5 / cos_inc)
+
+    for i in range(layer_number):
+        m = material_idx[i]
+        calc_M(Ms, Mp, cos_table[wl_idx, q, k, m], n_table[wl_idx, q, m],
+               d[i], wl)
+        mul_right(Ws, Ms)
+        mul_right(Wp, Mp)
+
+    # construct the last term D_{n+1}
+    fill_arr(Ms, 1, 1, n_sub * cos_sub, -n_sub * cos_sub)
+    fill_arr(Mp, n_sub, n_sub, cos_sub, -cos_sub)
+    mul_right(Ws, Ms)
+    mul_right(Wp, Mp)
+
+    rs = Ws[1, 0] / Ws[0, 0]
+    rp = Wp[1, 0] / Wp[0, 0]
+    R = (s_ratio * rs * rs.conjugate() + p_ratio * rp * rp.conjugate()) \
+        / (s_ratio + p_ratio)
+
+    ts = 1 / Ws[0, 0]
+    tp = 1 / Wp[0, 0]
+    T = cos_sub * n_sub / (cos_inc * n_inc) * \
+        (s_ratio * ts * ts.conjugate() + p_ratio * tp * tp.conjugate()) \
+        / (s_ratio + p_ratio)
+
+    cuda.atomic.add(spectrum, wl_idx, weight * R.real)
+    cuda.atomic.add(spectrum, wl_idx + wls_size, weight * T.real)
+
+
+@cuda.jit(cache=True)
+def forward_and_backward_propagation_averaged(
+    jacobi,
+    wls,
+    d,
+    n_table,
+    cos_table,
+    material_idx,
+    n_sub_arr,
+    n_inc_arr,
+    inc_angs,
+    wl_offsets,
+    weights,
+    wls_size,
+    n_wl_nodes,
+    n_ang_nodes,
+    layer_number,
+    s_ratio,
+    p_ratio
+):
+    """
+    Each thread calculates the jacobian of one (sample, quadrature node)
+    pair as in get_jacobi_indexed and adds it, weighted, to the sample.
+    """
+    wl_idx, node = cuda.grid(2)
+    if wl_idx > wls_size - 1 or node > n_wl_nodes * n_ang_nodes - 1:
+        return
+    q = node // n_ang_nodes
+    k = node % n_ang_nodes
+    wl = wls[wl_idx] + wl_offsets[q]
+    inc_ang = inc_angs[k]
+    weight = weights[q, k]
+
+    n_sub = n_sub_arr[wl_idx, q]
+    n_inc = n_inc_arr[wl_idx, q]
+    cos_inc = cmath.cos(inc_ang)
+    cos_sub = cmath.sqrt(1 - ((n_inc / n_sub) * cmath.sin(inc_ang)) ** 2)
+
+    '''
+    FORWARD PROPAGATION
+    '''
+    W_back_s = cuda.local.array((2, 2), dtype="complex128")
+    W_back_p = cuda.local.array((2, 2), dtype="complex128")
+
+    fill_arr(W_back_s, 0.5, 0.5 / cos_inc / n_inc, 0.5, -0.5 / cos_inc / n_inc)
+    fill_arr(W_back_p, 0.5 / n_inc, 0.5 / cos_inc, 0.5 / n_inc, -0.5 / cos_inc)
+
+    Ms = cuda.local.array((2, 2), dtype="complex128")
+    Mp = cuda.local.array((2, 2), dtype="complex128")
+
+    for i in range(layer_number):
+        m = material_idx[i]
+        calc_M(Ms, Mp, cos_table[wl_idx, q, k, m], n_table[wl_idx, q, m],
+               d[i], wl)
+        mul_right(W_back_s, Ms)
+        mul_right(W_back_p, Mp)
+
+    fill_arr(Ms, 1, 1, n_sub * cos_sub, -n_sub * cos_sub)
+    fill_arr(Mp, n_sub, n_sub, cos_sub, -cos_sub)
+    mul_right(W_back_s, Ms)
+    mul_right(W_back_p, Mp)
+
+    rs = W_back_s[1, 0] / W_back_s[0, 0]
+    rp = W_back_p[1, 0] / W_back_p[0, 0]
+    ts = 1 / W_back_s[0, 0]
+    tp = 1 / W_back_p[0, 0]
+
+    '''
+    BACKWARD PROPAGATION
+    '''
+    partial_Ws_R = cuda.local.array((2, 2), dtype="complex128")
+    partial_Wp_R = cuda.local.array((2, 2), dtype="complex128")
+    partial_Ws_T = cuda.local.array((2, 2), dtype="complex128")
+    partial_Wp_T = cuda.local.array((2, 2), dtype="complex128")
+
+    fill_arr(
+        partial_Ws_R,
+        rs.conjugate() * -(W_back_s[1, 0] / W_back_s[0, 0] ** 2),
+        0,
+        rs.conjugate() * 1 / W_back_s[0, 0],
+        0
+    )
+    fill_arr(
+        partial_Wp_R,
+        rp.conjugate() * -(W_back_p[1, 0] / W_back_p[0, 0] ** 2),
+        0,
+        rp.conjugate() * 1 / W_back_p[0, 0],
+        0
+    )
+    fill_arr(
+        partial_Ws_T,
+        ts.conjugate() * (-1 / W_back_s[0, 0] ** 2) *
+            (cos_sub * n_sub / (cos_inc * n_inc)),
+        0,
+        0,
+        0
+    )
+    fill_arr(
+        partial_Wp_T,
+        tp.conjugate() * (-1 / W_back_p[0, 0] ** 2) *
+            (cos_sub * n_sub / (cos_inc * n_inc)),
+        0,
+        0,
+        0
+    )
+
+    W_front_s = cuda.local.array((2, 2), dtype="complex128")
+    W_front_p = cuda.local.array((2, 2), dtype="complex128")
+    Ms_inv = cuda.local.array((2, 2), dtype='complex128')
+    Mp_inv = cuda.local.array((2, 2), dtype='complex128')
+    partial_d_Ms = cuda.local.array((2, 2), dtype='complex128')
+    partial_d_Mp = cuda.local.array((2, 2), dtype='complex128')
+    tmp_res_s = cuda.local.array((2, 2), dtype='complex128')
+    tmp_res_p = cuda.local.array((2, 2), dtype='complex128')
+
+    fill_arr(W_front_s, 0.5, 0.5 / cos_inc /
+             n_inc, 0.5, -0.5 / cos_inc / n_inc)
+    fill_arr(W_front_p, 0.5 / n_inc, 0.5 /
+             cos_inc, 0.5 / n_inc, -0.5 / cos_inc)
+
+    fill_arr(Ms_inv, 1, 1, n_inc * cos_inc, -n_inc * cos_inc)
+    fill_arr(Mp_inv, n_inc, n_inc, cos_inc, -cos_inc)
+    mul_left(Ms_inv, W_back_s)  # D_0 to left
+    mul_left(Mp_inv, W_back_p)
+
+    for i in range(layer_number):
+        m = material_idx[i]
+        cosi = cos_table[wl_idx, q, k, m]
+        ni = n_table[wl_idx, q, m]
+
+        calc_M_inv(Ms_inv, Mp_inv, cosi, ni, d[i], wl)
+        mul_left(Ms_inv, W_back_s)
+        mul_left(Mp_inv, W_back_p)
+
+        calc_partial_d_M(partial_d_Ms, partial_d_Mp, cosi, ni, d[i], wl)
+
+        mul_to(W_front_s, partial_d_Ms, tmp_res_s)
+        mul_to(tmp_res_s, W_back_s, tmp_res_s)
+
+        mul_to(W_front_p, partial_d_Mp, tmp_res_p)
+        mul_to(tmp_res_p, W_back_p, tmp_res_p)
+
+        partial_d_Rs = hadm_mul(tmp_res_s, partial_Ws_R)
+        partial_d_Rp = hadm_mul(tmp_res_p, partial_Wp_R)
+        cuda.atomic.add(
+            jacobi,
+            (wl_idx, i),
+            weight * (partial_d_Rs * s_ratio + partial_d_Rp *
+                      p_ratio).real / (s_ratio + p_ratio)
+        )
+
+        partial_d_Ts = hadm_mul(tmp_res_s, partial_Ws_T)
+        partial_d_Tp = hadm_mul(tmp_res_p, partial_Wp_T)
+        cuda.atomic.add(
+            jacobi,
+            (wl_idx + wls_size, i),
+            weight * (partial_d_Ts * s_ratio + partial_d_Tp *
+                      p_ratio).real / (s_ratio + p_ratio)
+        )
+
+        calc_M(Ms, Mp, cosi, ni, d[i], wl)
+        mul_right(W_front_s, Ms)
+        mul_right(W_front_p, Mp)
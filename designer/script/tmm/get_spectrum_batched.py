@@ -0,0 +1,193 @@
+import numpy as np
+import cmath
+from numba import cuda
+from tmm import autotune
+from tmm.mat_lib import mul_right  # 2 * 2 matrix optr
+
+
+def get_spectrum_batched(
+    spectrum,
+    wls,
+    d,
+    n_table,
+    material_idx,
+    n_sub,
+    n_inc,
+    inc_ang,
+    s_ratio=1,
+    p_ratio=1
+):
+    """
+    Spectra of a batch of films made of the same materials, in one launch
+    over (wavelength, film). Per film the same as
+    tmm.get_spectrum_indexed; the forward pass of
+    tmm.get_jacobi_batched, without the jacobians.
+
+    Used to evaluate many trial thicknesses at once, e.g. the step lengths
+    of a line search (optimizer.optimizer.GradientOptimizer). Films with
+    fewer layers are padded with zero-thickness layers.
+
+    Parameters:
+        spectrum (2d np.array):
+            size: films number \cross 2wls.shape[0]
+            pre-allocated memory space for returning the spectra
+            (R spectrum + T spectrum of every film)
+        wls (1d np.array):
+            wavelengths of the target spectrum
+        d (2d np.array):
+            films number \cross layer number. Thicknesses of every film
+        n_table (2d np.array):
+            wls.shape[0] \cross number of materials.
+            refractive indices of each *material*, shared by the films
+        material_idx (2d np.array):
+            same size as d, small unsigned int. Column of n_table of each
+            layer of every film
+        n_sub (1d np.array):
+            refractive indices of the substrate
+        n_inc (1d np.array):
+            refractive indices of the incident material
+        inc_ang (float):
+            incident angle in degree
+        s_ratio, p_ratio (float):
+            portions of s and p polarized light
+    """
+    film_number, layer_number = d.shape
+    inc_ang_rad = inc_ang / 180 * np.pi
+    wls_size = wls.shape[0]
+
+    n_table = np.ascontiguousarray(n_table, dtype='complex128')
+    cos_table = np.sqrt(
+        1 - ((n_inc.reshape((-1, 1)) / n_table) * np.sin(inc_ang_rad)) ** 2)
+
+    wls_device = cuda.to_device(wls)
+    d_device = cuda.to_device(np.ascontiguousarray(d))
+    n_table_device = cuda.to_device(n_table)
+    cos_table_device = cuda.to_device(cos_table)
+    material_idx_device = cuda.to_device(np.ascontiguousarray(material_idx))
+    n_sub_device = cuda.to_device(n_sub)
+    n_inc_device = cuda.to_device(n_inc)
+
+    spectrum_device = cuda.device_array(
+        (film_number, wls_size * 2), dtype="float64")
+
+    # invoke kernel with the autotuned block shape. See tmm.autotune
+    autotune.launch_2d(
+        'get_spectrum_batched.forward_propagation_batched',
+        forward_propagation_batched,
+        (wls_size, film_number),
+        (
+            spectrum_device,
+            wls_device,
+            d_device,
+            n_table_device,
+            cos_table_device,
+            material_idx_device,
+            n_sub_device,
+            n_inc_device,
+            inc_ang_rad,
+            wls_size,
+            film_number,
+            layer_number,
+            s_ratio,
+            p_ratio
+        ),
+        shape=(wls_size, film_number, layer_number)
+    )
+    cuda.synchronize()
+    spectrum_device.copy_to_host(spectrum)
+
+
+@cuda.jit(cache=True)
+def forward_propagation_batched(
+    spectrum,
+    wls,
+    d,
+    n_table,
+    cos_table,
+    material_idx,
+    n_sub_arr,
+    n_inc_arr,
+    inc_ang,
+    wls_size,
+    film_number,
+    layer_number,
+    s_ratio,
+    p_ratio
+):
+    """
+    Each thread calculates R and T of one film at one wavelength, as in
+    get_spectrum_indexed.
+    """
+    wl_idx, k = cuda.grid(2)
+    if wl_idx > wls_size - 1 or k > film_number - 1:
+        return
+    wl = wls[wl_idx]
+    n_sub = n_sub_arr[wl_idx]
+    n_inc = n_inc_arr[wl_idx]
+    cos_inc = cmath.cos(inc_ang)
+    cos_sub = cmath.sqrt(1 - ((n_inc / n_sub) * cmath.sin(inc_ang)) ** 2)
+
+    Ms = cuda.local.array((2, 2), dtype="complex128")
+    Mp = cuda.local.array((2, 2), dtype="complex128")
+
+    # Fill W with first term D_{0}^{-1}
+    Ws = cuda.local.array((2, 2), dtype="complex128")
+    Ws[0, 0] = 0.5
+    Ws[0, 1] = 0.5 / (cos_inc * n_inc)
+    Ws[1, 0] = 0.5
+    Ws[1, 1] = -0.5 / (cos_inc * n_inc)
+
+    Wp = cuda.local.array((2, 2), dtype="complex128")
+    Wp[0, 0] = 0.5 / n_inc
+    Wp[0, 1] = 0.5 / cos_inc
+    Wp[1, 0] = 0.5 / n_inc
+    Wp[1, 1] = -0.5 / cos_inc
+
+    for i in range(layer_number):
+        m = material_idx[k, i]
+        ni = n_table[wl_idx, m]
+        cosi = cos_table[wl_idx, m]
+        phi = 2 * cmath.pi * 1j * cosi * ni * d[k, i] / wl
+
+        coshi = cmath.cosh(phi)
+        sinhi = cmath.sinh(phi)
+
+        Ms[0, 0] = coshi
+        Ms[0, 1] = sinhi / cosi / ni
+        Ms[1, 0] = cosi * ni * sinhi
+        Ms[1, 1] = coshi
+
+        Mp[0, 0] = coshi
+        Mp[0, 1] = sinhi * ni / cosi
+        Mp[1, 0] = cosi / ni * sinhi
+        Mp[1, 1] = coshi
+
+        mul_right(Ws, Ms)
+        mul_right(Wp, Mp)
+
+    # construct the last term D_{n+1}
+    Ms[0, 0] = 1.
+    Ms[0, 1] = 1.
+    Ms[1, 0] = n_sub * cos_sub
+    Ms[1, 1] = -n_sub * cos_sub
+
+    Mp[0, 0] = n_sub
+    Mp[0, 1] = n_sub
+    Mp[1, 0] = cos_sub
+    Mp[1, 1] = -cos_sub
+
+    mul_right(Ws, Ms)
+    mul_right(Wp, Mp)
+
+    rs = Ws[1, 0] / Ws[0, 0]
+    rp = Wp[1, 0] / Wp[0, 0]
+    R = (s_ratio * rs * rs.conjugate() + p_ratio * rp * rp.conjugate()) \
+        / (s_ratio + p_ratio)
+    spectrum[k, wl_idx] = R.real
+
+    ts = 1 / Ws[0, 0]
+    tp = 1 / Wp[0, 0]
+    T = cos_sub * n_sub / (cos_inc * n_inc) * \
+        (s_ratio * ts * ts.conjugate() + p_ratio * tp * tp.conjugate()) \
+        / (s_ratio + p_ratio)
+    spectrum[k, wl_idx + wls_size] = T.real
@@ -0,0 +1,216 @@
+import numpy as np
+import cmath
+from numba import cuda
+from tmm import autotune
+from tmm.mat_lib import mul_right  # 2 * 2 matrix optr
+
+
+def get_spectrum_indexed(
+    spectrum,
+    wls,
+    d,
+    n_table,
+    material_idx,
+    n_sub,
+    n_inc,
+    inc_ang,
+    s_ratio=1,
+    p_ratio=1
+):
+    """
+    This function calculates the reflectance and transmittance spectrum of a
+    film made of a few materials.
+
+    Same as tmm.get_spectrum.get_spectrum_free, but instead of the dense
+    wls.shape[0] \cross d.shape[0] matrix of refractive indices, only the
+    refractive indices of each *material* and the material of each layer are
+    copied to the GPU.
+
+    Arguments:
+        spectrum (1d np.array):
+            2 * wls.shape[0], type: float64
+            pre-allocated memory space for returning spectrum
+        wls (1d np.array):
+            wls.shape[0]
+            wavelengths of the target spectrum
+        d (1d np.array):
+            multi-layer thicknesses after last iteration
+        n_table (2d np.array):
+            wls.shape[0] \cross number of materials.
+            refractive indices of each *material*
+        material_idx (1d np.array):
+            d.shape[0], small unsigned int. Column of n_table of each layer
+        n_sub (1d np.array):
+            refractive indices of the substrate
+        n_inc (1d np.array):
+            refractive indices of the incident material
+        inc_ang (float):
+            incident angle in degree
+        s_ratio (float):
+            portion of s-polarized light. Only intensity is taken into account,
+            which means randomized phase difference is assumed.
+        p_ratio (float):
+            p-polarized light
+
+    Returns:
+        size: 2 \cross wls.shape[0] spectrum
+        (Reflectance spectrum + Transmittance spectrum).
+    """
+    layer_number = d.shape[0]
+    inc_ang_rad = inc_ang / 180 * np.pi
+    wls_size = wls.shape[0]
+
+    # cos of the angle in each material. Snell's law:
+    # n_a sin(phi_a) = n_b sin(phi_b)
+    n_table = np.ascontiguousarray(n_table, dtype='complex128')
+    cos_table = np.sqrt(
+        1 - ((n_inc.reshape((-1, 1)) / n_table) * np.sin(inc_ang_rad)) ** 2)
+
+    wls_device = cuda.to_device(wls)
+    d_device = cuda.to_device(d)
+    n_table_device = cuda.to_device(n_table)
+    cos_table_device = cuda.to_device(cos_table)
+    material_idx_device = cuda.to_device(material_idx)
+    n_sub_device = cuda.to_device(n_sub)
+    n_inc_device = cuda.to_device(n_inc)
+
+    spectrum_device = cuda.device_array(wls_size * 2, dtype="float64")
+
+    # invoke kernel with the autotuned block size. See tmm.autotune
+    autotune.launch(
+        'get_spectrum_indexed.forward_propagation_indexed',
+        forward_propagation_indexed,
+        wls_size,
+        (
+            spectrum_device,
+            wls_device,
+            d_device,
+            n_table_device,
+            cos_table_device,
+            material_idx_device,
+            n_sub_device,
+            n_inc_device,
+            inc_ang_rad,
+            wls_size,
+            layer_number,
+            s_ratio,
+            p_ratio
+        ),
+        shape=(wls_size, layer_number)
+    )
+    cuda.synchronize()
+    spectrum_device.copy_to_host(spectrum)
+
+
+@cuda.jit(cache=True)
+def forward_propagation_indexed(
+    spectrum,
+    wls,
+    d,
+    n_table,
+    cos_table,
+    material_idx,
+    n_sub_arr,
+    n_inc_arr,
+    inc_ang,
+    wls_size,
+    layer_number,
+    s_ratio,
+    p_ratio
+):
+    """
+    Parameters:
+        spectrum (cuda.device_array):
+            device array for storing data
+        wls (cuda.device_array):
+            wavelengths
+        d (cuda.device_array):
+        n_table (cuda.device_array):
+            n of the materials at different wls
+        cos_table (cuda.device_array):
+            cos of the angle in the materials at different wls
+        material_idx (cuda.device_array):
+            material of each layer
+        n_sub
+        n_inc
+        inc_ang (float):
+            incident angle in rad
+        wls_size:
+            number of wavelengths
+        layer_number:
+            number of layers
+    """
+    thread_id = cuda.grid(1)
+    if thread_id > wls_size - 1:
+        return
+    wl = wls[thread_id]
+
+    n_sub = n_sub_arr[thread_id]
+    n_inc = n_inc_arr[thread_id]
+    cos_inc = cmath.cos(inc_ang)
+    cos_sub = cmath.sqrt(1 - ((n_inc / n_sub) * cmath.sin(inc_ang)) ** 2)
+
+    Ms = cuda.local.array((2, 2), dtype="complex128")
+    Mp = cuda.local.array((2, 2), dtype="complex128")
+
+    # Fill W with first term D_{0}^{-1}
+    Ws = cuda.local.array((2, 2), dtype="complex128")
+    Ws[0, 0] = 0.5
+    Ws[0, 1] = 0.5 / (cos_inc * n_inc)
+    Ws[1, 0] = 0.5
+    Ws[1, 1] = -0.5 / (cos_inc * n_inc)
+
+    Wp = cuda.local.array((2, 2), dtype="complex128")
+    Wp[0, 0] = 0.5 / n_inc
+    Wp[0, 1] = 0.5 / cos_inc
+    Wp[1, 0] = 0.5 / n_inc
+    Wp[1, 1] = -0.5 / cos_inc
+
+    for i in range(layer_number):
+        m = material_idx[i]
+        ni = n_table[thread_id, m]
+        cosi = cos_table[thread_id, m]
+        phi = 2 * cmath.pi * 1j * cosi * ni * d[i] / wl
+
+        coshi = cmath.cosh(phi)
+        sinhi = cmath.sinh(phi)
+
+        Ms[0, 0] = coshi
+        Ms[0, 1] = sinhi / cosi / ni
+        Ms[1, 0] = cosi * ni * sinhi
+        Ms[1, 1] = coshi
+
+        Mp[0, 0] = coshi
+        Mp[0, 1] = sinhi * ni / cosi
+        Mp[1, 0] = cosi / ni * sinhi
+        Mp[1, 1] = coshi
+
+        mul_right(Ws, Ms)
+        mul_right(Wp, Mp)
+
+    # construct the last term D_{n+1}
+    Ms[0, 0] = 1.
+    Ms[0, 1] = 1.
+    Ms[1, 0] = n_sub * cos_sub
+    Ms[1, 1] = -n_sub * cos_sub
+
+    Mp[0, 0] = n_sub
+    Mp[0, 1] = n_sub
+    Mp[1, 0] = cos_sub
+    Mp[1, 1] = -cos_sub
+
+    mul_right(Ws, Ms)
+    mul_right(Wp, Mp)
+
+    rs = Ws[1, 0] / Ws[0, 0]
+    rp = Wp[1, 0] / Wp[0, 0]
+    R = (s_ratio * rs * rs.conjugate() + p_ratio * rp * rp.conjugate()) \
+        / (s_ratio + p_ratio)
+    spectrum[thread_id] = R.real
+
+    ts = 1 / Ws[0, 0]
+    tp = 1 / Wp[0, 0]
+    T = cos_sub * n_sub / (cos_inc * n_inc) * \
+        (s_ratio * ts * ts.conjugate() + p_ratio * tp * tp.conjugate()) \
+        / (s_ratio + p_ratio)
+    spectrum[thread_id + wls_size] = T.real
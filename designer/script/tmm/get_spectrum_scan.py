@@ -0,0 +1,306 @@
+import numpy as np
+import cmath
+from numba import cuda
+from tmm import autotune
+from tmm.mat_lib import mul_right, mul_to  # 2 * 2 matrix optr
+
+
+# launch at least about this many threads in the first stage
+TARGET_THREADS = 1 << 14
+MIN_BLOCK_LEN = 8
+
+
+def get_spectrum_free_scan(
+    spectrum,
+    wls,
+    d,
+    n_layers,
+    n_sub,
+    n_inc,
+    inc_ang,
+    s_ratio=1,
+    p_ratio=1,
+    block_len=None
+):
+    """
+    Same as tmm.get_spectrum.get_spectrum_free, but also parallel over layers.
+    Intended for very deep stacks (1e4 - 1e5 layers) at few wavelengths,
+    where one thread per wavelength leaves most of the GPU idle and the
+    serial product of 2 * 2 matrices dominates.
+
+    The layers are split into blocks of block_len layers. Each thread
+    multiplies the transfer matrices of one (wavelength, block) pair. The
+    partial products are then combined pairwise in a tree, which takes
+    log2(number of blocks) launches. Matrix multiplication is associative
+    but not commutative, so the order of the blocks is kept in every level.
+
+    Arguments:
+        spectrum (1d np.array):
+            2 * wls.shape[0], type: float64
+            pre-allocated memory space for returning spectrum
+        wls (1d np.array):
+            wls.shape[0]
+            wavelengths of the target spectrum
+        d (1d np.array):
+            multi-layer thicknesses after last iteration
+        n_layers (2d np.array):
+            wls.shape[0] \cross d.shape[0].
+            refractive indices of each *layer*
+        n_sub (1d np.array):
+            refractive indices of the substrate
+        n_inc (1d np.array):
+            refractive indices of the incident material
+        inc_ang (float):
+            incident angle in degree
+        s_ratio (float):
+            portion of s-polarized light. Only intensity is taken into account,
+            which means randomized phase difference is assumed.
+        p_ratio (float):
+            p-polarized light
+        block_len (int):
+            layers multiplied serially by one thread. By default chosen s.t.
+            about TARGET_THREADS threads are launched.
+
+    Returns:
+        size: 2 \cross wls.shape[0] spectrum
+        (Reflectance spectrum + Transmittance spectrum).
+    """
+    layer_number = d.shape[0]
+    inc_ang_rad = inc_ang / 180 * np.pi
+    wls_size = wls.shape[0]
+
+    if block_len is None:
+        block_len = max(
+            MIN_BLOCK_LEN,
+            -(-layer_number * wls_size // TARGET_THREADS)
+        )
+    n_blocks = max(1, -(-layer_number // block_len))
+
+    wls_device = cuda.to_device(wls)
+    d_device = cuda.to_device(d)
+    n_layers_device = cuda.to_device(n_layers)
+    n_sub_device = cuda.to_device(n_sub)
+    n_inc_device = cuda.to_device(n_inc)
+
+    # partial products. Axis 2 is the polarization (s, p)
+    src = cuda.device_array(
+        (wls_size, n_blocks, 2, 2, 2), dtype="complex128")
+    dst = cuda.device_array(
+        (wls_size, (n_blocks + 1) // 2, 2, 2, 2), dtype="complex128")
+
+    autotune.launch_2d(
+        'get_spectrum_scan.block_products',
+        block_products,
+        (wls_size, n_blocks),
+        (
+            src,
+            wls_device,
+            d_device,
+            n_layers_device,
+            n_inc_device,
+            inc_ang_rad,
+            wls_size,
+            layer_number,
+            block_len,
+            n_blocks
+        ),
+        shape=(wls_size, layer_number)
+    )
+
+    # tree reduction. combine_pairs does not write to its input, so the
+    # autotuner may launch it repeatedly
+    n_src = n_blocks
+    while n_src > 1:
+        n_dst = (n_src + 1) // 2
+        autotune.launch_2d(
+            'get_spectrum_scan.combine_pairs',
+            combine_pairs,
+            (wls_size, n_dst),
+            (dst, src, wls_size, n_src),
+            shape=(wls_size, n_src)
+        )
+        src, dst = dst, src
+        n_src = n_dst
+
+    spectrum_device = cuda.device_array(wls_size * 2, dtype="float64")
+    autotune.launch(
+        'get_spectrum_scan.finalize',
+        finalize,
+        wls_size,
+        (
+            spectrum_device,
+            src,
+            n_sub_device,
+            n_inc_device,
+            inc_ang_rad,
+            wls_size,
+            s_ratio,
+            p_ratio
+        )
+    )
+    cuda.synchronize()
+    spectrum_device.copy_to_host(spectrum)
+
+
+@cuda.jit(cache=True)
+def block_products(
+    partial,
+    wls,
+    d,
+    n_layers,
+    n_inc_arr,
+    inc_ang,
+    wls_size,
+    layer_number,
+    block_len,
+    n_blocks
+):
+    """
+    Each thread multiplies the transfer matrices of the layers
+    [block * block_len, (block + 1) * block_len) at one wavelength.
+
+    Parameters:
+        partial (cuda.device_array):
+            wls_size * n_blocks * 2 * 2 * 2, products of the blocks
+        inc_ang (float):
+            incident angle in rad
+    """
+    wl_idx, block = cuda.grid(2)
+    if wl_idx > wls_size - 1 or block > n_blocks - 1:
+        return
+    wl = wls[wl_idx]
+    n_inc = n_inc_arr[wl_idx]
+    sin_inc = cmath.sin(inc_ang)
+
+    Ms = cuda.local.array((2, 2), dtype="complex128")
+    Mp = cuda.local.array((2, 2), dtype="complex128")
+    Ws = cuda.local.array((2, 2), dtype="complex128")
+    Wp = cuda.local.array((2, 2), dtype="complex128")
+    Ws[0, 0] = 1.
+    Ws[0, 1] = 0.
+    Ws[1, 0] = 0.
+    Ws[1, 1] = 1.
+    Wp[0, 0] = 1.
+    Wp[0, 1] = 0.
+    Wp[1, 0] = 0.
+    Wp[1, 1] = 1.
+
+    start = block * block_len
+    end = min(start + block_len, layer_number)
+    for i in range(start, end):
+        ni = n_layers[wl_idx, i]
+        cosi = cmath.sqrt(1 - ((n_inc / ni) * sin_inc) ** 2)
+        phi = 2 * cmath.pi * 1j * cosi * ni * d[i] / wl
+
+        coshi = cmath.cosh(phi)
+        sinhi = cmath.sinh(phi)
+
+        Ms[0, 0] = coshi
+        Ms[0, 1] = sinhi / cosi / ni
+        Ms[1, 0] = cosi * ni * sinhi
+        Ms[1, 1] = coshi
+
+        Mp[0, 0] = coshi
+        Mp[0, 1] = sinhi * ni / cosi
+        Mp[1, 0] = cosi / ni * sinhi
+        Mp[1, 1] = coshi
+
+        mul_right(Ws, Ms)
+        mul_right(Wp, Mp)
+
+    for j in range(2):
+        for k in range(2):
+            partial[wl_idx, block, 0, j, k] = Ws[j, k]
+            partial[wl_idx, block, 1, j, k] = Wp[j, k]
+
+
+@cuda.jit(cache=True)
+def combine_pairs(dst, src, wls_size, n_src):
+    """
+    One level of the tree reduction: dst[k] = src[2k] @ src[2k + 1].
+    The last block is copied if n_src is odd.
+    """
+    wl_idx, k = cuda.grid(2)
+    if wl_idx > wls_size - 1 or k > (n_src + 1) // 2 - 1:
+        return
+    left = 2 * k
+    for pol in range(2):
+        if left + 1 < n_src:
+            mul_to(
+                src[wl_idx, left, pol],
+                src[wl_idx, left + 1, pol],
+                dst[wl_idx, k, pol]
+            )
+        else:
+            for j in range(2):
+                for m in range(2):
+                    dst[wl_idx, k, pol, j, m] = src[wl_idx, left, pol, j, m]
+
+
+@cuda.jit(cache=True)
+def finalize(
+    spectrum,
+    partial,
+    n_sub_arr,
+    n_inc_arr,
+    inc_ang,
+    wls_size,
+    s_ratio,
+    p_ratio
+):
+    """
+    Multiplies the product of all layers (partial[:, 0]) with D_0^{-1} and
+    D_{n+1} and calculates R and T, as in forward_propagation_free.
+    """
+    thread_id = cuda.grid(1)
+    if thread_id > wls_size - 1:
+        return
+
+    n_sub = n_sub_arr[thread_id]
+    n_inc = n_inc_arr[thread_id]
+    cos_inc = cmath.cos(inc_ang)
+    cos_sub = cmath.sqrt(1 - ((n_inc / n_sub) * cmath.sin(inc_ang)) ** 2)
+
+    Ms = cuda.local.array((2, 2), dtype="complex128")
+    Mp = cuda.local.array((2, 2), dtype="complex128")
+
+    Ws = cuda.local.array((2, 2), dtype="complex128")
+    Ws[0, 0] = 0.5
+    Ws[0, 1] = 0.5 / (cos_inc * n_inc)
+    Ws[1, 0] = 0.5
+    Ws[1, 1] = -0.5 / (cos_inc * n_inc)
+
+    Wp = cuda.local.array((2, 2), dtype="complex128")
+    Wp[0, 0] = 0.5 / n_inc
+    Wp[0, 1] = 0.5 / cos_inc
+    Wp[1, 0] = 0.5 / n_inc
+    Wp[1, 1] = -0.5 / cos_inc
+
+    mul_right(Ws, partial[thread_id, 0, 0])
+    mul_right(Wp, partial[thread_id, 0, 1])
+
+    Ms[0, 0] = 1.
+    Ms[0, 1] = 1.
+    Ms[1, 0] = n_sub * cos_sub
+    Ms[1, 1] = -n_sub * cos_sub
+
+    Mp[0, 0] = n_sub
+    Mp[0, 1] = n_sub
+    Mp[1, 0] = cos_sub
+    Mp[1, 1] = -cos_sub
+
+    mul_right(Ws, Ms)
+    mul_right(Wp, Mp)
+
+    rs = Ws[1, 0] / Ws[0, 0]
+    rp = Wp[1, 0] / Wp[0, 0]
+    R = (s_ratio * rs * rs.conjugate() + p_ratio * rp * rp.conjugate()) \
+        / (s_ratio + p_ratio)
+    spectrum[thread_id] = R.real
+
+    ts = 1 / Ws[0, 0]
+    tp = 1 / Wp[0, 0]
+    T = cos_sub * n_sub / (cos_inc * n_inc) * \
+        (s_ratio * ts * ts.conjugate() + p_ratio * tp * tp.conjugate()) \
+        / (s_ratio + p_ratio)
+    spectrum[thread_id + wls_size] = T.real
@@ -0,0 +1,212 @@
+"""incoherent.py - thick (incoherent) substrates and back side coatings.
+
+A glass slide is thousands of wavelengths thick. Its fringes are far too dense
+to be resolved by the target wavelength grid and are washed out in any real
+measurement anyway. Instead of treating the substrate as semi-infinite, the
+coherent stacks on both sides of it are combined with intensity matrices
+(Mitsas & Siapkas, Appl. Opt. 34, 1995):
+
+    incidence | front coating | thick substrate | back coating | exit medium
+
+Each coherent stack is reduced to the reflectances and transmittances from
+both sides, which give its 2 * 2 intensity matrix
+
+    M = 1 / T [[1, -R_rev], [R, T T_rev - R R_rev]]
+
+and the substrate to the propagation matrix diag(1 / A, A), where A is the
+single pass intensity attenuation. R and T of the whole system follow from
+the product of the three matrices in closed form, so evaluating the
+fringe-free spectrum takes one extra 2 * 2 product per wavelength.
+
+Everything here is done on the host with numpy, vectorized over wavelengths.
+This is meant for evaluating designs; no gradients are provided. Films with
+an incoherent substrate can be evaluated but not optimized: the gradient
+based optimizers refuse them (remove_incoherent_substrate first to optimize
+the coherent model).
+"""
+import numpy as np
+
+
+def coherent_rt(wls, d, n_layers, n_in, n_out, kx):
+    """
+    Reflectance and transmittance of a coherent stack between two
+    semi-infinite media, for s and p polarized light separately.
+
+    Arguments:
+        wls (1d np.array):
+            wavelengths
+        d (1d np.array):
+            thicknesses of the layers, from the entrance medium on
+        n_layers (2d np.array):
+            wls.shape[0] \cross d.shape[0]. refractive indices of each layer
+        n_in, n_out (1d np.array):
+            refractive indices of the entrance and exit medium
+        kx (1d np.array):
+            n sin(theta), conserved through the stack (Snell's law)
+
+    Returns:
+        R, T (2d np.array):
+            2 \cross wls.shape[0]. First row s, second row p polarization.
+    """
+    n_in = n_in.astype('complex128')
+    n_out = n_out.astype('complex128')
+    cos_in = np.sqrt(1 - (kx / n_in) ** 2)
+    cos_out = np.sqrt(1 - (kx / n_out) ** 2)
+
+    # W = D_in^{-1} M_1 ... M_n D_out, shape (wls, 2, 2) for each polarization
+    Ws = np.empty((wls.shape[0], 2, 2), dtype='complex128')
+    Ws[:, 0, 0] = 0.5
+    Ws[:, 0, 1] = 0.5 / (cos_in * n_in)
+    Ws[:, 1, 0] = 0.5
+    Ws[:, 1, 1] = -0.5 / (cos_in * n_in)
+
+    Wp = np.empty((wls.shape[0], 2, 2), dtype='complex128')
+    Wp[:, 0, 0] = 0.5 / n_in
+    Wp[:, 0, 1] = 0.5 / cos_in
+    Wp[:, 1, 0] = 0.5 / n_in
+    Wp[:, 1, 1] = -0.5 / cos_in
+
+    Ms = np.empty_like(Ws)
+    Mp = np.empty_like(Wp)
+    for i in range(d.shape[0]):
+        ni = n_layers[:, i]
+        cosi = np.sqrt(1 - (kx / ni) ** 2)
+        phi = 2 * np.pi * 1j * cosi * ni * d[i] / wls
+        coshi = np.cosh(phi)
+        sinhi = np.sinh(phi)
+
+        Ms[:, 0, 0] = coshi
+        Ms[:, 0, 1] = sinhi / cosi / ni
+        Ms[:, 1, 0] = cosi * ni * sinhi
+        Ms[:, 1, 1] = coshi
+
+        Mp[:, 0, 0] = coshi
+        Mp[:, 0, 1] = sinhi * ni / cosi
+        Mp[:, 1, 0] = cosi / ni * sinhi
+        Mp[:, 1, 1] = coshi
+
+        Ws = Ws @ Ms
+        Wp = Wp @ Mp
+
+    # only the first column of D_out matters since E_out = (1, 0)
+    rs = (Ws[:, 1, 0] + Ws[:, 1, 1] * n_out * cos_out) / \
+        (Ws[:, 0, 0] + Ws[:, 0, 1] * n_out * cos_out)
+    ts = 1 / (Ws[:, 0, 0] + Ws[:, 0, 1] * n_out * cos_out)
+    rp = (Wp[:, 1, 0] * n_out + Wp[:, 1, 1] * cos_out) / \
+        (Wp[:, 0, 0] * n_out + Wp[:, 0, 1] * cos_out)
+    tp = 1 / (Wp[:, 0, 0] * n_out + Wp[:, 0, 1] * cos_out)
+
+    flux = (n_out * cos_out).real / (n_in * cos_in).real
+    R = np.stack([np.abs(rs) ** 2, np.abs(rp) ** 2])
+    T = np.stack([flux * np.abs(ts) ** 2, flux * np.abs(tp) ** 2])
+    return R, T
+
+
+def intensity_matrix(R, T, R_rev, T_rev):
+    """
+    Intensity matrix of a coherent stack from its reflectance and
+    transmittance seen from the front (R, T) and from the back
+    (R_rev, T_rev). Works on arrays of any shape; the matrix axes are
+    appended at the end.
+    """
+    M = np.empty(R.shape + (2, 2))
+    M[..., 0, 0] = 1
+    M[..., 0, 1] = -R_rev
+    M[..., 1, 0] = R
+    M[..., 1, 1] = T * T_rev - R * R_rev
+    return M / T[..., np.newaxis, np.newaxis]
+
+
+def stack_intensity_matrix(wls, d, n_layers, n_in, n_out, kx):
+    """
+    Intensity matrices (2 \cross wls.shape[0] \cross 2 \cross 2, s and p) of a
+    coherent stack. See coherent_rt for the arguments.
+    """
+    R, T = coherent_rt(wls, d, n_layers, n_in, n_out, kx)
+    R_rev, T_rev = coherent_rt(
+        wls, d[::-1], n_layers[:, ::-1], n_out, n_in, kx)
+    return intensity_matrix(R, T, R_rev, T_rev)
+
+
+def propagation_matrix(A):
+    """
+    Intensity matrix of an incoherent layer with single pass intensity
+    attenuation A.
+    """
+    P = np.zeros(A.shape + (2, 2))
+    P[..., 0, 0] = 1 / A
+    P[..., 1, 1] = A
+    return P
+
+
+def get_spectrum_incoherent(
+    spectrum,
+    wls,
+    d,
+    n_layers,
+    n_sub,
+    n_inc,
+    inc_ang,
+    sub_thickness,
+    n_exit,
+    d_back=None,
+    n_layers_back=None,
+    s_ratio=1,
+    p_ratio=1
+):
+    """
+    Reflectance and transmittance of a coated thick substrate, treating the
+    substrate incoherently.
+
+    Arguments:
+        spectrum (1d np.array):
+            2 * wls.shape[0], type: float64
+            pre-allocated memory space for returning spectrum
+        wls (1d np.array):
+            wavelengths of the target spectrum
+        d, n_layers:
+            thicknesses and refractive indices (wls.shape[0] \cross
+            d.shape[0]) of the front coating, as in the coherent engines
+        n_sub (1d np.array):
+            refractive indices of the substrate
+        n_inc (1d np.array):
+            refractive indices of the incident material
+        inc_ang (float):
+            incident angle in degree
+        sub_thickness (float):
+            geometric thickness of the substrate, in the unit of wls
+        n_exit (1d np.array):
+            refractive indices of the medium behind the substrate
+        d_back, n_layers_back:
+            optional coating on the back side of the substrate, ordered from
+            the substrate to the exit medium
+        s_ratio, p_ratio (float):
+            portions of s and p polarized light
+
+    Returns:
+        size: 2 \cross wls.shape[0] spectrum
+        (Reflectance spectrum + Transmittance spectrum).
+    """
+    wls_size = wls.shape[0]
+    if d_back is None:
+        d_back = np.array([])
+        n_layers_back = np.empty((wls_size, 0), dtype='complex128')
+    n_sub = n_sub.astype('complex128')
+    kx = n_inc.astype('complex128') * np.sin(inc_ang / 180 * np.pi)
+
+    M_front = stack_intensity_matrix(wls, d, n_layers, n_inc, n_sub, kx)
+    M_back = stack_intensity_matrix(
+        wls, d_back, n_layers_back, n_sub, n_exit, kx)
+
+    # single pass attenuation |exp(i 2 pi n cos D / wl)| ** 2
+    cos_sub = np.sqrt(1 - (kx / n_sub) ** 2)
+    A = np.exp(-4 * np.pi * (n_sub * cos_sub).imag * sub_thickness / wls)
+
+    M = M_front @ propagation_matrix(A) @ M_back
+    R = M[..., 1, 0] / M[..., 0, 0]
+    T = 1 / M[..., 0, 0]
+
+    spectrum[:wls_size] = (s_ratio * R[0] + p_ratio * R[1]) / \
+        (s_ratio + p_ratio)
+    spectrum[wls_size:] = (s_ratio * T[0] + p_ratio * T[1]) / \
+        (s_ratio + p_ratio)
@@ -0,0 +1,126 @@
+"""dispersion.py - memoised refractive indices of materials.
+
+Every film and spectrum needs the refractive indices of its materials on the
+wavelength grids of the target spectra, and the same (material, grid) pairs
+come up over and over: every SpectrumSimple, every stack_init_params call of
+an optimizer, every film of a needle / sweep run on the same targets.
+calculate_n evaluates a material once per grid, vectorised over the
+wavelengths, and keeps the result in a process wide LRU cache keyed by
+(material, digest of the grid). Materials are compared by value (see
+utils.materials), so a name and the Material it stands for share entries.
+The returned arrays are read-only and shared by all callers.
+
+The cache is bounded by memory: least recently used grids are dropped once
+the stored arrays exceed max_bytes. TFD_DISPERSION_CACHE_MB sets the default
+cap (256 MB); 0 disables caching.
+"""
+import hashlib
+import os
+from collections import OrderedDict
+import numpy as np
+from utils.materials import get_material
+
+
+DEFAULT_MAX_MB = 256
+
+
+def grid_digest(wls):
+    '''Digest of a wavelength grid. Equal for grids with the same values.'''
+    wls = np.ascontiguousarray(wls, dtype='float64')
+    return (wls.shape, hashlib.blake2b(wls.tobytes(), digest_size=16).digest())
+
+
+def evaluate(material, wls):
+    '''
+    Refractive indices of material (see utils.materials.get_material) at
+    wls, vectorised and not cached.
+
+    Returns:
+        1d NDArray, type: complex128, size is wls.shape[0]
+    '''
+    # constant materials may return a scalar
+    return np.array(
+        np.broadcast_to(get_material(material)(wls), wls.shape),
+        dtype='complex128'
+    )
+
+
+class DispersionCache:
+    '''
+    LRU cache of refractive index arrays.
+
+    Attributes:
+        max_bytes (int):
+            total size of the stored arrays before the least recently used
+            are evicted
+        nbytes (int):
+            total size of the stored arrays
+        hits, misses (int):
+            statistics of get
+    '''
+
+    def __init__(self, max_bytes=DEFAULT_MAX_MB << 20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._arrays = OrderedDict()
+
+    def __len__(self):
+        return len(self._arrays)
+
+    def get(self, material, wls):
+        '''
+        Read-only refractive indices of material at wls, evaluated on the
+        first request of this (material, grid) pair.
+        '''
+        key = (get_material(material), grid_digest(wls))
+        n = self._arrays.get(key)
+        if n is not None:
+            self._arrays.move_to_end(key)
+            self.hits += 1
+            return n
+
+        self.misses += 1
+        n = evaluate(key[0], wls)
+        n.flags.writeable = False
+        if n.nbytes > self.max_bytes:
+            return n
+        self._arrays[key] = n
+        self.nbytes += n.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._arrays.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+        return n
+
+    def clear(self):
+        self._arrays.clear()
+        self.nbytes = 0
+
+
+_cache = None
+
+
+def get_cache():
+    '''Process wide DispersionCache, capped at TFD_DISPERSION_CACHE_MB'''
+    global _cache
+    if _cache is None:
+        max_mb = float(os.environ.get('TFD_DISPERSION_CACHE_MB', DEFAULT_MAX_MB))
+        _cache = DispersionCache(max_bytes=int(max_mb * (1 << 20)))
+    return _cache
+
+
+def set_cache(cache):
+    '''Replace the process wide cache, e.g. with a differently sized one'''
+    global _cache
+    _cache = cache
+
+
+def calculate_n(material, wls):
+    '''
+    Refractive indices of material at wls from the process wide cache.
+
+    Returns:
+        1d NDArray, read-only, type: complex128, size is wls.shape[0]
+    '''
+    return get_cache().get(material, wls)
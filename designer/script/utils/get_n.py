@@ -78,31 +78,20 @@ def load_from_file(fname_n, fname_k) -> tuple[NDArray, NDArray]:
     return wls * 1000, n - 1j * k
 
 
-cached_Si = False
-wls_Si = None
-n_Si = None
-n_Si_interp = None
-
-
 def get_Si_exp(wl):
     '''
     Get refractive index & extinction coeff from file.
     NOTE: input wls instead of iteratively calling this function
-    has significantly better performance (for ~ 1000 pts, ~1 s 
-    compared to ~ 0.003 s)
+    has significantly better performance
 
     Parameters:
         wl: wavelength OR wavelengths (array-like) to compute wl
     '''
     # Si: Green 2008
-    # NOTE: 300 nm - 1510 nm
-
-    global cached_Si, wls_Si, n_Si
-    if not cached_Si:
-        wls_Si, n_Si = load_from_file(
-            'Si_n_Green-2008.csv',
-            'Si_k_Green-2008.csv'
-        )
-        n_Si_interp = scipy.interpolate.interp1d(wls_Si, n_Si)
-
-    return n_Si_interp(wl)
+    # NOTE: 300 nm - 1510 nm, ValueError outside
+    from utils.materials import load_tabulated
+    return load_tabulated(
+        'Si_n_Green-2008.csv',
+        'Si_k_Green-2008.csv',
+        name='Si'
+    )(wl)
@@ -1,6 +1,6 @@
 import numpy as np
 from film import BaseFilm
-from spectrum import BaseSpectrum
+from spectrum import BaseSpectrum, SpectrumSimple
 from typing import Sequence
 
 
@@ -16,12 +16,8 @@ def calculate_RMS(film1: BaseFilm, film2: BaseFilm):
         # target spectrum params
         inc_ang, wls = this_spec_film1.INC_ANG, this_spec_film1.WLS
         this_spec_film2 = film2.get_spec(inc_ang, wls)
-        # if spec updated, no need to calculate again
-        if not this_spec_film1.is_updated():
-            this_spec_film1.calculate()
-        if not this_spec_film2.is_updated():
-            this_spec_film2.calculate()
-        # R and T spec are counted
+        # R and T spec are counted. get_R / get_T only calculate if the film
+        # changed since the last call
         R_1 = np.append(R_1, this_spec_film1.get_R())
         R_2 = np.append(R_2, this_spec_film2.get_R())
 
@@ -49,10 +45,8 @@ def calculate_RMS_f_spec(film: BaseFilm, specs: Sequence[BaseSpectrum]):
         # target spectrum params
         inc_ang, wls = spec.INC_ANG, spec.WLS
         this_spec_film = film.get_spec(inc_ang, wls)
-        # if spec updated, no need to calculate again
-        if not this_spec_film.is_updated():
-            this_spec_film.calculate()
-        # R and T spec are counted
+        # R and T spec are counted. get_R / get_T only calculate if the film
+        # changed since the last call
         R_1 = np.append(R_1, this_spec_film.get_R())
         R_2 = np.append(R_2, spec.get_R())
 
@@ -63,5 +57,24 @@ def calculate_RMS_f_spec(film: BaseFilm, specs: Sequence[BaseSpectrum]):
     return rms(f)
 
 
+def calculate_RMS_f_spec_averaged(
+    film: BaseFilm,
+    specs: Sequence[BaseSpectrum],
+    **quadrature
+):
+    '''
+        calculate_RMS_f_spec with the spectra of the film averaged over
+        the quadrature nodes (wl_offsets, wl_weights, ang_offsets,
+        ang_weights), see SpectrumSimple.calculate_averaged
+    '''
+    f = np.array([])
+    for spec in specs:
+        # not the film's own spectrum, which is not averaged
+        this_spec_film = SpectrumSimple(spec.INC_ANG, spec.WLS, film)
+        this_spec_film.calculate_averaged(**quadrature)
+        f = np.append(f, this_spec_film.spec - np.append(spec.get_R(), spec.get_T()))
+    return rms(f)
+
+
 def rms(f):
     return np.sqrt(np.sum(np.square(f)) / f.shape[0])
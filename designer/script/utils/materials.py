@@ -0,0 +1,340 @@
+"""materials.py - first-class dispersion models and the material registry.
+
+A material is an object mapping wavelengths (nm, scalar or array) to
+refractive indices, evaluated vectorised. Materials compare and hash by
+value, so they can key caches (utils.dispersion) and tell films whether two
+layers are made of the same material, and they pickle with the standard
+library, so films can be sent to worker processes.
+
+    ConstantMaterial      non-dispersive, n
+    CauchyMaterial        n = A + B / wl^2 + C / wl^4 + ...    (wl in um)
+    SellmeierMaterial     n^2 = A + sum_i B_i wl^2 / (wl^2 - C_i)  (wl in um)
+    TabulatedMaterial     linear interpolation of measured (wl, n) data
+    CallableMaterial      any module level function wl -> n
+
+Films look materials up by name in a MaterialRegistry (`registry` holds the
+built-in ones). Names that are not registered fall back to the functions
+get_n_<name> in utils.get_n, so materials added there keep working.
+
+Measured data in designer/material_data is parsed once per machine into a
+binary .npy cache (TFD_MATERIAL_CACHE, default
+~/.cache/thin_film_designer/material_data) which every process memory-maps,
+see load_tabulated.
+"""
+import hashlib
+import importlib.resources as pkg_resources
+import numbers
+import os
+import sys
+from abc import ABC, abstractmethod
+import numpy as np
+from designer import material_data
+import designer.material_data.exp_eq as exp_eq
+import utils.get_n as get_n
+
+
+class Material(ABC):
+    '''
+    Refractive index as a function of the wavelength.
+
+    Attributes:
+        name (str): used for printing only, not part of the identity
+    '''
+    name = None
+
+    @abstractmethod
+    def __call__(self, wl):
+        '''
+        Parameters:
+            wl: wavelength in nm or 1d NDArray of wavelengths
+        Returns:
+            refractive index, same shape as wl
+        '''
+        raise NotImplementedError
+
+    @abstractmethod
+    def _key(self):
+        '''Tuple of the parameters defining this material'''
+        raise NotImplementedError
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash((type(self).__name__, self._key()))
+
+    def __repr__(self):
+        if self.name is not None:
+            return self.name
+        return f'{type(self).__name__}{self._key()}'
+
+
+class ConstantMaterial(Material):
+
+    def __init__(self, n, name=None):
+        self.n = n
+        self.name = name
+
+    def __call__(self, wl):
+        return np.full(np.shape(wl), self.n)[()]
+
+    def _key(self):
+        return (complex(self.n),)
+
+
+class CauchyMaterial(Material):
+
+    def __init__(self, coefficients, name=None):
+        '''
+        Parameters:
+            coefficients (sequence of float):
+                A, B, C, ... of n = A + B / wl^2 + C / wl^4 + ..., wl in um
+        '''
+        self.coefficients = tuple(float(c) for c in coefficients)
+        self.name = name
+
+    def __call__(self, wl):
+        wl = np.asarray(wl) * 1e-3  # nm to um
+        n = self.coefficients[0]
+        for i, c in enumerate(self.coefficients[1:]):
+            n = n + c / wl ** (2 * (i + 1))
+        return n
+
+    def _key(self):
+        return self.coefficients
+
+
+class SellmeierMaterial(Material):
+
+    def __init__(self, B, C, A=1., name=None):
+        '''
+        Parameters:
+            B, C (sequence of float):
+                n^2 = A + sum_i B_i wl^2 / (wl^2 - C_i), wl in um
+            A (float)
+        '''
+        assert len(B) == len(C), 'one pole per coefficient'
+        self.A = float(A)
+        self.B = tuple(float(b) for b in B)
+        self.C = tuple(float(c) for c in C)
+        self.name = name
+
+    def __call__(self, wl):
+        wl2 = (np.asarray(wl) * 1e-3) ** 2
+        n2 = self.A
+        for b, c in zip(self.B, self.C):
+            n2 = n2 + b * wl2 / (wl2 - c)
+        return np.sqrt(n2)
+
+    def _key(self):
+        return (self.A, self.B, self.C)
+
+
+class TabulatedMaterial(Material):
+
+    def __init__(self, wls, n, name=None):
+        '''
+        Parameters:
+            wls (1d NDArray): ascending wavelengths of the data in nm
+            n (1d NDArray): (complex) refractive indices at wls
+        '''
+        # not copied, may be memory-mapped (see load_tabulated)
+        self.wls = np.asarray(wls, dtype='float64')
+        self.n = np.asarray(n, dtype='complex128')
+        # (fname_n, fname_k) in material_data if loaded by load_tabulated
+        self.source = None
+        assert self.wls.shape == self.n.shape, 'one n per wavelength'
+        assert np.all(np.diff(self.wls) > 0), 'wls must be ascending'
+        self.name = name
+        self._digest = hashlib.blake2b(
+            self.wls.tobytes() + self.n.tobytes(), digest_size=16).digest()
+
+    def __call__(self, wl):
+        wl = np.asarray(wl, dtype='float64')
+        if np.any(wl < self.wls[0]) or np.any(wl > self.wls[-1]):
+            raise ValueError(
+                f'{self}: data only available in '
+                f'[{self.wls[0]}, {self.wls[-1]}] nm')
+        return (np.interp(wl, self.wls, self.n.real)
+                + 1j * np.interp(wl, self.wls, self.n.imag))[()]
+
+    def _key(self):
+        return (self._digest,)
+
+    def __reduce__(self):
+        # materials from material_data are unpickled from the cache of the
+        # receiving process instead of shipping the data
+        if self.source is not None:
+            return (load_tabulated, self.source + (self.name,))
+        return (TabulatedMaterial, (self.wls, self.n, self.name))
+
+
+class CallableMaterial(Material):
+
+    def __init__(self, func, name=None):
+        '''
+        Parameters:
+            func (callable):
+                wl -> n, vectorised. Must be a module level function (not a
+                lambda or closure) for the material to be picklable.
+        '''
+        self.func = func
+        self.name = getattr(func, '__name__', None) if name is None else name
+
+    def __call__(self, wl):
+        return self.func(wl)
+
+    def _key(self):
+        # a module level function is the same material in every process.
+        # Other callables (lambdas and closures share their qualname) are
+        # compared by identity
+        module = getattr(self.func, '__module__', None)
+        qualname = getattr(self.func, '__qualname__', None)
+        obj = sys.modules.get(module)
+        for attr in (qualname or '<>').split('.'):
+            obj = getattr(obj, attr, None)
+        if obj is self.func:
+            return (module, qualname)
+        return (self.func,)
+
+
+def material_cache_dir():
+    return os.environ.get(
+        'TFD_MATERIAL_CACHE',
+        os.path.join(
+            os.path.expanduser('~'),
+            '.cache',
+            'thin_film_designer',
+            'material_data'
+        )
+    )
+
+
+def _load_data(fname_n, fname_k):
+    '''
+    Returns:
+        2 * N complex NDArray: wavelengths in nm and refractive indices,
+        memory-mapped from the binary cache, which is compiled from the csv
+        files if needed
+    '''
+    raw = pkg_resources.read_binary(material_data, fname_n) + \
+        pkg_resources.read_binary(material_data, fname_k)
+    # a changed csv gets a new cache file
+    digest = hashlib.blake2b(raw, digest_size=8).hexdigest()
+    path = os.path.join(
+        material_cache_dir(),
+        f'{os.path.splitext(fname_n)[0]}-{digest}.npy'
+    )
+    if os.path.exists(path):
+        try:
+            return np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            pass  # corrupted: compile again
+
+    wls, n = get_n.load_from_file(fname_n, fname_k)
+    data = np.stack([wls.astype('complex128'), n])
+    try:
+        os.makedirs(material_cache_dir(), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, data)
+        os.replace(tmp_path, path)
+        return np.load(path, mmap_mode='r')
+    except OSError:
+        # read-only home etc.: keep the parsed data in memory
+        return data
+
+
+_tabulated = {}
+
+
+def load_tabulated(fname_n, fname_k, name=None) -> TabulatedMaterial:
+    '''
+    Material of measured n and k in the csv files fname_n, fname_k of
+    designer/material_data (first column wavelength in um). The files are
+    parsed once per machine, and the material is kept per process.
+    '''
+    key = (fname_n, fname_k)
+    if key not in _tabulated:
+        data = _load_data(fname_n, fname_k)
+        material = TabulatedMaterial(data[0].real, data[1], name=name)
+        material.source = key
+        _tabulated[key] = material
+    return _tabulated[key]
+
+
+class MaterialRegistry:
+    '''
+    Materials by name.
+
+    get accepts everything films accept as a material: a Material, a
+    registered name, the name of a get_n_<name> function in utils.get_n, or
+    a number (constant refractive index).
+    '''
+
+    def __init__(self):
+        self._materials = {}
+
+    def register(self, name, material, overwrite=False):
+        if not isinstance(material, Material):
+            raise TypeError(f'{material} is not a Material')
+        if name in self._materials and not overwrite:
+            raise ValueError(f'material {name} already registered')
+        if material.name is None:
+            material.name = name
+        self._materials[name] = material
+
+    def names(self):
+        return list(self._materials.keys())
+
+    def __contains__(self, name):
+        return name in self._materials
+
+    def get(self, material) -> Material:
+        if isinstance(material, Material):
+            return material
+        if isinstance(material, (str, np.str_)):
+            name = str(material)
+            if name in self._materials:
+                return self._materials[name]
+            func = getattr(get_n, f'get_n_{name}', None)
+            if func is None:
+                raise ValueError(
+                    f'Material {name} not found. Register it or define '
+                    'get_n_{name} in utils.get_n')
+            return CallableMaterial(func, name=name)
+        if isinstance(material, numbers.Number):
+            return ConstantMaterial(material, name=str(material))
+        raise ValueError(
+            'bad material. should be a Material, a registered name or a number')
+
+
+def default_registry():
+    '''Registry of the materials defined in utils.get_n'''
+    reg = MaterialRegistry()
+    reg.register('Air', ConstantMaterial(1.))
+    reg.register('1', ConstantMaterial(1.))
+    reg.register('1_5', ConstantMaterial(1.5))
+    reg.register('2', ConstantMaterial(2.))
+    # SiO2: Ghosh 1999 crystal, alpha-quartz. 198 nm - 2050 nm
+    reg.register('SiO2', SellmeierMaterial(
+        B=(1.07044083, 1.10202242), C=(0.0100585997, 100.), A=1.28604141))
+    reg.register('BK7', SellmeierMaterial(
+        B=(1.03961212, 0.231792344, 1.01046945),
+        C=(0.00600069867, 0.0200179144, 103.560653)))
+    # TiO2: Devore 1951, crystal. 430 nm - 1530 nm. Not of Sellmeier form
+    reg.register('TiO2', CallableMaterial(exp_eq.get_n_TiO2_Sellmeier))
+    reg.register('Ta2O5_xc', CauchyMaterial((2.083033, 3.0398531e-2, 6.6997423e-9)))
+    reg.register('SiO2_xc', CauchyMaterial((1.476128, 1.5048792e-3, 4.3051470e-4)))
+    reg.register('MgF2_xc', CauchyMaterial((1.384, -3.651e-3, 6.429e-4)))
+    # Si: Green 2008, tabulated. 300 nm - 1510 nm
+    reg.register('Si', CallableMaterial(get_n.get_n_Si))
+    return reg
+
+
+registry = default_registry()
+
+
+def get_material(material) -> Material:
+    '''Material of a name, number or Material from the default registry'''
+    return registry.get(material)
@@ -11,7 +11,7 @@ from utils.loss import calculate_RMS
 
 
 def equal_optical_thickness(f: TwoMaterialFilm, d_min):
-    d = f.get_d()
+    d = f.get_d().copy()
     # neglect first layer...
     i = 1
     count = 0
@@ -33,7 +33,7 @@ def equal_optical_thickness(f: TwoMaterialFilm, d_min):
     return count
 
 def equal_optical_thickness_new(f: TwoMaterialFilm, d_min, wl=700, eq_thickness=False):
-    d = f.get_d()
+    d = f.get_d().copy()
     # neglect first layer...
     del_idx = []
     count = 0
@@ -121,7 +121,7 @@ def optimal_and_thin_film_approx_substitution_onestep_new(f: TwoMaterialFilm, d_
     # assume single spec
     assert len(f.get_all_spec_list()) == 1, "too many spectrums"
     # load params to the get W function
-    d = f.get_d()
+    d = f.get_d().copy()
     spec = f.get_spec()
     count = 0
     ratios: list[float] = []
@@ -57,7 +57,7 @@ def optimal_and_thin_film_approx_substitution_onestep_new(f: FilmSimple, d_min):
     # assume single spec
     assert len(f.get_all_spec_list()) == 1, "too many spectrums"
     # load params to the get W function
-    d = f.get_d()
+    d = f.get_d().copy()
     spec = f.get_spec()
     count = 0
     ratios = []
@@ -92,7 +92,7 @@ def optimal_and_thin_film_approx_substitution_onestep_new(f: FilmSimple, d_min):
     return count, ratios
 
 def equal_optical_thickness(f: FilmSimple, d_min):
-    d = f.get_d()
+    d = f.get_d().copy()
     i = 1
     count = 0
     while i < d.shape[0] - 1:
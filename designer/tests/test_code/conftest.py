@@ -0,0 +1,20 @@
+import os
+import sys
+sys.path.append('./designer/script/')
+import pytest
+import tmm.autotune as autotune
+
+
+@pytest.fixture(scope='session', autouse=True)
+def autotune_cache(tmp_path_factory):
+    '''Keep the launch configurations tuned by the tests out of ~/.cache'''
+    old = os.environ.get('TFD_AUTOTUNE_CACHE')
+    os.environ['TFD_AUTOTUNE_CACHE'] = str(
+        tmp_path_factory.mktemp('autotune') / 'launch_config.json')
+    autotune.set_tuner(None)
+    yield
+    autotune.set_tuner(None)
+    if old is None:
+        del os.environ['TFD_AUTOTUNE_CACHE']
+    else:
+        os.environ['TFD_AUTOTUNE_CACHE'] = old
@@ -0,0 +1,25 @@
+'''
+Target spectra of a known film, shared by the optimizer tests.
+
+Usage (from the repository root, as the tests are run):
+    sys.path.append('./designer/tests/test_code/')
+    from film_targets import d_true, d_init, make_wls, make_target
+'''
+import numpy as np
+from spectrum import Spectrum
+
+
+# TiO2 / SiO2 on BK7, and a start close enough to converge to it
+d_true = np.array([80., 120., 60., 150., 90., 40.])
+d_init = d_true + np.array([5., -6., 4., -3., 5., 2.])
+
+
+def make_wls(wl_num):
+    '''wl_num wavelengths between 400 and 1000 nm'''
+    return np.linspace(400, 1000, wl_num)
+
+
+def make_target(film, wls, inc_ang=0.):
+    '''R and T of film at wls as a target Spectrum'''
+    s = film.add_spec_param(inc_ang, wls)
+    return Spectrum(inc_ang, wls, s.get_R().copy(), s.get_T().copy())
@@ -0,0 +1,68 @@
+import unittest
+import numpy as np
+from scipy.interpolate import CubicSpline
+import sys
+sys.path.append("./designer/script")
+sys.path.append("./")
+import film as film
+
+
+class TestAdaptive(unittest.TestCase):
+
+    def setUp(self):
+        # quarter wave stack at 750 nm: flat stop band, fringes outside
+        n_H, n_L = 2.3, 1.45
+        d = np.array([750 / 4 / n_H, 750 / 4 / n_L] * 10)
+        self.f = film.TwoMaterialFilm(n_H, n_L, 1.52, d)
+        self.wls = np.linspace(500, 1000, 1001)
+        self.s = self.f.add_spec_param(0., self.wls)
+
+    def test_adaptive(self):
+        self.s.calculate()
+        R_fine, T_fine = self.s.get_R().copy(), self.s.get_T().copy()
+
+        tol = 1e-3
+        wls, R, T = self.s.calculate_adaptive(tol=tol)
+        self.assertTrue(np.all(np.diff(wls) > 0))
+        self.assertEqual(wls[0], 500.)
+        self.assertEqual(wls[-1], 1000.)
+        self.assertLess(wls.shape[0], self.wls.shape[0])
+        # interpolating the adaptive grid reproduces the fine spectrum
+        self.assertLess(
+            np.max(np.abs(np.interp(self.wls, wls, R) - R_fine)), 10 * tol)
+        self.assertLess(
+            np.max(np.abs(np.interp(self.wls, wls, T) - T_fine)), 10 * tol)
+        # spectrum on the grid is exact
+        spec = self.f.add_spec_param(0., wls)
+        spec.calculate()
+        np.testing.assert_almost_equal(spec.get_R(), R)
+
+        # does not overwrite the stored spectrum
+        np.testing.assert_almost_equal(self.s.spec_R, R_fine)
+
+    def test_adaptive_derivative(self):
+        self.s.calculate()
+        wls_linear, _, _ = self.s.calculate_adaptive(tol=1e-3)
+        wls, R, T = self.s.calculate_adaptive(tol=1e-3, use_derivative=True)
+        self.assertLess(wls.shape[0], wls_linear.shape[0])
+        # the grid resolves the spectrum for cubic interpolation
+        self.assertLess(
+            np.max(np.abs(CubicSpline(wls, R)(self.wls) - self.s.get_R())),
+            1e-2
+        )
+
+    def test_max_points(self):
+        wls, R, T = self.s.calculate_adaptive(tol=0., max_points=100)
+        self.assertLessEqual(wls.shape[0], 100)
+
+    def test_wl_derivative(self):
+        wls = np.linspace(600, 900, 5)
+        h = 1e-4
+        dspec = self.s.calculate_wl_derivative(wls)
+        fd = (self.s._calculate_at(wls + h) - self.s._calculate_at(wls - h)) \
+            / (2 * h)
+        np.testing.assert_almost_equal(dspec, fd, decimal=5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import unittest
+import os
+import json
+import tempfile
+import numpy as np
+import sys
+sys.path.append("./designer/script")
+sys.path.append("./")
+from numba import cuda
+from numba.cuda.cudadrv.driver import CudaAPIError
+from tmm.autotune import LaunchAutotuner
+import tmm.autotune as autotune
+
+
+@cuda.jit
+def add_one(out, n):
+    i = cuda.grid(1)
+    if i < n:
+        out[i] += 1.
+
+
+@cuda.jit
+def add_one_2d(out, nx, ny):
+    i, j = cuda.grid(2)
+    if i < nx and j < ny:
+        out[i, j] += 1.
+
+
+def make_timer(durations):
+    '''timer s.t. the k-th timed launch takes durations[k] seconds'''
+    calls = {'n': 0, 't': 0.}
+
+    def timer():
+        k = calls['n'] // 2
+        if calls['n'] % 2 == 1:
+            calls['t'] += durations[k]
+        calls['n'] += 1
+        return calls['t']
+    return timer
+
+
+class CountingKernel:
+    '''Mimics the kernel[grid, block](*args) launch syntax'''
+
+    def __init__(self, fail_blocks=(), error=None):
+        self.launches = []
+        self.fail_blocks = fail_blocks
+        self.error = CudaAPIError(
+            701, 'too many resources requested for launch') \
+            if error is None else error
+
+    def __getitem__(self, config):
+        grid, block = config
+
+        def launch(*args):
+            if block in self.fail_blocks:
+                raise self.error
+            self.launches.append((grid, block))
+        return launch
+
+
+class TestAutotune(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'launch_config.json')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def make_tuner(self, durations, **kwargs):
+        return LaunchAutotuner(
+            cache_path=self.path,
+            repeats=1,
+            timer=make_timer(durations),
+            synchronize=cuda.synchronize,
+            device_name='test_device',
+            **kwargs
+        )
+
+    def test_picks_fastest_and_launches(self):
+        n = 100
+        out = np.zeros(n)
+        tuner = self.make_tuner([5., 1., 3.], candidates=(16, 32, 64))
+
+        def reset():
+            out[:] = 0.
+        tuner.launch('add_one', add_one, n, (out, n), reset=reset)
+
+        self.assertEqual(tuner.block_size('add_one', add_one, n, (out, n)), 32)
+        # output of the final launch is valid
+        np.testing.assert_almost_equal(out, np.ones(n))
+
+    def test_cache_persisted(self):
+        n = 100
+        tuner = self.make_tuner([5., 1., 3.], candidates=(16, 32, 64))
+        tuner.launch('k', CountingKernel(), n, (), shape=(n, 10))
+        with open(self.path) as f:
+            self.assertIn(32, json.load(f).values())
+
+        # new process: only one launch, no benchmarking
+        kernel = CountingKernel()
+        tuner = self.make_tuner([], candidates=(16, 32, 64))
+        tuner.launch('k', kernel, n, (), shape=(n, 10))
+        self.assertListEqual(kernel.launches, [((n + 31) // 32, 32)])
+
+        # same bucket
+        kernel = CountingKernel()
+        tuner.launch('k', kernel, 120, (), shape=(120, 9))
+        self.assertEqual(len(kernel.launches), 1)
+
+        # new shape bucket: benchmark again
+        kernel = CountingKernel()
+        tuner = self.make_tuner([1., 2., 3.], candidates=(16, 32, 64))
+        tuner.launch('k', kernel, n, (), shape=(n, 1000))
+        self.assertEqual(kernel.launches[-1][1], 16)
+        self.assertEqual(len(kernel.launches), 5)
+
+    def test_skip_oversized_and_failing(self):
+        kernel = CountingKernel(fail_blocks=(16,))
+        tuner = self.make_tuner([1., 3.], candidates=(8, 16, 256))
+        # first (untimed) launch with 8, 256 > 2 * 10 is not tried,
+        # 16 fails
+        tuner.launch('k', kernel, 10, ())
+        self.assertEqual(tuner.block_size('k', kernel, 10, ()), 8)
+
+        kernel = CountingKernel(fail_blocks=(8, 16))
+        tuner = self.make_tuner([], candidates=(8, 16))
+        self.assertRaises(
+            RuntimeError, lambda: tuner.launch('k2', kernel, 10, ()))
+
+    def test_errors_raised(self):
+        # errors other than refused launches are not swallowed
+        kernel = CountingKernel(fail_blocks=(16,), error=TypeError('bad'))
+        tuner = self.make_tuner([1.], candidates=(8, 16))
+        self.assertRaises(TypeError, lambda: tuner.launch('k', kernel, 10, ()))
+
+    def test_2d(self):
+        nx, ny = 20, 6
+        out = np.zeros((nx, ny))
+        tuner = self.make_tuner(
+            [4., 2., 3.], candidates_2d=((16, 1), (8, 8), (32, 4)))
+
+        def reset():
+            out[:] = 0.
+        tuner.launch_2d('add_one_2d', add_one_2d, (nx, ny), (out, nx, ny),
+                        reset=reset)
+        self.assertTupleEqual(
+            tuner.block_shape_2d('add_one_2d', add_one_2d, (nx, ny), ()),
+            (8, 8)
+        )
+        np.testing.assert_almost_equal(out, np.ones((nx, ny)))
+
+    def test_disabled(self):
+        old = os.environ.get('TFD_AUTOTUNE')
+        os.environ['TFD_AUTOTUNE'] = '0'
+        try:
+            kernel = CountingKernel()
+            autotune.launch('k', kernel, 100, ())
+            autotune.launch('k', kernel, 100, (), candidates=(1, 2))
+            self.assertListEqual(kernel.launches, [(7, 16), (100, 1)])
+        finally:
+            if old is None:
+                del os.environ['TFD_AUTOTUNE']
+            else:
+                os.environ['TFD_AUTOTUNE'] = old
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+import functools
+import numpy as np
+import sys
+sys.path.append("./designer/script")
+sys.path.append("./")
+import film as film
+from spectrum import SpectrumSimple
+from tmm.get_spectrum_indexed import get_spectrum_indexed
+from tmm.get_jacobi_indexed import get_jacobi_indexed
+from tmm.get_spectrum_averaged import get_spectrum_averaged, \
+    get_jacobi_averaged, gauss_legendre
+from optimizer.grad_helper import stack_f, stack_J, stack_init_params
+
+
+wls = np.linspace(500, 1000, 4)
+
+
+class TestAveraged(unittest.TestCase):
+
+    def setUp(self):
+        materials = np.array(['SiO2', 'TiO2', 'MgF2_xc', 'TiO2'])
+        self.f = film.MultiMaterialFilm(
+            materials, 'BK7', np.array([120., 60., 90., 200.]))
+        self.wl_offsets, self.wl_weights = gauss_legendre(5., 3)
+        self.ang_offsets = np.array([-3., 0., 4.])
+        self.ang_weights = np.array([1., 2., 1.])
+        self.inc_ang = 30.
+
+    def expected(self, engine, shape):
+        '''weighted average of the indexed engine at every node'''
+        res = np.zeros(shape)
+        weights = np.outer(self.wl_weights, self.ang_weights)
+        weights /= weights.sum()
+        for q, wl_offset in enumerate(self.wl_offsets):
+            wls_q = wls + wl_offset
+            for k, ang_offset in enumerate(self.ang_offsets):
+                out = np.empty(shape)
+                engine(
+                    out, wls_q, self.f.get_d(), self.f.calculate_n_table(wls_q),
+                    self.f.get_material_idx(), self.f.calculate_n_sub(wls_q),
+                    self.f.calculate_n_inc(wls_q), self.inc_ang + ang_offset
+                )
+                res += weights[q, k] * out
+        return res
+
+    def averaged(self, engine, shape):
+        out = np.empty(shape)
+        n_table, n_sub, n_inc = self.f.calculate_node_n_tables(
+            wls, self.wl_offsets)
+        engine(
+            out, wls, self.f.get_d(), n_table, self.f.get_material_idx(),
+            n_sub, n_inc, self.inc_ang, self.wl_offsets, self.wl_weights,
+            self.ang_offsets, self.ang_weights
+        )
+        return out
+
+    def test_gauss_legendre(self):
+        offsets, weights = gauss_legendre(2., 4)
+        self.assertAlmostEqual(weights.sum(), 1.)
+        # exact for polynomials of degree <= 7: mean of x^6 on [-2, 2]
+        self.assertAlmostEqual(np.sum(weights * offsets ** 6), 2 ** 6 / 7)
+
+    def test_spectrum(self):
+        shape = (wls.shape[0] * 2,)
+        np.testing.assert_almost_equal(
+            self.averaged(get_spectrum_averaged, shape),
+            self.expected(get_spectrum_indexed, shape)
+        )
+
+        # default: no averaging
+        spec = np.empty(shape)
+        get_spectrum_indexed(
+            spec, wls, self.f.get_d(), self.f.calculate_n_table(wls),
+            self.f.get_material_idx(), self.f.calculate_n_sub(wls),
+            self.f.calculate_n_inc(wls), self.inc_ang
+        )
+        s = SpectrumSimple(self.inc_ang, wls, self.f)
+        s.calculate_averaged()
+        np.testing.assert_almost_equal(s.get_R(), spec[:wls.shape[0]])
+
+    def test_jacobi(self):
+        shape = (wls.shape[0] * 2, self.f.get_layer_number())
+        np.testing.assert_almost_equal(
+            self.averaged(get_jacobi_averaged, shape),
+            self.expected(get_jacobi_indexed, shape)
+        )
+
+    def test_stack(self):
+        target = [SpectrumSimple(self.inc_ang, wls, self.f)]
+        target[0].calculate()
+        quadrature = dict(
+            wl_offsets=self.wl_offsets,
+            wl_weights=self.wl_weights,
+            ang_offsets=self.ang_offsets,
+            ang_weights=self.ang_weights
+        )
+        n_arrs_ls = stack_init_params(
+            self.f, target, indexed=True, wl_offsets=self.wl_offsets)
+
+        f = np.empty(wls.shape[0] * 2)
+        stack_f(
+            f, n_arrs_ls, self.f.get_d(), target,
+            get_f=functools.partial(get_spectrum_averaged, **quadrature),
+            material_idx=self.f.get_material_idx()
+        )
+        spec = self.expected(get_spectrum_indexed, (wls.shape[0] * 2,))
+        np.testing.assert_almost_equal(
+            f, spec - np.append(target[0].get_R(), target[0].get_T()))
+
+        J = np.empty((wls.shape[0] * 2, self.f.get_layer_number()))
+        stack_J(
+            J, n_arrs_ls, self.f.get_d(), target,
+            get_J=functools.partial(get_jacobi_averaged, **quadrature),
+            material_idx=self.f.get_material_idx()
+        )
+        np.testing.assert_almost_equal(
+            J, self.expected(get_jacobi_indexed, J.shape))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("./designer/script")
+sys.path.append("./")
+import film as film
+from utils import get_n
+import utils.dispersion as dispersion
+from utils.dispersion import DispersionCache
+
+
+wls = np.linspace(500, 1000, 101)
+
+
+class TestDispersion(unittest.TestCase):
+
+    def setUp(self):
+        self.old_cache = dispersion.get_cache()
+        dispersion.set_cache(DispersionCache())
+
+    def tearDown(self):
+        dispersion.set_cache(self.old_cache)
+
+    def test_values(self):
+        n = dispersion.calculate_n('SiO2', wls)
+        for i in [0, 47, 100]:
+            self.assertAlmostEqual(n[i], get_n.get_n_SiO2(wls[i]))
+        np.testing.assert_equal(dispersion.calculate_n('Air', wls), 1.)
+        np.testing.assert_equal(dispersion.calculate_n(1.7, wls), 1.7)
+        self.assertRaises(ValueError, dispersion.calculate_n, 'nothing', wls)
+
+    def test_shared_and_read_only(self):
+        n = dispersion.calculate_n('TiO2', wls)
+        self.assertFalse(n.flags.writeable)
+        # an equal grid in another array hits the cache
+        self.assertIs(dispersion.calculate_n('TiO2', wls.copy()), n)
+        self.assertIsNot(dispersion.calculate_n('TiO2', wls[:-1]), n)
+        self.assertIsNot(dispersion.calculate_n('SiO2', wls), n)
+
+        f1 = film.TwoMaterialFilm('TiO2', 'SiO2', 'BK7', np.array([10., 20.]))
+        f2 = film.TwoMaterialFilm('SiO2', 'TiO2', 'BK7', np.array([30.]))
+        self.assertIs(f1.calculate_n_sub(wls), f2.calculate_n_sub(wls))
+        self.assertIs(
+            f1.add_spec_param(0., wls).n_inc, f2.add_spec_param(0., wls).n_inc)
+        np.testing.assert_equal(
+            f1.calculate_n_array(wls)[:, 0], f2.calculate_n_table(wls)[:, 1])
+
+    def test_lru_eviction(self):
+        cache = DispersionCache(max_bytes=2 * wls.nbytes * 2)  # 2 complex arrays
+        dispersion.set_cache(cache)
+        a = dispersion.calculate_n('SiO2', wls)
+        dispersion.calculate_n('TiO2', wls)
+        dispersion.calculate_n('SiO2', wls)  # most recently used
+        dispersion.calculate_n('BK7', wls)  # evicts TiO2
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+        self.assertIs(dispersion.calculate_n('SiO2', wls), a)
+        misses = cache.misses
+        dispersion.calculate_n('TiO2', wls)
+        self.assertEqual(cache.misses, misses + 1)
+
+        # disabled
+        cache = DispersionCache(max_bytes=0)
+        dispersion.set_cache(cache)
+        dispersion.calculate_n('SiO2', wls)
+        self.assertEqual(len(cache), 0)
+
+    def test_films(self):
+        f = film.MultiMaterialFilm(
+            np.array(['TiO2', 'SiO2', 'BK7', 'SiO2']), 'BK7',
+            np.array([50., 80., 120., 30.]))
+        n_arr = f.calculate_n_array(wls)
+        for i, m in enumerate(['TiO2', 'SiO2', 'BK7', 'SiO2']):
+            np.testing.assert_almost_equal(
+                n_arr[:, i], getattr(get_n, f'get_n_{m}')(wls))
+
+        f = film.FreeFormFilm(np.array([2., 1.5, 2.2]), 400., 'BK7')
+        np.testing.assert_equal(
+            f.calculate_n_array(wls), np.tile([2., 1.5, 2.2], (101, 1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
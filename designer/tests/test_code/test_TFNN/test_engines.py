@@ -0,0 +1,50 @@
+import unittest
+import subprocess
+import numpy as np
+import sys
+sys.path.append("./designer/script")
+sys.path.append("./")
+import film as film
+import tmm.engines as engines
+
+
+class TestEngines(unittest.TestCase):
+
+    def test_import_film_does_not_import_cuda(self):
+        code = (
+            "import sys\n"
+            "sys.path.append('./designer/script')\n"
+            "sys.path.append('./')\n"
+            "import film, spectrum, design, utils.loss\n"
+            "assert 'numba.cuda' not in sys.modules, 'numba.cuda imported'\n"
+        )
+        res = subprocess.run([sys.executable, '-c', code],
+                             capture_output=True, text=True)
+        self.assertEqual(res.returncode, 0, res.stderr)
+
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, lambda: engines.get_engine('nope'))
+
+    def test_lazy_engine_forwards(self):
+        wls = np.linspace(500, 1000, 5)
+        f = film.TwoMaterialFilm('SiO2', 'TiO2', 'SiO2', np.array([10., 20.]))
+        args = (wls, f.get_d(), f.calculate_n_array(wls),
+                f.calculate_n_sub(wls), f.calculate_n_inc(wls), 30.)
+
+        spec_lazy = np.empty(wls.shape[0] * 2)
+        engines.lazy('spectrum_simple')(spec_lazy, *args)
+        spec = np.empty(wls.shape[0] * 2)
+        engines.get_engine('spectrum_simple')(spec, *args)
+        np.testing.assert_almost_equal(spec_lazy, spec)
+
+    def test_warmup(self):
+        self.assertListEqual(
+            engines.warmup(film.TwoMaterialFilm),
+            ['spectrum_indexed', 'jacobi_indexed']
+        )
+        self.assertListEqual(
+            engines.warmup(engines=['spectrum_free']), ['spectrum_free'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("./designer/script")
+sys.path.append("./")
+import film as film
+import tmm.get_spectrum as get_spectrum
+from tmm.incoherent import coherent_rt, get_spectrum_incoherent
+from spectrum import Spectrum
+from optimizer.adam import AdamThicknessOptimizer
+from optimizer.LM_optimizer import LMOptimizer
+from optimizer.batched_adam import BatchedAdamOptimizer
+
+
+wls = np.linspace(500, 1000, 7)
+
+
+class TestIncoherent(unittest.TestCase):
+
+    def setUp(self):
+        self.f = film.TwoMaterialFilm(
+            'TiO2', 'SiO2', 'BK7', np.array([50., 80., 120., 30., 60.]))
+        self.n_sub = self.f.calculate_n_sub(wls)
+        self.n_inc = self.f.calculate_n_inc(wls)
+        self.n_air = np.ones(wls.shape[0], dtype='complex128')
+
+    def test_coherent_rt(self):
+        inc_ang = 40.
+        R, T = coherent_rt(
+            wls,
+            self.f.get_d(),
+            self.f.calculate_n_array(wls),
+            self.n_inc,
+            self.n_sub,
+            self.n_inc * np.sin(inc_ang / 180 * np.pi)
+        )
+        for pol, (s_ratio, p_ratio) in enumerate([(1, 0), (0, 1)]):
+            expected = np.empty(wls.shape[0] * 2)
+            get_spectrum.get_spectrum_free(
+                expected, wls, self.f.get_d(), self.f.calculate_n_array(wls),
+                self.n_sub, self.n_inc, inc_ang, s_ratio, p_ratio)
+            np.testing.assert_almost_equal(R[pol], expected[:wls.shape[0]])
+            np.testing.assert_almost_equal(T[pol], expected[wls.shape[0]:])
+
+    def test_bare_slab(self):
+        n_sub = np.full(wls.shape[0], 1.5, dtype='complex128')
+        R0 = 0.04
+        spec = np.empty(wls.shape[0] * 2)
+        get_spectrum_incoherent(
+            spec, wls, np.array([]), np.empty((wls.shape[0], 0)),
+            n_sub, self.n_air, 0., 1e6, self.n_air)
+        np.testing.assert_almost_equal(spec[:wls.shape[0]], 2 * R0 / (1 + R0))
+        np.testing.assert_almost_equal(
+            spec[wls.shape[0]:], (1 - R0) / (1 + R0))
+
+        # absorbing slab
+        n_sub = n_sub + 1e-5j
+        thickness = 1e6
+        get_spectrum_incoherent(
+            spec, wls, np.array([]), np.empty((wls.shape[0], 0)),
+            n_sub, self.n_air, 0., thickness, self.n_air)
+        A = np.exp(-4 * np.pi * 1e-5 * thickness / wls)
+        R0 = np.abs((1 - n_sub) / (1 + n_sub)) ** 2
+        np.testing.assert_almost_equal(
+            spec[wls.shape[0]:], (1 - R0) ** 2 * A / (1 - R0 ** 2 * A ** 2))
+        np.testing.assert_almost_equal(
+            spec[:wls.shape[0]], R0 + (1 - R0) ** 2 * R0 * A ** 2 /
+            (1 - R0 ** 2 * A ** 2))
+
+    def test_energy_conservation(self):
+        back_d = np.array([100., 140.])
+        n_back = np.tile([2.1, 1.38], (wls.shape[0], 1)).astype('complex128')
+        spec = np.empty(wls.shape[0] * 2)
+        for s_ratio, p_ratio in [(1, 0), (0, 1)]:
+            get_spectrum_incoherent(
+                spec, wls, self.f.get_d(), self.f.calculate_n_array(wls),
+                self.n_sub, self.n_inc, 45., 1e6, self.n_air, back_d, n_back,
+                s_ratio=s_ratio, p_ratio=p_ratio)
+            np.testing.assert_almost_equal(
+                spec[:wls.shape[0]] + spec[wls.shape[0]:], 1)
+
+    def test_film(self):
+        s = self.f.add_spec_param(0., wls)
+        s.calculate()
+        R_coherent = s.get_R().copy()
+
+        # index matched exit medium: no back side reflection
+        self.f.set_incoherent_substrate(1e6, exit_medium='BK7')
+        self.assertFalse(s.is_updated())
+        self.f.calculate_spectrum()
+        np.testing.assert_almost_equal(s.get_R(), R_coherent)
+
+        # glass / air back side reflects
+        self.f.set_incoherent_substrate(1e6)
+        self.f.calculate_spectrum()
+        self.assertTrue(np.all(s.get_R() > R_coherent))
+
+        # AR coated back side reflects less
+        R_bare_back = s.get_R().copy()
+        self.f.set_incoherent_substrate(
+            1e6, back_d=np.array([100.]), back_materials=[1.23])
+        self.f.calculate_spectrum()
+        self.assertTrue(np.all(s.get_R() < R_bare_back))
+        # lists are accepted as well
+        R_coated = s.get_R().copy()
+        self.f.set_incoherent_substrate(1e6, 1., [100.], [1.23])
+        self.f.calculate_spectrum()
+        np.testing.assert_almost_equal(s.get_R(), R_coated)
+
+        self.f.remove_incoherent_substrate()
+        self.f.calculate_spectrum()
+        np.testing.assert_almost_equal(s.get_R(), R_coherent)
+
+    def test_not_optimized(self):
+        s = self.f.add_spec_param(0., wls)
+        s.calculate()
+        target = [Spectrum(0., wls, s.get_R().copy(), s.get_T().copy())]
+        self.f.set_incoherent_substrate(1e6)
+        for make in [
+            lambda: AdamThicknessOptimizer(self.f, target, 10),
+            lambda: LMOptimizer(self.f, target, 10),
+            lambda: BatchedAdamOptimizer([self.f], target, 10),
+        ]:
+            self.assertRaises(AssertionError, make)
+
+
+if __name__ == "__main__":
+    unittest.main()
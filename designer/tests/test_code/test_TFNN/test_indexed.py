@@ -0,0 +1,135 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("./designer/script")
+sys.path.append("./")
+import film as film
+from spectrum import SpectrumSimple
+import tmm.get_spectrum as get_spectrum
+import tmm.get_jacobi_adjoint as get_jacobi_adjoint
+from tmm.get_spectrum_indexed import get_spectrum_indexed
+from tmm.get_jacobi_indexed import get_jacobi_indexed
+from optimizer.grad_helper import stack_f, stack_J, stack_init_params
+
+
+wls = np.linspace(500, 1000, 5)
+
+
+def dense_args(f, wls):
+    return (wls, f.get_d(), f.calculate_n_array(wls),
+            f.calculate_n_sub(wls), f.calculate_n_inc(wls))
+
+
+def indexed_args(f, wls):
+    return (wls, f.get_d(), f.calculate_n_table(wls), f.get_material_idx(),
+            f.calculate_n_sub(wls), f.calculate_n_inc(wls))
+
+
+class TestIndexed(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        materials = np.array(['SiO2', 'TiO2', 'MgF2_xc', 'TiO2', 'SiO2'] * 3)
+        self.multi = film.MultiMaterialFilm(
+            materials, 'BK7', np.random.uniform(20, 200, materials.shape[0]))
+        self.two = film.TwoMaterialFilm(
+            'SiO2', 'TiO2', 'BK7', np.random.uniform(20, 200, 11))
+
+    def test_material_table(self):
+        self.assertEqual(self.multi.calculate_n_table(wls).shape, (5, 3))
+        np.testing.assert_array_equal(
+            self.multi.get_material_idx()[:5], [0, 1, 2, 1, 0])
+        self.assertEqual(self.multi.get_material_idx().dtype, np.uint8)
+        np.testing.assert_array_equal(
+            self.multi.calculate_n_table(wls)[:, self.multi.get_material_idx()],
+            self.multi.calculate_n_array(wls)
+        )
+        np.testing.assert_array_equal(
+            self.two.calculate_n_table(wls)[:, self.two.get_material_idx()],
+            self.two.calculate_n_array(wls)
+        )
+
+    def test_spectrum(self):
+        for inc_ang in [0., 50.]:
+            expected = np.empty(wls.shape[0] * 2)
+            get_spectrum.get_spectrum_free(
+                expected, *dense_args(self.multi, wls), inc_ang)
+            spec = np.empty(wls.shape[0] * 2)
+            get_spectrum_indexed(spec, *indexed_args(self.multi, wls), inc_ang)
+            np.testing.assert_almost_equal(spec, expected)
+
+        # calculate() of films made of a few materials uses the indexed engine
+        s = SpectrumSimple(50., wls, self.multi)
+        s.calculate()
+        np.testing.assert_almost_equal(s.get_R(), expected[:wls.shape[0]])
+
+    def test_jacobi_two_material(self):
+        for inc_ang in [0., 50.]:
+            expected = np.empty((wls.shape[0] * 2, self.two.get_layer_number()))
+            get_jacobi_adjoint.get_jacobi_simple(
+                expected, *dense_args(self.two, wls), inc_ang)
+            J = np.empty_like(expected)
+            get_jacobi_indexed(J, *indexed_args(self.two, wls), inc_ang)
+            np.testing.assert_almost_equal(J, expected)
+
+    def test_jacobi_finite_difference(self):
+        inc_ang = 30.
+        f = self.multi
+        J = np.empty((wls.shape[0] * 2, f.get_layer_number()))
+        get_jacobi_indexed(J, *indexed_args(f, wls), inc_ang)
+
+        h = 1e-4
+        d = f.get_d().copy()
+        for i in [0, 4, 7, f.get_layer_number() - 1]:
+            spec = []
+            for sign in [1, -1]:
+                d_h = d.copy()
+                d_h[i] += sign * h
+                s = np.empty(wls.shape[0] * 2)
+                get_spectrum_indexed(
+                    s, wls, d_h, f.calculate_n_table(wls),
+                    f.get_material_idx(), f.calculate_n_sub(wls),
+                    f.calculate_n_inc(wls), inc_ang
+                )
+                spec.append(s)
+            # same convention as get_jacobi_adjoint: half the derivative
+            np.testing.assert_almost_equal(
+                J[:, i], (spec[0] - spec[1]) / (2 * h) / 2, decimal=6)
+
+    def test_stack(self):
+        target = [SpectrumSimple(0., wls, self.two)]
+        target[0].calculate()
+        self.two.update_d(self.two.get_d() * 1.1)
+
+        f_dense = np.empty(wls.shape[0] * 2)
+        stack_f(f_dense, stack_init_params(self.two, target),
+                self.two.get_d(), target)
+        f_indexed = np.empty(wls.shape[0] * 2)
+        stack_f(
+            f_indexed,
+            stack_init_params(self.two, target, indexed=True),
+            self.two.get_d(),
+            target,
+            get_f=get_spectrum_indexed,
+            material_idx=self.two.get_material_idx()
+        )
+        np.testing.assert_almost_equal(f_indexed, f_dense)
+
+        J_dense = np.empty((wls.shape[0] * 2, self.two.get_layer_number()))
+        stack_J(J_dense, stack_init_params(self.two, target),
+                self.two.get_d(), target,
+                get_J=get_jacobi_adjoint.get_jacobi_simple)
+        J_indexed = np.empty_like(J_dense)
+        stack_J(
+            J_indexed,
+            stack_init_params(self.two, target, indexed=True),
+            self.two.get_d(),
+            target,
+            get_J=get_jacobi_indexed,
+            material_idx=self.two.get_material_idx()
+        )
+        np.testing.assert_almost_equal(J_indexed, J_dense)
+
+
+if __name__ == "__main__":
+    unittest.main()
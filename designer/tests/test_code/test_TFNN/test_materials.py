@@ -0,0 +1,160 @@
+import unittest
+import os
+import pickle
+import tempfile
+import numpy as np
+import sys
+sys.path.append("./designer/script")
+sys.path.append("./")
+import film as film
+from utils import get_n
+from utils.materials import (
+    MaterialRegistry, ConstantMaterial, CauchyMaterial, SellmeierMaterial,
+    TabulatedMaterial, CallableMaterial, get_material, registry
+)
+import designer.material_data.exp_eq as exp_eq
+import utils.materials as materials
+
+
+wls = np.linspace(500, 1000, 51)
+
+
+class TestMaterials(unittest.TestCase):
+
+    def test_builtin_match_get_n(self):
+        for name in ['SiO2', 'BK7', 'TiO2', 'Ta2O5_xc', 'SiO2_xc', 'MgF2_xc',
+                     'Air', '1_5']:
+            m = get_material(name)
+            np.testing.assert_almost_equal(
+                m(wls), getattr(get_n, f'get_n_{name}')(wls) * np.ones(51))
+            # scalar in, scalar out
+            self.assertAlmostEqual(m(700.), getattr(get_n, f'get_n_{name}')(700.))
+
+    def test_models(self):
+        m = CauchyMaterial((1.5, 4e-3))
+        np.testing.assert_almost_equal(m(wls), 1.5 + 4e-3 / (wls * 1e-3) ** 2)
+        m = SellmeierMaterial(B=(1.,), C=(0.01,), A=1.)
+        np.testing.assert_almost_equal(
+            m(wls), np.sqrt(1 + (wls * 1e-3) ** 2 / ((wls * 1e-3) ** 2 - 0.01)))
+        m = TabulatedMaterial([400., 600., 1100.], [2., 1.8 - 0.1j, 1.6])
+        self.assertAlmostEqual(m(500.), 1.9 - 0.05j)
+        self.assertAlmostEqual(m(1100.), 1.6)
+        self.assertRaises(ValueError, m, np.array([300., 500.]))
+
+    def test_hash_eq(self):
+        self.assertEqual(get_material('SiO2'), SellmeierMaterial(
+            B=(1.07044083, 1.10202242), C=(0.0100585997, 100.), A=1.28604141))
+        self.assertEqual(get_material(1.), get_material('Air'))
+        self.assertNotEqual(get_material('SiO2'), get_material('SiO2_xc'))
+        self.assertEqual(
+            TabulatedMaterial([1., 2.], [1., 2.]),
+            TabulatedMaterial(np.array([1., 2.]), [1., 2.])
+        )
+        self.assertEqual(
+            CallableMaterial(exp_eq.get_n_TiO2_Sellmeier), get_material('TiO2'))
+        self.assertEqual(len({get_material('SiO2'), get_material('SiO2'),
+                              get_material(1.5), get_material('1_5')}), 2)
+
+    def test_closures(self):
+        # closures share their qualname but are different materials
+        def constant(n):
+            return lambda wl: np.full(np.shape(wl), n, dtype='complex128')
+        a, b = CallableMaterial(constant(1.5)), CallableMaterial(constant(2.))
+        self.assertNotEqual(a, b)
+        self.assertEqual(len({a, b, CallableMaterial(a.func)}), 2)
+
+        from utils.dispersion import DispersionCache
+        cache = DispersionCache()
+        wls = np.array([500., 600.])
+        np.testing.assert_array_equal(cache.get(a, wls), 1.5)
+        np.testing.assert_array_equal(cache.get(b, wls), 2.)
+
+    def test_pickle(self):
+        for m in ['SiO2', 'TiO2', 'Si', 2.1,
+                  TabulatedMaterial([1., 2.], [1., 2. - 1j])]:
+            m = get_material(m)
+            self.assertEqual(pickle.loads(pickle.dumps(m)), m)
+
+        f = film.TwoMaterialFilm('TiO2', 1.46, 'BK7', np.array([10., 20.]))
+        f.add_spec_param(0., wls)
+        g = pickle.loads(pickle.dumps(f))
+        np.testing.assert_almost_equal(
+            g.calculate_n_array(wls), f.calculate_n_array(wls))
+        self.assertEqual(g.materials, f.materials)
+
+    def test_registry(self):
+        reg = MaterialRegistry()
+        m = CauchyMaterial((1.7, 1e-2))
+        reg.register('H', m)
+        self.assertIs(reg.get('H'), m)
+        self.assertEqual(str(m), 'H')
+        self.assertRaises(ValueError, reg.register, 'H', m)
+        self.assertRaises(TypeError, reg.register, 'L', 1.46)
+        # names defined in utils.get_n only
+        self.assertEqual(reg.get('SiO2')(700.), get_n.get_n_SiO2(700.))
+        self.assertRaises(ValueError, reg.get, 'nothing')
+        self.assertIn('SiO2', registry)
+
+    def test_films(self):
+        m = CauchyMaterial((1.7, 1e-2))
+        f = film.MultiMaterialFilm(
+            np.array([m, 'SiO2', CauchyMaterial((1.7, 1e-2)), 'SiO2']), 'BK7',
+            np.array([50., 80., 120., 30.]))
+        # equal materials share a column
+        self.assertEqual(f.calculate_n_table(wls).shape, (51, 2))
+        np.testing.assert_equal(f.get_material_idx(), [0, 1, 0, 1])
+        np.testing.assert_almost_equal(f.calculate_n_array(wls)[:, 2], m(wls))
+        self.assertRaises(
+            ValueError, film.TwoMaterialFilm, 'nothing', 'SiO2', 'BK7',
+            np.array([1.]))
+
+
+class TestTabulatedCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.old_env = os.environ.get('TFD_MATERIAL_CACHE')
+        os.environ['TFD_MATERIAL_CACHE'] = self.dir.name
+        self.old_tabulated = dict(materials._tabulated)
+        materials._tabulated.clear()
+        self.old_load = get_n.load_from_file
+
+    def tearDown(self):
+        get_n.load_from_file = self.old_load
+        materials._tabulated.clear()
+        materials._tabulated.update(self.old_tabulated)
+        if self.old_env is None:
+            del os.environ['TFD_MATERIAL_CACHE']
+        else:
+            os.environ['TFD_MATERIAL_CACHE'] = self.old_env
+        self.dir.cleanup()
+
+    def load_Si(self):
+        return materials.load_tabulated(
+            'Si_n_Green-2008.csv', 'Si_k_Green-2008.csv', name='Si')
+
+    def test_compiled_once(self):
+        m = self.load_Si()
+        self.assertEqual(len(os.listdir(self.dir.name)), 1)
+        self.assertIsInstance(m.n.base, np.memmap)
+        self.assertAlmostEqual(m(500.), 4.294 - 1j * 0.044165)
+        # kept per process
+        self.assertIs(self.load_Si(), m)
+        self.assertIs(pickle.loads(pickle.dumps(m)), m)
+
+        # a new process memory-maps the binary cache, no csv parsing
+        materials._tabulated.clear()
+
+        def fail(*args):
+            raise AssertionError('csv parsed again')
+        get_n.load_from_file = fail
+        self.assertEqual(self.load_Si(), m)
+        np.testing.assert_equal(get_n.get_n_Si(wls), m(wls))
+
+    def test_out_of_range(self):
+        self.assertRaises(ValueError, get_n.get_n_Si, 200.)
+        self.assertRaises(ValueError, get_n.get_n_Si, np.array([500., 1600.]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("./designer/script")
+sys.path.append("./")
+import film as film
+
+
+wls = np.linspace(500, 1000, 11)
+inc_ang = 30.
+
+
+def fresh_R(f):
+    '''R of an identical film that never had a spectrum'''
+    g = film.TwoMaterialFilm(
+        f.materials['A'], f.materials['B'], f.materials['sub'], f.get_d())
+    if f.has_incoherent_substrate():
+        g.set_incoherent_substrate(f.sub_thickness)
+    return g.add_spec_param(inc_ang, wls).get_R().copy()
+
+
+class TestSpectrumCache(unittest.TestCase):
+
+    def setUp(self):
+        self.f = film.TwoMaterialFilm(
+            'TiO2', 'SiO2', 'BK7', np.array([50., 80., 120., 30., 60.]))
+        self.s = self.f.add_spec_param(inc_ang, wls)
+
+    def test_cached(self):
+        R = self.s.get_R()
+        T = self.s.get_T()
+        self.assertTrue(self.s.is_updated())
+        # no recalculation: the very same arrays are returned
+        self.assertIs(self.s.get_R(), R)
+        self.assertIs(self.s.get_T(), T)
+        np.testing.assert_almost_equal(R, fresh_R(self.f))
+
+    def test_read_only(self):
+        R = self.s.get_R()
+        with self.assertRaises(ValueError):
+            R[0] = 0.
+        with self.assertRaises(ValueError):
+            self.f.get_d()[0] = 1.
+        with self.assertRaises(ValueError):
+            self.f.get_d()[:] *= 2
+
+    def test_update_d(self):
+        R_old = self.s.get_R()
+        R_old_copy = R_old.copy()
+        d = self.f.get_d().copy()
+        d[1] += 40.
+        self.f.update_d(d)
+        self.assertFalse(self.s.is_updated())
+        R_new = self.s.get_R()
+        np.testing.assert_almost_equal(R_new, fresh_R(self.f))
+        # arrays handed out before are not overwritten
+        np.testing.assert_equal(R_old, R_old_copy)
+        self.assertGreater(np.max(np.abs(R_new - R_old)), 1e-3)
+
+        # modifying the array passed to update_d afterwards does not reach
+        # the film
+        d[1] += 40.
+        self.assertIs(self.s.get_R(), R_new)
+        np.testing.assert_almost_equal(R_new, fresh_R(self.f))
+
+    def test_layer_number_changes(self):
+        self.s.get_R()
+        self.f.insert_layer(2, 60., 10.)
+        self.assertFalse(self.s.is_updated())
+        np.testing.assert_almost_equal(self.s.get_R(), fresh_R(self.f))
+
+        d = self.f.get_d().copy()
+        d[3] = -1.
+        self.f.update_d(d)
+        self.s.get_R()
+        self.f.remove_negative_thickness_layer()
+        self.assertEqual(self.f.get_layer_number(), 5)
+        self.assertFalse(self.s.is_updated())
+        np.testing.assert_almost_equal(self.s.get_R(), fresh_R(self.f))
+
+    def test_materials(self):
+        self.s.get_R()
+        self.f.set_incoherent_substrate(1e6)
+        self.assertFalse(self.s.is_updated())
+        np.testing.assert_almost_equal(self.s.get_R(), fresh_R(self.f))
+
+        self.f.remove_incoherent_substrate()
+        self.f._register_get_n('sub', 'SiO2')
+        self.assertFalse(self.s.is_updated())
+        np.testing.assert_almost_equal(
+            self.s.n_sub, self.f.calculate_n_sub(wls))
+        np.testing.assert_almost_equal(self.s.get_R(), fresh_R(self.f))
+
+    def test_engine_arguments(self):
+        R = self.s.get_R().copy()
+        R_s = self.s.get_R(s_ratio=1, p_ratio=0).copy()
+        self.assertGreater(np.max(np.abs(R_s - R)), 1e-3)
+        # not the default spectrum: not served from the cache
+        self.assertFalse(self.s.is_updated())
+        np.testing.assert_almost_equal(self.s.get_R(), R)
+
+    def test_free_form(self):
+        f = film.FreeFormFilm(np.array([2., 1.5, 2., 1.5]), 400., 'BK7')
+        s = f.add_spec_param(inc_ang, wls)
+        R = s.get_R()
+        with self.assertRaises(ValueError):
+            f.get_n()[0] = 1.
+        n = f.get_n().copy()
+        n[0] = 2.3
+        f.update_n(n)
+        self.assertFalse(s.is_updated())
+        self.assertGreater(np.max(np.abs(s.get_R() - R)), 1e-3)
+
+    def test_multi_material_remove_layer(self):
+        f = film.MultiMaterialFilm(
+            np.array(['TiO2', 'SiO2', 'TiO2', 'SiO2']), 'BK7',
+            np.array([50., 80., 120., 30.]))
+        s = f.add_spec_param(inc_ang, wls)
+        s.get_R()
+        f.remove_layer([2, 3])
+        self.assertFalse(s.is_updated())
+        np.testing.assert_almost_equal(s.get_R(), fresh_R(
+            film.TwoMaterialFilm('TiO2', 'SiO2', 'BK7', np.array([50., 80.]))))
+
+
+class TestSpectrumIndex(unittest.TestCase):
+
+    def test_lookup(self):
+        f = film.TwoMaterialFilm('TiO2', 'SiO2', 'BK7', np.array([50., 80.]))
+        s0 = f.add_spec_param(0., wls)
+        s30 = f.add_spec_param(inc_ang, wls.copy())
+        s_other = f.add_spec_param(0., wls[:-1])
+        self.assertEqual(len(f.spectra), 3)
+        # equal grids in other arrays and int angles find the same spectra
+        self.assertIs(f.add_spec_param(0, wls.copy()), s0)
+        self.assertIs(f.get_spec(inc_ang, wls.copy()), s30)
+        self.assertIs(f.get_spec(0., wls[:-1].copy()), s_other)
+        self.assertEqual(len(f.spectra), 3)
+        # equal grids are shared
+        self.assertIs(s30.WLS, s0.WLS)
+        self.assertIs(s30.n_sub, s0.n_sub)
+        s = f.add_spec_param(60., wls.copy(), share_wls=False)
+        self.assertIsNot(s.WLS, s0.WLS)
+
+    def test_remove(self):
+        f = film.TwoMaterialFilm('TiO2', 'SiO2', 'BK7', np.array([50., 80.]))
+        for ang in [0., 30., 60.]:
+            f.add_spec_param(ang, wls)
+        f.add_spec_param(0., wls[:-1])
+        self.assertEqual(f.remove_spec_param(inc_ang=0.), 2)
+        self.assertEqual(f.remove_spec_param(30., wls), 1)
+        self.assertEqual(f.remove_spec_param(30., wls), 0)
+        self.assertEqual([s.INC_ANG for s in f.spectra], [60.])
+        s = f.get_spec(0., wls)
+        self.assertEqual(len(f.spectra), 2)
+        self.assertIs(f.get_spec(0., wls), s)
+
+        # the list may still be modified directly
+        f.spectra = [s]
+        self.assertIs(f.get_spec(0., wls), s)
+        self.assertEqual(len(f.get_all_spec_list()), 1)
+        f.remove_all_spec_param()
+        self.assertIsNot(f.add_spec_param(0., wls), s)
+
+
+if __name__ == "__main__":
+    unittest.main()
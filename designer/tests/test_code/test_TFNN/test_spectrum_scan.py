@@ -0,0 +1,56 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("./designer/script")
+sys.path.append("./")
+import film as film
+import tmm.get_spectrum as get_spectrum
+import tmm.get_spectrum_scan as get_spectrum_scan
+
+
+class TestSpectrumScan(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.wls = np.linspace(500, 1000, 3)
+        layer_number = 37
+        n = np.random.uniform(1.3, 2.4, layer_number) + 0.01j
+        self.f = film.FreeFormFilm(n, 3000, 'SiO2')
+        self.f.update_d(np.random.uniform(5, 50, layer_number))
+
+    def calculate(self, func, inc_ang, **kwargs):
+        wls = self.wls
+        spec = np.empty(wls.shape[0] * 2)
+        func(spec, wls, self.f.get_d(), self.f.calculate_n_array(wls),
+             self.f.calculate_n_sub(wls), self.f.calculate_n_inc(wls),
+             inc_ang, **kwargs)
+        return spec
+
+    def test_same_as_serial(self):
+        for inc_ang in [0., 45.]:
+            expected = self.calculate(get_spectrum.get_spectrum_free, inc_ang)
+            # odd number of blocks at some level, one layer per block and
+            # a single block
+            for block_len in [4, 1, 100, None]:
+                spec = self.calculate(
+                    get_spectrum_scan.get_spectrum_free_scan,
+                    inc_ang,
+                    block_len=block_len
+                )
+                np.testing.assert_almost_equal(spec, expected)
+
+    def test_polarization(self):
+        expected = self.calculate(
+            get_spectrum.get_spectrum_free, 60., s_ratio=1, p_ratio=0)
+        spec = self.calculate(
+            get_spectrum_scan.get_spectrum_free_scan,
+            60.,
+            s_ratio=1,
+            p_ratio=0,
+            block_len=3
+        )
+        np.testing.assert_almost_equal(spec, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
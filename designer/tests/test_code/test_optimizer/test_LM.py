@@ -0,0 +1,73 @@
+import sys
+sys.path.append('./designer/script/')
+sys.path.append('./')
+sys.path.append('./designer/tests/test_code/')
+
+from optimizer.LM_optimizer import LMOptimizer
+from film import TwoMaterialFilm, MultiMaterialFilm
+from film_targets import d_true, d_init, make_wls, make_target
+import numpy as np
+import unittest
+
+
+wls = make_wls(50)
+
+
+class TestLM(unittest.TestCase):
+
+    def setUp(self):
+        self.target = [make_target(
+            TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true), wls)]
+
+    def test_solvers(self):
+        for solver in LMOptimizer.SOLVERS:
+            for geodesic in [False, True]:
+                f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_init)
+                lm = LMOptimizer(
+                    f, self.target, 100, solver=solver, geodesic=geodesic,
+                    h_tol=1e-8)
+                films, losses = lm.optimize()
+                np.testing.assert_allclose(f.get_d(), d_true, atol=1e-6)
+                self.assertLess(lm._validate_loss(), 1e-10)
+                self.assertLess(lm.i, 50)
+                # not recorded by default
+                self.assertEqual(len(losses), 1)
+
+    def test_same_first_step(self):
+        steps = []
+        for solver in LMOptimizer.SOLVERS:
+            f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_init)
+            lm = LMOptimizer(f, self.target, 1, solver=solver, mu=10.)
+            lm._optimize_step()
+            steps.append(lm.h)
+        np.testing.assert_allclose(steps[1], steps[0], rtol=1e-6)
+        np.testing.assert_allclose(steps[2], steps[0], rtol=1e-6)
+
+    def test_rejected_steps_reuse_J(self):
+        # far from the optimum with little damping: some steps are rejected
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true * 1.5)
+        lm = LMOptimizer(f, self.target, 1, mu=1e-6)
+        calls = []
+        update_J = lm._update_J
+        lm._update_J = lambda: calls.append(1) or update_J()
+        accepted = []
+        for _ in range(10):
+            lm._optimize_step()
+            accepted.append(lm.accepted)
+        self.assertIn(False, accepted)
+        # J only after accepted steps
+        self.assertEqual(len(calls), 1 + sum(accepted[:-1]))
+
+    def test_record_and_multi_material(self):
+        f = MultiMaterialFilm(
+            np.array(['TiO2', 'SiO2'] * 3), 'BK7', d_init)
+        lm = LMOptimizer(f, self.target, 5, record=True)
+        films, losses = lm.optimize()
+        self.assertEqual(len(losses), lm.i + 2)
+        self.assertLess(min(losses), losses[0])
+        self.assertRaises(
+            AssertionError, LMOptimizer, f, self.target, 5, batch_size_wl=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import sys
+sys.path.append('./designer/script/')
+sys.path.append('./')
+sys.path.append('./designer/tests/test_code/')
+
+from optimizer.LM_matrix_free import steihaug_cg, \
+    MatrixFreeLMThicknessOptimizer, MatrixFreeLMFreeFormOptimizer
+from optimizer.grad_helper import JacobianOperator, stack_J, stack_init_params
+import tmm.engines as engines
+from spectrum import Spectrum
+from film import TwoMaterialFilm, FreeFormFilm
+from film_targets import d_true, d_init, make_wls, make_target
+import numpy as np
+import unittest
+
+
+wls = make_wls(50)
+
+
+class TestSteihaug(unittest.TestCase):
+
+    def test_quadratic(self):
+        rng = np.random.default_rng(0)
+        J = rng.normal(size=(30, 8))
+        B = J.T @ J
+        g = rng.normal(size=8)
+        D = rng.random(8) + 0.5
+        # large trust region: Newton step
+        p, predicted = steihaug_cg(lambda v: B @ v, g, D, 1e6, 1e-12, 100)
+        np.testing.assert_allclose(p, np.linalg.solve(B, -g), rtol=1e-6)
+        self.assertAlmostEqual(predicted, -(g @ p + 0.5 * p @ B @ p))
+        # small trust region: on the boundary, still descending
+        p, predicted = steihaug_cg(lambda v: B @ v, g, D, 1e-2, 1e-12, 100)
+        self.assertAlmostEqual(np.linalg.norm(D * p), 1e-2)
+        self.assertGreater(predicted, 0)
+
+
+class TestJacobianOperator(unittest.TestCase):
+
+    def test_products(self):
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_init)
+        target = [make_target(f, wls), Spectrum(30., wls, np.ones(50))]
+        n_arrs_ls = stack_init_params(f, target, indexed=True)
+        get_J = engines.get_engine('jacobi_indexed')
+        J = np.empty((200, 6))
+        stack_J(J, n_arrs_ls, f.get_d(), target, get_J=get_J,
+                material_idx=f.get_material_idx())
+        J *= 2
+        # several blocks per spectrum, the last one shorter
+        op = JacobianOperator(
+            n_arrs_ls, f.get_d(), target, get_J, 6,
+            material_idx=f.get_material_idx(), chunk_size=16)
+        rng = np.random.default_rng(0)
+        v, u = rng.normal(size=6), rng.normal(size=200)
+        np.testing.assert_allclose(op.matvec(v), J @ v)
+        np.testing.assert_allclose(op.rmatvec(u), J.T @ u)
+        np.testing.assert_allclose(op.normal_matvec(v), J.T @ J @ v)
+        g, sq = op.rmatvec_and_column_norms(u)
+        np.testing.assert_allclose(g, J.T @ u)
+        np.testing.assert_allclose(sq, (J ** 2).sum(axis=0))
+        # chunk size from the memory budget
+        op = JacobianOperator(
+            n_arrs_ls, f.get_d(), target, get_J, 6, max_chunk_bytes=16 * 6 * 10)
+        self.assertEqual(op.chunk_size, 10)
+
+
+class TestMatrixFreeLM(unittest.TestCase):
+
+    def test_thickness(self):
+        target = [make_target(TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true), wls)]
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_init)
+        lm = MatrixFreeLMThicknessOptimizer(
+            f, target, 100, h_tol=1e-8, chunk_size=20, record=True)
+        films, losses = lm.optimize()
+        np.testing.assert_allclose(f.get_d(), d_true, atol=1e-5)
+        self.assertLess(losses[-1], losses[0])
+
+    def test_free_form(self):
+        n_true = np.array([2., 1.5, 2.2, 1.6, 1.9])
+        t = FreeFormFilm(n_true, 500., 'BK7')
+        target = [make_target(t, wls)]
+        f = FreeFormFilm(n_true + np.array([.05, -.04, .03, .02, -.05]), 500., 'BK7')
+        lm = MatrixFreeLMFreeFormOptimizer(f, target, 100, h_tol=1e-10)
+        lm.optimize()
+        self.assertLess(lm._validate_loss(), 1e-6)
+
+        # thicknesses of free form films with the dense adjoint engines
+        f = FreeFormFilm(n_true, 500., 'BK7')
+        f.update_d(t.get_d() * 1.02)
+        lm = MatrixFreeLMThicknessOptimizer(f, target, 100, h_tol=1e-10)
+        lm.optimize()
+        np.testing.assert_allclose(f.get_d(), t.get_d(), atol=1e-4)
+
+
+if __name__ == '__main__':
+    unittest.main()
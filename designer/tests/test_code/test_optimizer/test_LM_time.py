@@ -0,0 +1,59 @@
+import sys
+sys.path.append('./designer/script/')
+sys.path.append('./')
+
+from optimizer.archive.LM_gradient_descent import LM_optimize_d_simple
+from optimizer.LM_optimizer import LMOptimizer
+from spectrum import Spectrum
+from film import TwoMaterialFilm
+import numpy as np
+import time
+
+
+def make_problem(layer_number, wl_number=1000, seed=0):
+    '''target of a random film and a perturbed initial film'''
+    rng = np.random.default_rng(seed)
+    wls = np.linspace(400, 1000, wl_number)
+    d_true = rng.random(layer_number) * 100. + 20.
+    target_film = TwoMaterialFilm('SiO2', 'TiO2', 'SiO2', d_true)
+    s = target_film.add_spec_param(0., wls)
+    target = [Spectrum(0., wls, s.get_R().copy(), s.get_T().copy())]
+    d_init = d_true + rng.normal(scale=3., size=layer_number)
+    return TwoMaterialFilm('SiO2', 'TiO2', 'SiO2', d_init), target
+
+
+def time_archive(layer_number, max_steps=1000):
+    film, target = make_problem(layer_number)
+    t1 = time.time()
+    steps = LM_optimize_d_simple(film, target, 1e-5, max_steps)
+    t2 = time.time()
+    loss = LMOptimizer(film, target, 1)._validate_loss()
+    print(f'archive: {steps} steps, loss {loss:.2e}, takes {t2 - t1} s')
+
+
+def time_LM(layer_number, max_steps=1000, **kwargs):
+    film, target = make_problem(layer_number)
+    t1 = time.time()
+    lm = LMOptimizer(film, target, max_steps, **kwargs)
+    lm.optimize()
+    t2 = time.time()
+    print(f'LMOptimizer {kwargs}: {lm.i + 1} steps, loss',
+          f'{lm._validate_loss():.2e}, takes {t2 - t1} s')
+
+
+if __name__ == '__main__':
+    print('warm up')
+    time_LM(5, max_steps=2)
+    time_archive(5, max_steps=2)
+    print('end of warm up\n')
+
+    for layer_number in [20, 100, 300]:
+        print(f'{layer_number} layers @ 1000 wls')
+        time_archive(layer_number)
+        for solver in LMOptimizer.SOLVERS:
+            time_LM(layer_number, solver=solver)
+        time_LM(layer_number, geodesic=True)
+    # The archive routine recomputes f and J after every accepted step and
+    # inverts A + mu I for every trial. The engines return half
+    # the derivative, so its Gauss-Newton steps are twice too long and it
+    # needs several times as many steps.
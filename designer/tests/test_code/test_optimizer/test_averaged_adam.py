@@ -0,0 +1,59 @@
+import sys
+sys.path.append('./designer/script/')
+sys.path.append('./')
+sys.path.append('./designer/tests/test_code/')
+
+from optimizer.adam import AdamThicknessOptimizer
+from optimizer.LM_optimizer import LMOptimizer
+from tmm.get_spectrum_averaged import gauss_legendre
+from spectrum import Spectrum, SpectrumSimple
+from film import TwoMaterialFilm
+from utils.loss import calculate_RMS_f_spec_averaged
+from film_targets import d_true, d_init, make_wls
+import numpy as np
+import unittest
+
+
+wls = make_wls(30)
+
+
+class TestAveragedAdam(unittest.TestCase):
+
+    def setUp(self):
+        wl_offsets, wl_weights = gauss_legendre(20., 3)
+        self.quadrature = dict(
+            wl_offsets=wl_offsets,
+            wl_weights=wl_weights,
+            ang_offsets=np.array([-5., 0., 5.]),
+            ang_weights=np.array([1., 2., 1.]),
+        )
+        film = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true)
+        self.target = []
+        for inc_ang in [0., 30.]:
+            s = SpectrumSimple(inc_ang, wls, film)
+            s.calculate_averaged(**self.quadrature)
+            self.target.append(Spectrum(
+                inc_ang, wls, s.spec[:30].copy(), s.spec[30:].copy()))
+
+    def test_fit(self):
+        film = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true)
+        self.assertLess(calculate_RMS_f_spec_averaged(
+            film, self.target, **self.quadrature), 1e-12)
+
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_init)
+        adam = AdamThicknessOptimizer(
+            f, self.target, 40, alpha=0.5, **self.quadrature)
+        loss_init = adam._validate_loss()
+        adam.optimize()
+        # the training residual is the averaged one
+        self.assertAlmostEqual(adam.best_loss, adam._validate_loss())
+        self.assertLess(adam.best_loss, loss_init / 5)
+
+    def test_unsupported(self):
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true)
+        self.assertRaises(
+            AssertionError, LMOptimizer, f, self.target, 10, **self.quadrature)
+
+
+if __name__ == '__main__':
+    unittest.main()
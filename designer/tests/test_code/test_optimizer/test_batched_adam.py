@@ -0,0 +1,94 @@
+import sys
+sys.path.append('./designer/script/')
+sys.path.append('./')
+sys.path.append('./designer/tests/test_code/')
+
+import tmm.engines as engines
+from optimizer.batched_adam import BatchedAdamOptimizer
+from optimizer.adam import AdamThicknessOptimizer
+from film import TwoMaterialFilm
+from film_targets import d_true, d_init, make_wls, make_target
+import numpy as np
+import unittest
+
+
+wls = make_wls(30)
+
+
+class TestBatchedAdam(unittest.TestCase):
+
+    def setUp(self):
+        film = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true)
+        self.target = [make_target(film, wls), make_target(film, wls, 30.)]
+
+    def test_engine(self):
+        films = [
+            TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true),
+            TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true[:4] + 10.),
+        ]
+        inc_ang = 30.
+        n_table = films[0].calculate_n_table(wls)
+        n_sub, n_inc = films[0].calculate_n_sub(wls), films[0].calculate_n_inc(wls)
+        d = np.zeros((2, 6))
+        d[0], d[1, :4] = films[0].get_d(), films[1].get_d()
+        material_idx = np.tile(films[0].get_material_idx(), (2, 1))
+
+        spectrum = np.empty((2, wls.shape[0] * 2))
+        jacobi = np.empty((2, wls.shape[0] * 2, 6))
+        engines.get_engine('jacobi_batched')(
+            spectrum, jacobi, wls, d, n_table, material_idx, n_sub, n_inc,
+            inc_ang)
+
+        for k, f in enumerate(films):
+            l = f.get_layer_number()
+            spec_k = np.empty(wls.shape[0] * 2)
+            jacobi_k = np.empty((wls.shape[0] * 2, l))
+            args = (wls, f.get_d(), n_table, f.get_material_idx(), n_sub,
+                    n_inc, inc_ang)
+            engines.get_engine('spectrum_indexed')(spec_k, *args)
+            engines.get_engine('jacobi_indexed')(jacobi_k, *args)
+            np.testing.assert_allclose(spectrum[k], spec_k, atol=1e-12)
+            np.testing.assert_allclose(jacobi[k, :, :l], jacobi_k, atol=1e-10)
+
+    def test_same_as_adam(self):
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_init)
+        AdamThicknessOptimizer(f, self.target, 20, alpha=1.).optimize()
+
+        f_batched = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_init)
+        BatchedAdamOptimizer([f_batched], self.target, 20, alpha=1.).optimize()
+        np.testing.assert_allclose(f_batched.get_d(), f.get_d(), rtol=1e-8)
+
+    def test_multi_start(self):
+        rng = np.random.default_rng(0)
+        films = [
+            TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true + rng.normal(0, 5, 6))
+            for _ in range(3)
+        ] + [TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true[:5] * 1.1)]
+        d_init = [f.get_d().copy() for f in films]
+
+        adam = BatchedAdamOptimizer(
+            films, self.target, 50, alpha=np.array([1., 0.5, 1., 1.]),
+            patience=10, record=True)
+        xs, losses = adam.optimize()
+        init_loss = losses[0]
+
+        self.assertEqual(len(xs), adam.i + 2)
+        np.testing.assert_array_less(adam.best_loss, init_loss)
+        # padded layer stays empty
+        self.assertEqual(films[3].get_layer_number(), 5)
+        np.testing.assert_array_equal(xs[-1][3, 5], 0.)
+        for k, f in enumerate(films):
+            np.testing.assert_allclose(
+                f.get_d(), adam.best_x[k, :f.get_layer_number()])
+            self.assertFalse(np.array_equal(f.get_d(), d_init[k]))
+        self.assertRaises(
+            AssertionError,
+            BatchedAdamOptimizer,
+            [films[0], TwoMaterialFilm('TiO2', 'MgF2_xc', 'BK7', d_true)],
+            self.target,
+            10
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
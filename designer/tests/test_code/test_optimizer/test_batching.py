@@ -0,0 +1,128 @@
+import sys
+sys.path.append('./designer/script/')
+sys.path.append('./')
+sys.path.append('./designer/tests/test_code/')
+
+from optimizer.batching import Batcher
+from optimizer.grad_helper import stack_f, stack_init_params
+from optimizer.adam import AdamThicknessOptimizer
+from film import TwoMaterialFilm
+import tmm.engines as engines
+from film_targets import d_true, make_wls, make_target
+import numpy as np
+import unittest
+
+
+
+
+class TestBatching(unittest.TestCase):
+
+    def setUp(self):
+        film = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true)
+        self.target = [
+            make_target(film, make_wls(20)),
+            make_target(film, make_wls(60), 30.),
+        ]
+
+    def test_uniform(self):
+        batcher = Batcher(self.target, 1, 10, seed=0)
+        seen = [set(), set()]
+        for _ in range(50):
+            batcher.sample()
+            self.assertEqual(len(batcher.spec_batch_idx), 1)
+            i = batcher.spec_batch_idx[0]
+            idx = batcher.wl_batch_idx[0]
+            self.assertEqual(idx.shape, (10,))
+            self.assertTrue(np.all(np.diff(idx) > 0))
+            seen[i] |= set(idx)
+        # each spectrum is sampled from all its wavelengths
+        self.assertEqual(seen[0], set(range(20)))
+        self.assertEqual(seen[1], set(range(60)))
+        np.testing.assert_array_equal(batcher.weights, 1.)
+
+        # reproducible
+        a, b = Batcher(self.target, 1, 10, seed=1), Batcher(self.target, 1, 10, seed=1)
+        a.sample()
+        b.sample()
+        np.testing.assert_array_equal(a.wl_batch_idx[0], b.wl_batch_idx[0])
+
+    def test_stratified_and_full(self):
+        batcher = Batcher(self.target, 2, 10, stratified=True, seed=0)
+        np.testing.assert_array_equal(batcher.batch_sizes, [5, 15])
+        batcher.sample()
+        np.testing.assert_array_equal(batcher.spec_batch_idx, [0, 1])
+        self.assertEqual(
+            [idx.shape[0] for idx in batcher.wl_batch_idx], [5, 15])
+        self.assertEqual(batcher.weights.shape, (40,))
+
+        full = Batcher(self.target[:1], 1, 20)
+        self.assertTrue(full.is_full)
+        full.sample()
+        np.testing.assert_array_equal(full.wl_batch_idx[0], np.arange(20))
+
+    def test_importance(self):
+        batcher = Batcher(
+            self.target, 2, 10, sampling='importance', stratified=True,
+            seed=0)
+        # large residuals at the first 5 wavelengths of the second spectrum
+        residual = np.full(60, 0.01)
+        residual[:5] = 1.
+        batcher.residual[1] = residual.copy()
+
+        counts = np.zeros(60)
+        estimate = 0.
+        n = 2000
+        for _ in range(n):
+            batcher.sample()
+            idx = batcher.wl_batch_idx[1]
+            np.add.at(counts, idx, 1)
+            # a 'gradient' of which every wavelength contributes residual
+            f = np.zeros(batcher.weights.shape[0])
+            f[10: 25] = residual[idx]
+            estimate += batcher.weigh(f).sum() / n
+        self.assertGreater(counts[:5].sum(), counts[5:].sum())
+        # unbiased w.r.t. uniform sampling of 15 of 60 wavelengths
+        self.assertAlmostEqual(estimate, 15 / 60 * residual.sum(), delta=0.1)
+
+        # residuals are taken from f
+        batcher.sample()
+        f = np.arange(batcher.weights.shape[0], dtype=float)
+        batcher.observe(f)
+        idx = batcher.wl_batch_idx[0]
+        np.testing.assert_allclose(
+            batcher.residual[0][idx[-1]], np.hypot(f[4], f[9]))
+
+    def test_stack_f_per_spectrum(self):
+        film = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true + 5.)
+        n_arrs_ls = stack_init_params(film, self.target)
+        batcher = Batcher(self.target, 2, 10, stratified=True, seed=0)
+        batcher.sample()
+        f = np.empty(batcher.weights.shape[0])
+        stack_f(f, n_arrs_ls, film.get_d(), self.target,
+                spec_batch_idx=batcher.spec_batch_idx,
+                wl_batch_idx=batcher.wl_batch_idx,
+                get_f=engines.get_engine('spectrum_free'))
+        row = 0
+        for s, idx in zip(self.target, batcher.wl_batch_idx):
+            spec = film.add_spec_param(s.INC_ANG, s.WLS)
+            n = idx.shape[0]
+            np.testing.assert_allclose(
+                f[row: row + n], spec.get_R()[idx] - s.get_R()[idx], atol=1e-12)
+            np.testing.assert_allclose(
+                f[row + n: row + 2 * n], spec.get_T()[idx] - s.get_T()[idx],
+                atol=1e-12)
+            row += 2 * n
+
+    def test_adam(self):
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true + 5.)
+        adam = AdamThicknessOptimizer(
+            f, self.target, 30, batch_size_wl=10, sampling='importance',
+            stratified=True, seed=0)
+        self.assertEqual(adam.total_wl_num, 40)
+        loss_init = adam._validate_loss()
+        adam.optimize()
+        self.assertLess(adam._validate_loss(), loss_init)
+
+
+if __name__ == '__main__':
+    unittest.main()
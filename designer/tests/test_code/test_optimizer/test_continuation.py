@@ -0,0 +1,82 @@
+import sys
+sys.path.append('./designer/script/')
+sys.path.append('./')
+sys.path.append('./designer/tests/test_code/')
+
+from optimizer.batching import Batcher
+from optimizer.LM_optimizer import LMOptimizer
+from optimizer.adam import AdamThicknessOptimizer
+from film import TwoMaterialFilm
+from film_targets import d_true, d_init, make_wls, make_target
+import numpy as np
+import unittest
+
+
+
+
+class TestContinuation(unittest.TestCase):
+
+    def setUp(self):
+        film = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true)
+        wls = make_wls(120)
+        self.target = [make_target(film, wls), make_target(film, wls, 30.)]
+        self.d_init = d_init
+
+    def test_levels(self):
+        batcher = Batcher(self.target, 2, 120, levels=[8, 2, 1])
+        self.assertEqual(batcher.max_rows, 480)
+        weights = batcher.weights
+        for stride in [8, 2, 1]:
+            self.assertEqual(batcher.stride, stride)
+            batcher.sample()
+            for idx in batcher.wl_batch_idx:
+                np.testing.assert_array_equal(idx, np.arange(0, 120, stride))
+            self.assertEqual(batcher.weights.shape[0], 4 * 120 // stride)
+            self.assertTrue(np.shares_memory(batcher.weights, weights))
+            self.assertEqual(batcher.is_full, stride == 1)
+            self.assertEqual(batcher.refine(), stride != 1)
+
+        # mini-batches of the coarse wavelengths
+        batcher = Batcher(
+            self.target, 1, 40, sampling='importance', levels=[4, 1], seed=0)
+        batcher.sample()
+        idx = batcher.wl_batch_idx[0]
+        self.assertEqual(idx.shape[0], 30)  # all 30 of the level at most
+        np.testing.assert_array_equal(idx % 4, 0)
+        batcher.refine()
+        batcher.sample()
+        self.assertEqual(batcher.wl_batch_idx[0].shape[0], 40)
+        self.assertRaises(AssertionError, Batcher, self.target, 1, 40,
+                          levels=[1, 4])
+
+    def test_lm(self):
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', self.d_init)
+        lm = LMOptimizer(f, self.target, 20, wl_levels=[8, 1], refine_every=3)
+        J, f_buf = lm.J, lm.f
+        self.assertEqual(lm.J.shape[0], 60)
+        self.assertFalse(lm.f_is_full)
+        lm.optimize()
+
+        self.assertEqual(lm.batcher.level, 1)
+        self.assertEqual(lm.J.shape[0], 480)
+        self.assertTrue(lm.f_is_full)
+        # the buffers are reused
+        self.assertTrue(np.shares_memory(lm.J, J))
+        self.assertTrue(
+            np.shares_memory(lm.f, f_buf) or np.shares_memory(lm.f_new, f_buf))
+        np.testing.assert_allclose(f.get_d(), d_true, atol=1e-3)
+
+    def test_plateau(self):
+        # refine when the patience runs out on the coarse level
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', self.d_init)
+        adam = AdamThicknessOptimizer(
+            f, self.target, 200, wl_levels=[40, 1], patience=5)
+        loss_init = adam._validate_loss()
+        adam.optimize()
+        self.assertEqual(adam.batcher.level, 1)
+        self.assertGreater(adam._level_start, 0)
+        self.assertLess(adam.best_loss, loss_init)
+
+
+if __name__ == '__main__':
+    unittest.main()
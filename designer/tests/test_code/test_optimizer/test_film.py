@@ -1,11 +1,15 @@
 import unittest
 import numpy as np
 import copy
+import pickle
 
 
 import sys
 sys.path.append('./designer/script/')
-from film import TwoMaterialFilm
+from film import TwoMaterialFilm, MultiMaterialFilm, FreeFormFilm, FilmCore
+from optimizer.adam import AdamThicknessOptimizer
+from spectrum import Spectrum
+from utils.materials import get_material
 
 
 class TestFilm(unittest.TestCase):
@@ -24,6 +28,22 @@ class TestFilm(unittest.TestCase):
         self.remove_helper([1, 2, 3, 4, 0, 6], [1, 2, 3, 10])
         self.remove_helper([1, 2, 3, 4, 0, 0], [1, 2, 3, 4])
         self.remove_helper([1, 2, 3, 4, 5, 0], [1, 2, 3, 4, 5])
+        # consecutive non-positive layers are dropped, not summed into
+        # the neighbour
+        self.remove_helper([10, -1, -2, 20, 30], [10, 20, 30])
+        self.remove_helper([10, -1, -2, -3, 30], [40])
+
+    def test_delete_layer_exclude(self):
+        for exclude in [[4], [-1]]:
+            f = TwoMaterialFilm(
+                'SiO2', 'TiO2', 'SiO2', np.array([1., 2., 3., 4., -1.]))
+            f.remove_negative_thickness_layer(exclude=exclude)
+            np.testing.assert_equal(f.get_d(), [1., 2., 3., 4., -1.])
+
+        f = TwoMaterialFilm(
+            'SiO2', 'TiO2', 'SiO2', np.array([1., 2., 3., 4., -1.]))
+        f.remove_negative_thickness_layer()
+        np.testing.assert_equal(f.get_d(), [1., 2., 3., 4.])
 
     def test_insert(self):
         f = TwoMaterialFilm('SiO2', 'TiO2', 'SiO2',
@@ -64,6 +84,180 @@ class TestFilm(unittest.TestCase):
         f_tmp.insert_layer(0, 1., 100)
         self.assertListEqual(list(f_tmp.get_d()), [1., 100, 0.])
 
+    def test_insert_layers(self):
+        d = np.array([1., 2., 3.])
+        f = TwoMaterialFilm('SiO2', 'TiO2', 'SiO2', d)
+        # unsorted, two insertions into layer 2
+        idx = f.insert_layers([2, 0, 2], [2., 0.5, 1.], [7., 8., 9.])
+        np.testing.assert_almost_equal(
+            f.get_d(), [0.5, 8., 0.5, 2., 1., 9., 1., 7., 1.])
+        np.testing.assert_equal(f.get_d()[idx], [7., 8., 9.])
+
+        # same as inserting one by one, back to front
+        g = TwoMaterialFilm('SiO2', 'TiO2', 'SiO2', d)
+        g.insert_layer(2, 2., 7.)
+        g.insert_layer(2, 1., 9.)
+        g.insert_layer(0, 0.5, 8.)
+        np.testing.assert_almost_equal(f.get_d(), g.get_d())
+
+        self.assertRaises(AssertionError, f.insert_layers, [0, 1], [0.1, 9.], 1.)
+        version = f.get_version()
+        f.insert_layers(np.arange(9), 0., 0.)
+        self.assertEqual(f.get_version(), version + 1)
+        self.assertEqual(f.get_layer_number(), 27)
+
+    def test_remove_layers(self):
+        f = TwoMaterialFilm('SiO2', 'TiO2', 'SiO2', np.array([1., 2., 3., 4., 5.]))
+        f.remove_layers(np.array([False, True, False, True, True]))
+        np.testing.assert_equal(f.get_d(), [4.])
+        self.assertRaises(AssertionError, f.remove_layers, [True])
+
+        f = TwoMaterialFilm('SiO2', 'TiO2', 'SiO2', np.array([1., -1., 3., 0., 5.]))
+        f.remove_negative_thickness_layer(exclude=[3])
+        np.testing.assert_equal(f.get_d(), [4., 0., 5.])
+
+    def test_multi_material(self):
+        f = MultiMaterialFilm(
+            np.array(['TiO2', 'SiO2', 'SiO2', 'BK7', 'TiO2']), 'BK7',
+            np.array([1., 2., 3., -1., 5.]))
+        f.remove_negative_thickness_layer()
+        np.testing.assert_equal(f.get_d(), [1., 2., 3., 5.])
+        f.merge_adjacent_same_material()
+        np.testing.assert_equal(f.get_d(), [1., 5., 5.])
+        self.assertEqual(
+            list(f.materials_list), [get_material(m) for m in ['TiO2', 'SiO2', 'TiO2']])
+        self.assertEqual(len(f.get_core().materials), 2)
+
+    def test_project_to_two_material_film(self):
+        f = FreeFormFilm(np.array([1.5, 1.5, 2., 2.2, 1.5]), 10., 'BK7')
+        f.update_d(np.array([0.5, 1.25, 1., 1., 0.25]))
+        g = f.project_to_two_material_film(2., 1.5)
+        np.testing.assert_equal(g.get_d(), [0., 1.75, 2., 0.25])
+        self.assertEqual(g.materials['A'], get_material(2.))
+
+
+class TestFilmCore(unittest.TestCase):
+
+    def test_from_layers(self):
+        core = FilmCore.from_layers(
+            [1., 2., 3., 4.], ['TiO2', 'SiO2', get_material('TiO2'), 1.])
+        self.assertEqual(core.materials, tuple(
+            get_material(m) for m in ['TiO2', 'SiO2', 1.]))
+        np.testing.assert_equal(core.material_idx, [0, 1, 0, 2])
+        self.assertEqual(core.material_idx.dtype, np.uint8)
+        self.assertFalse(core.material_idx.flags.writeable)
+        self.assertEqual(core.layer_material(2), get_material('TiO2'))
+
+        core = FilmCore(np.ones(3), [0, 1, 299],
+                        [get_material(1. + i / 1000) for i in range(300)])
+        self.assertEqual(core.material_idx.dtype, np.uint16)
+
+    def test_bulk(self):
+        core = FilmCore.from_layers(
+            [1., 2., 3., 4.], ['TiO2', 'SiO2', 'BK7', 'SiO2'])
+        deleted = core.delete([2])
+        np.testing.assert_equal(deleted.d, [1., 2., 4.])
+        # BK7 not used any more
+        self.assertEqual(len(deleted.materials), 2)
+        np.testing.assert_equal(deleted.material_idx, [0, 1, 1])
+
+        selected = core.select(np.array([False, True, True, True]))
+        np.testing.assert_equal(selected.d, [2., 3., 4.])
+        self.assertEqual(selected.materials[0], get_material('SiO2'))
+
+        inserted = core.insert([1, 1], [5., 6.], ['MgF2_xc', 'TiO2'])
+        np.testing.assert_equal(inserted.d, [1., 5., 6., 2., 3., 4.])
+        self.assertEqual(
+            list(inserted.layer_materials()),
+            [get_material(m) for m in
+             ['TiO2', 'MgF2_xc', 'TiO2', 'SiO2', 'BK7', 'SiO2']]
+        )
+        # the original is untouched
+        np.testing.assert_equal(core.d, [1., 2., 3., 4.])
+        self.assertEqual(len(core.materials), 3)
+
+    def test_large_film(self):
+        L = 50000
+        materials = np.array(['TiO2', 'SiO2', 'MgF2_xc'])[np.arange(L) % 3]
+        f = MultiMaterialFilm(materials, 'BK7', np.full(L, 100.))
+        core = f.get_core()
+        self.assertEqual(core.material_idx.nbytes, L)
+        self.assertEqual(len(core.materials), 3)
+        wls = np.linspace(500, 1000, 5)
+        n_arr = f.calculate_n_array(wls)
+        np.testing.assert_almost_equal(
+            n_arr[:, 4], get_material('SiO2')(wls))
+
+        g = pickle.loads(pickle.dumps(f))
+        np.testing.assert_equal(g.get_d(), f.get_d())
+        np.testing.assert_equal(g.get_material_idx(), f.get_material_idx())
+
+        f.remove_layer(np.arange(0, L, 3))
+        self.assertEqual(f.get_layer_number(), L - L // 3 - 1)
+        self.assertEqual(f.materials_list[0], get_material('SiO2'))
+        self.assertEqual(g.get_layer_number(), L)
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.wls = np.linspace(500, 1000, 20)
+        self.f = TwoMaterialFilm(
+            'TiO2', 'SiO2', 'BK7', np.array([50., 80., 120.]))
+        self.f.add_spec_param(0., self.wls)
+
+    def test_restore(self):
+        R = self.f.get_spec().get_R().copy()
+        snap = self.f.snapshot()
+        self.f.update_d(np.array([10., 10., 10.]))
+        self.f._register_get_n('A', 'MgF2_xc')
+
+        np.testing.assert_equal(snap.get_d(), [50., 80., 120.])
+        self.assertEqual(snap.get_layer_number(), 3)
+        self.assertRaises(ValueError, snap.get_d().__setitem__, 0, 1.)
+        # film methods are available on the snapshot
+        np.testing.assert_almost_equal(snap.get_spec().get_R(), R)
+
+        g = snap.to_film()
+        self.assertEqual(g.materials['A'], get_material('TiO2'))
+        np.testing.assert_almost_equal(g.get_spec().get_R(), R)
+        # the restored film is independent of the snapshot
+        g.update_d(np.array([1., 2., 3.]))
+        np.testing.assert_equal(snap.to_film().get_d(), [50., 80., 120.])
+
+        snap = pickle.loads(pickle.dumps(snap))
+        np.testing.assert_equal(snap.get_d(), [50., 80., 120.])
+
+    def test_shared_state(self):
+        f = MultiMaterialFilm(
+            np.array(['TiO2', 'SiO2', 'BK7']), 'BK7', np.array([1., 2., 3.]))
+        snap = f.snapshot()
+        # material ids are shared, not copied
+        self.assertIs(
+            snap.params['_core'].material_idx, f.get_material_idx())
+        f.update_d(np.array([4., 5., 6.]))
+        np.testing.assert_equal(snap.get_d(), [1., 2., 3.])
+        f.remove_layer([1])
+        self.assertEqual(snap.to_film().get_layer_number(), 3)
+
+        f = FreeFormFilm(np.array([2., 1.5]), 100., 'BK7')
+        snap = f.snapshot()
+        f.update_n(np.array([1.8, 1.8]))
+        np.testing.assert_equal(snap.get_n(), [2., 1.5])
+        self.assertRaises(
+            AttributeError, TwoMaterialFilm(
+                'TiO2', 'SiO2', 'BK7', np.array([1.])).snapshot().get_n)
+
+    def test_optimizer_records(self):
+        target = Spectrum(0., self.wls, np.ones(20))
+        adam = AdamThicknessOptimizer(
+            self.f, [target], 5, alpha=1., record=True)
+        films, losses = adam.optimize()
+        self.assertEqual(len(films), 6)
+        self.assertEqual(type(films[0]).__name__, 'FilmSnapshot')
+        np.testing.assert_equal(films[0].get_d(), [50., 80., 120.])
+        self.assertFalse(np.array_equal(films[-1].get_d(), films[0].get_d()))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,82 @@
+import sys
+sys.path.append('./designer/script/')
+sys.path.append('./')
+sys.path.append('./designer/tests/test_code/')
+
+from optimizer.lbfgsb import LBFGSBThicknessOptimizer, LBFGSBFreeFormOptimizer
+from film import TwoMaterialFilm, FreeFormFilm
+from film_targets import d_true, d_init, make_wls, make_target
+import numpy as np
+import unittest
+
+
+wls = make_wls(50)
+
+
+class TestLBFGSB(unittest.TestCase):
+
+    def test_thickness(self):
+        target = [make_target(TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true), wls)]
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_init)
+        lbfgsb = LBFGSBThicknessOptimizer(
+            f, target, 200, h_tol=1e-9, record=True)
+        films, losses = lbfgsb.optimize()
+        np.testing.assert_allclose(f.get_d(), d_true, atol=1e-4)
+        self.assertLess(lbfgsb.i, 100)
+        # monotone: every accepted step satisfies the Armijo condition
+        self.assertTrue(np.all(np.diff(losses) <= 1e-15))
+
+    def test_batched_line_search(self):
+        target = [make_target(TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true), wls)]
+        d_far = d_true + np.array([15., -16., 14., -13., 15., 12.])
+        d = []
+        for ls_batch in [1, 4]:
+            f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_far)
+            lbfgsb = LBFGSBThicknessOptimizer(f, target, 10, ls_batch=ls_batch)
+            lbfgsb.optimize()
+            d.append(f.get_d())
+        # the same step lengths are taken
+        np.testing.assert_allclose(d[0], d[1], rtol=1e-10)
+
+        X = np.array([d_true, d_far, d_far * 0.9])
+        F = lbfgsb._trial_f(X)
+        for x, f_batched in zip(X, F):
+            f = np.empty(F.shape[1])
+            lbfgsb._stack_f(f, x)
+            np.testing.assert_allclose(f_batched, f, atol=1e-12)
+
+    def test_active_bound(self):
+        # the optimum has a layer of zero thickness
+        d_true = np.array([80., 0., 60., 150.])
+        target = [make_target(TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true), wls)]
+        f = TwoMaterialFilm(
+            'TiO2', 'SiO2', 'BK7', d_true + np.array([3., 5., -4., 2.]))
+        lbfgsb = LBFGSBThicknessOptimizer(f, target, 200, h_tol=1e-9)
+        lbfgsb.optimize()
+        self.assertLess(lbfgsb._validate_loss(), 1e-8)
+        self.assertEqual(f.get_d()[1] >= 0, True)
+        self.assertLess(f.get_d()[1], 1e-6)
+        self.assertLess(lbfgsb.i, 100)
+
+    def test_free_form(self):
+        n_true = np.array([2., 1.5, 2.2, 1.6, 1.9])
+        target = [make_target(FreeFormFilm(n_true, 500., 'BK7'), wls)]
+        f = FreeFormFilm(
+            n_true + np.array([.05, -.04, .03, .02, -.05]), 500., 'BK7')
+        lbfgsb = LBFGSBFreeFormOptimizer(
+            f, target, 200, n_min=1.45, n_max=2.3, h_tol=1e-10)
+        lbfgsb.optimize()
+        np.testing.assert_allclose(f.get_n(), n_true, atol=1e-5)
+
+        # bounds are respected and active
+        f = FreeFormFilm(
+            n_true + np.array([.05, -.04, .03, .02, -.05]), 500., 'BK7')
+        lbfgsb = LBFGSBFreeFormOptimizer(
+            f, target, 50, n_min=1.55, n_max=2.1)
+        lbfgsb.optimize()
+        self.assertTrue(np.all((f.get_n().real >= 1.55) & (f.get_n().real <= 2.1)))
+        self.assertAlmostEqual(f.get_n().real.min(), 1.55)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import sys
+sys.path.append('./designer/script/')
+sys.path.append('./')
+sys.path.append('./designer/tests/test_code/')
+
+import tmm.engines as engines
+from optimizer.adam import AdamThicknessOptimizer, AdamFreeFormOptimizer
+from optimizer.sgd import SGDThicknessOptimizer
+from optimizer.grad_helper import stack_f, stack_f_batched, stack_init_params
+from spectrum import Spectrum
+from film import TwoMaterialFilm, FreeFormFilm
+from film_targets import d_true, d_init, make_wls, make_target
+import numpy as np
+import unittest
+
+
+wls = make_wls(30)
+
+
+class TestLineSearch(unittest.TestCase):
+
+    def setUp(self):
+        film = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true)
+        self.target = [make_target(film, wls), make_target(film, wls, 30.)]
+        self.d_init = d_init
+
+    def test_engine(self):
+        film = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true)
+        D = np.array([d_true, d_true * 1.1, np.append(d_true[:4], [0., 0.])])
+        n_arrs_ls = stack_init_params(film, self.target, indexed=True)
+        wl_batch_idx = [np.arange(0, 30, 2), np.arange(5, 20)]
+        F = np.empty((3, 60))
+        stack_f_batched(
+            F, n_arrs_ls, D, self.target, film.get_material_idx(),
+            wl_batch_idx=wl_batch_idx)
+        for d, f_batched in zip(D, F):
+            f = np.empty(60)
+            stack_f(f, n_arrs_ls, d, self.target,
+                    wl_batch_idx=wl_batch_idx,
+                    get_f=engines.get_engine('spectrum_indexed'),
+                    material_idx=film.get_material_idx())
+            np.testing.assert_allclose(f_batched, f, atol=1e-12)
+        # zero-thickness layers do not change the spectrum
+        F_4 = np.empty((1, 60))
+        stack_f_batched(
+            F_4, n_arrs_ls, D[2:, :4], self.target,
+            film.get_material_idx()[:4], wl_batch_idx=wl_batch_idx)
+        np.testing.assert_allclose(F_4[0], F[2], atol=1e-12)
+
+    def test_tuned_step(self):
+        # alpha far too small
+        losses = []
+        for line_search in [0, 5]:
+            f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', self.d_init)
+            adam = AdamThicknessOptimizer(
+                f, self.target, 30, alpha=1e-3, line_search=line_search)
+            adam.optimize()
+            losses.append(adam.best_loss)
+        self.assertGreater(adam.alpha, 1e-2)
+        self.assertLess(losses[1], losses[0] / 5)
+
+    def test_sgd(self):
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', self.d_init)
+        sgd = SGDThicknessOptimizer(
+            f, self.target, 20, lr=1e-2, nesterov=False, line_search=3)
+        loss_init = sgd._validate_loss()
+        sgd.optimize()
+        self.assertLess(sgd.best_loss, loss_init)
+        self.assertNotEqual(sgd.lr, 1e-2)
+
+        # batched trials are the f of each of them
+        X = np.array([d_true, self.d_init])
+        F = sgd._trial_f(X)
+        for x, f_batched in zip(X, F):
+            f = np.empty(F.shape[1])
+            stack_f(f, sgd.n_arrs_ls, x, self.target,
+                    spec_batch_idx=sgd.spec_batch_idx,
+                    wl_batch_idx=sgd.wl_batch_idx,
+                    get_f=sgd.get_f, material_idx=sgd.material_idx)
+            np.testing.assert_allclose(f_batched, f, atol=1e-12)
+
+    def test_selection(self):
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', self.d_init)
+        adam = AdamThicknessOptimizer(f, self.target, 1, line_search=3)
+        adam._mini_batching()
+        adam._optimize_step()
+        adam.x = adam._x_f.copy()  # f and J are at _x_f
+        g = adam.J.T @ adam.f
+
+        # short steps downhill: the longest is the best and satisfies Armijo
+        self.assertEqual(adam._line_search(g / np.abs(g).max(), 1e-2), 2e-2)
+        # no trial improves uphill: plain update
+        self.assertEqual(adam._line_search(-g, 1.), 1.)
+        adam.line_search_c1 = None
+        step = adam._line_search(g / np.abs(g).max(), 1.)
+        self.assertIn(step, [0.5, 1., 2.])
+
+    def test_free_form(self):
+        wls_ff = np.linspace(500, 700, 10)
+        target_film = FreeFormFilm(
+            np.array([1.6, 2.0, 1.7, 2.1]), 400., substrate=1.5)
+        s = target_film.add_spec_param(0., wls_ff)
+        target = [Spectrum(0., wls_ff, s.get_R().copy(), s.get_T().copy())]
+
+        film = FreeFormFilm(np.array([1.8, 1.8, 1.8, 1.8]), 400., substrate=1.5)
+        adam = AdamFreeFormOptimizer(
+            film, target, 10, alpha=1e-3, line_search=3, n_min=1.3, n_max=2.5)
+        loss_init = adam._validate_loss()
+        adam.optimize()
+        self.assertLess(adam.best_loss, loss_init)
+        self.assertNotEqual(adam.alpha, 1e-3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import sys
+sys.path.append('./designer/script/')
+sys.path.append('./')
+sys.path.append('./designer/tests/test_code/')
+
+from optimizer.recorder import TrajectoryRecorder, Trajectory
+from optimizer.adam import AdamThicknessOptimizer
+from optimizer.LM_optimizer import LMOptimizer
+from film import TwoMaterialFilm, MultiMaterialFilm, FreeFormFilm
+from film_targets import d_true, d_init, make_wls, make_target
+import numpy as np
+import os
+import tempfile
+import unittest
+
+
+wls = make_wls(50)
+
+
+class TestRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'run')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_segments_and_templates(self):
+        f = MultiMaterialFilm(np.array(['TiO2', 'SiO2'] * 3), 'BK7', d_init)
+        recorder = TrajectoryRecorder(self.path, chunk_size=3)
+        ds = []
+        for i in range(7):
+            if i == 4:
+                mask = np.zeros(6, dtype=bool)
+                mask[2] = True
+                f.remove_layers(mask)
+            f.update_d(f.get_d() + i)
+            ds.append(f.get_d().copy())
+            recorder.append(i, 1. / (i + 1), f)
+        # full segments are on disk before close
+        self.assertEqual(len(Trajectory(self.path)), 6)
+        trajectory = recorder.close()
+
+        self.assertEqual(len(trajectory), 7)
+        np.testing.assert_array_equal(trajectory.steps, np.arange(7))
+        np.testing.assert_allclose(trajectory.losses, 1. / np.arange(1, 8))
+        self.assertTrue(np.all(np.diff(trajectory.times) >= 0))
+        for i in [0, 3, 4, -1]:
+            film = trajectory.films[i]
+            np.testing.assert_array_equal(film.get_d(), ds[i])
+        # materials of the template after the layer number changed
+        np.testing.assert_array_equal(
+            trajectory.films[-1].get_material_idx(), f.get_material_idx())
+        self.assertEqual(len(trajectory.films[2:5]), 3)
+        self.assertRaises(IndexError, trajectory.params, 7)
+
+        self.assertRaises(FileExistsError, TrajectoryRecorder, self.path)
+        TrajectoryRecorder(self.path, overwrite=True).close()
+        self.assertEqual(len(Trajectory(self.path)), 0)
+
+    def test_free_form(self):
+        f = FreeFormFilm(np.array([1.5, 2.1, 1.8]), 500., 'BK7')
+        recorder = TrajectoryRecorder(self.path)
+        recorder.append(-1, 1., f)
+        n = f.get_n().copy()
+        f.update_n(n + 0.1j)
+        recorder.append(0, 0.5, f)
+        films = recorder.close().films
+        np.testing.assert_array_equal(films[0].get_n(), n)
+        np.testing.assert_array_equal(films[1].get_n(), n + 0.1j)
+
+    def test_optimizers(self):
+        target = [make_target(TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true), wls)]
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_init)
+        films_mem, losses_mem = LMOptimizer(
+            f, target, 5, h_tol=0., record=True).optimize()
+
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_init)
+        films, losses = LMOptimizer(
+            f, target, 5, h_tol=0., record_path=self.path,
+            record_chunk_size=2).optimize()
+        self.assertEqual(len(films), len(films_mem))
+        np.testing.assert_allclose(losses, losses_mem)
+        for film, film_mem in zip(films, films_mem):
+            np.testing.assert_allclose(film.get_d(), film_mem.get_d())
+
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_init)
+        films, losses = AdamThicknessOptimizer(
+            f, target, 10, record_path=self.path, record_overwrite=True,
+            record_stride=3).optimize()
+        # initial film, steps 0, 3, 6, 9
+        np.testing.assert_array_equal(
+            Trajectory(self.path).steps, [-1, 0, 3, 6, 9])
+        self.assertEqual(len(losses), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import sys
+sys.path.append('./designer/script/')
+sys.path.append('./')
+
+from sweep import SweepRunner, grid, case_id
+from film import TwoMaterialFilm
+import numpy as np
+import os
+import tempfile
+import unittest
+
+
+def run_case(d, rep):
+    if d == 2.:
+        raise ValueError('bad case')
+    film = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', np.array([d * 50., 100.]))
+    s = film.add_spec_param(0., np.linspace(400, 800, 5))
+    return s.get_R().copy(), film
+
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_grid(self):
+        cases = grid(a=[1, 2], b='xyz')
+        self.assertEqual(len(cases), 6)
+        self.assertEqual(cases[1], {'a': 1, 'b': 'y'})
+        self.assertEqual(case_id({'a': 1, 'b': 'y'}), case_id({'b': 'y', 'a': 1}))
+        self.assertNotEqual(case_id(cases[0]), case_id(cases[1]))
+
+    def test_case_id_numpy(self):
+        self.assertEqual(case_id({'a': np.float64(1.)}), case_id({'a': 1.}))
+        self.assertEqual(case_id({'a': [np.int64(2)]}), case_id({'a': [2]}))
+        # long arrays differing in the middle (elided by repr)
+        x = np.zeros(10000)
+        y = x.copy()
+        y[5000] = 1.
+        self.assertNotEqual(case_id({'d': x}), case_id({'d': y}))
+        self.assertEqual(case_id({'d': x}), case_id({'d': x.copy()}))
+        self.assertNotEqual(case_id({'d': x}), case_id({'d': x.reshape(100, 100)}))
+        self.assertNotEqual(case_id({'d': x}), case_id({'d': x.astype('float32')}))
+
+    def _check(self, runner, cases, errors):
+        self.assertEqual(len(errors), len(cases))
+        for params, record in zip(cases, runner.results(cases)):
+            self.assertEqual(record['params'], params)
+            self.assertGreaterEqual(record['time'], 0.)
+            if params['d'] == 2.:
+                self.assertIn('bad case', record['error'])
+                self.assertIsNone(record['result'])
+                self.assertIsNotNone(errors[case_id(params)])
+            else:
+                self.assertIsNone(record['error'])
+                R, film = record['result']
+                self.assertEqual(R.shape, (5,))
+                np.testing.assert_array_equal(film.get_d()[0], params['d'] * 50.)
+
+    def test_pool_and_resume(self):
+        cases = grid(d=[1., 2., 3.], rep=range(2))
+        runner = SweepRunner(
+            run_case, self.dir.name, processes=2, warmup=TwoMaterialFilm)
+        self._check(runner, cases, runner.run(cases))
+
+        # interrupted sweep: a case is missing
+        os.remove(runner.path(cases[-1]))
+        errors = runner.run(cases)
+        # the failed cases are retried
+        self.assertEqual(
+            set(errors), {case_id(p) for p in cases if p['d'] == 2.} |
+            {case_id(cases[-1])})
+        self.assertEqual(
+            SweepRunner(run_case, self.dir.name, processes=2,
+                        retry_failed=False).run(cases), {})
+
+    def test_in_process(self):
+        cases = grid(d=[1., 2.], rep=[0])
+        runner = SweepRunner(
+            run_case, self.dir.name, processes=0, warmup=['spectrum_indexed'])
+        self._check(runner, cases, runner.run(cases))
+        self.assertEqual(len(os.listdir(self.dir.name)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
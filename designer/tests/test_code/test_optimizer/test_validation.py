@@ -0,0 +1,105 @@
+import sys
+sys.path.append('./designer/script/')
+sys.path.append('./')
+sys.path.append('./designer/tests/test_code/')
+
+from optimizer.adam import AdamThicknessOptimizer
+from optimizer.LM_optimizer import LMOptimizer
+from film import TwoMaterialFilm
+from film_targets import d_true, d_init, make_wls, make_target
+import numpy as np
+import unittest
+
+
+wls = make_wls(50)
+
+
+def count_validations(optimizer):
+    calls = []
+    validate_loss = optimizer._validate_loss
+    optimizer._validate_loss = lambda: calls.append(1) or validate_loss()
+    return calls
+
+
+class TestValidation(unittest.TestCase):
+
+    def setUp(self):
+        film = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true)
+        self.target = [make_target(film, wls), make_target(film, wls, 0.3)]
+
+    def test_training_loss_is_validation_loss(self):
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_init)
+        for opt in [
+            AdamThicknessOptimizer(f, self.target, 1),
+            LMOptimizer(f, self.target, 1),
+        ]:
+            self.assertTrue(opt.f_is_full)
+            opt._optimize_step()
+            loss, x, i = opt._training_loss()
+            f_x = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', x)
+            opt.film, film = f_x, opt.film
+            self.assertAlmostEqual(loss, opt._validate_loss())
+            opt.film = film
+
+    def test_full_batch_reuses_f(self):
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_init)
+        adam = AdamThicknessOptimizer(f, self.target, 20)
+        calls = count_validations(adam)
+        adam.optimize()
+        # initial record and the final parameters only
+        self.assertEqual(len(calls), 2)
+        self.assertAlmostEqual(adam.best_loss, adam._validate_loss())
+
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_init)
+        lm = LMOptimizer(f, self.target, 20)
+        calls = count_validations(lm)
+        lm.optimize()
+        self.assertEqual(len(calls), 1)
+        self.assertAlmostEqual(lm.best_loss, lm._validate_loss())
+
+    def test_incoherent_substrate(self):
+        # set after the initialization: rms(f) of the coherent engines is
+        # not the loss of the film
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_init)
+        adam = AdamThicknessOptimizer(f, self.target, 5)
+        f.set_incoherent_substrate(1e6)
+        calls = count_validations(adam)
+        adam.optimize()
+        # initial record and every step
+        self.assertEqual(len(calls), 6)
+        loss = adam._validate_loss()
+        self.assertAlmostEqual(adam.best_loss, loss)
+        f.remove_incoherent_substrate()
+        self.assertNotAlmostEqual(adam._validate_loss(), loss)
+
+    def test_schedule_and_held_out(self):
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_init)
+        adam = AdamThicknessOptimizer(
+            f, self.target[:1], 10, validate_every=3,
+            validate_spec_ls=self.target[1:])
+        self.assertFalse(adam.f_is_full)
+        calls = count_validations(adam)
+        adam.optimize()
+        # initial record, steps 0, 3, 6, 9
+        self.assertEqual(len(calls), 5)
+        self.assertIn(adam.best_i, [0, 3, 6, 9])
+
+        # mini-batches never reuse f
+        adam = AdamThicknessOptimizer(
+            f, self.target, 10, batch_size_spec=1)
+        self.assertEqual(adam.batch_size_spec, 1)
+        self.assertFalse(adam.f_is_full)
+
+    def test_patience_counts_validations(self):
+        f = TwoMaterialFilm('TiO2', 'SiO2', 'BK7', d_true)
+        # at the optimum: no improvement after the initial parameters
+        adam = AdamThicknessOptimizer(
+            f, self.target, 100, patience=2, validate_every=5)
+        adam.optimize()
+        self.assertEqual(adam.best_i, -1)
+        self.assertEqual(adam.i, 10)
+        np.testing.assert_allclose(f.get_d(), d_true)
+
+
+if __name__ == '__main__':
+    unittest.main()